@@ -1,31 +1,42 @@
-import pandas as pd
-import numpy as np
+import argparse
+import analysis_engine
+import raw_data
+import sketches
 
 
-# 1 Display Pull Request with min/avg/max time between open and merge
-pulls = pd.read_csv("analysis/python/raw/git_pullrequest.csv", parse_dates=["created_at", "merged_at", "closed_at"])
-pulls = pulls[
-            ~np.isnat(pulls["merged_at"]) & ~np.isnat(pulls["merged_at"])
-        ].loc[:, ["id", "repository_id", "created_at", "merged_at"]]
-
-pulls["diff"] = pulls["merged_at"] - pulls["created_at"]
-d = pulls["diff"].describe()
-print("Minimum / Average /  Maximum time between Pull Request open and merge: \n" + str(d[["min", "mean", "max"]]))
-
-# 2. Top 3 frequently changed files for each repository
-pull_files = pd.read_csv("analysis/python/raw/git_pullrequest_file.csv")
-repositories = pd.read_csv("analysis/python/raw/git_repository.csv")
-
-pulls_repo = pulls.add_suffix("_pulls")\
-     .merge(repositories.add_suffix("_repo"), left_on="repository_id_pulls", right_on="id_repo", sort=False)
-
-files_pulls_repo = pull_files.add_suffix("_files").merge(pulls_repo, left_on="pull_id_files", right_on="id_pulls")
-files_pulls_repo["cnt"] = 1
-x = files_pulls_repo.loc[:, ["full_name_repo", "filename_files", "cnt"]]\
-    .groupby(["full_name_repo", "filename_files"], sort=False).count()
-
-x["rank"] = x.groupby(["full_name_repo"])["cnt"].rank(ascending=False)
-print(x.loc[x["rank"] <= 3.0].sort_values(by=["full_name_repo", "rank"]))
+SKETCHES_STATE = "analysis/python/sketches/state.json"
 
+parser = argparse.ArgumentParser(description="Merge time and top changed files of pull requests")
+parser.add_argument("--approximate", action="store_true",
+                    help="answer from Space-Saving and KLL sketches with fixed memory, updated incrementally")
+parser.add_argument("--state", default=SKETCHES_STATE, help="sketches state file of approximate mode")
+parser.add_argument("--capacity", type=int, default=100, help="files counters per repository in approximate mode")
+args, _ = parser.parse_known_args()
 
 
+# 1 Display Pull Request with min/avg/max time between open and merge
+pulls = raw_data.read_table("git_pullrequest", columns=["id", "repository_id", "created_at", "merged_at"])
+merged = analysis_engine.merged_pulls(pulls)
+del pulls
+
+d = analysis_engine.merge_time_stats(merged)
+print("Minimum / Average /  Maximum time between Pull Request open and merge: \n" + str(d))
+
+repositories = raw_data.read_table("git_repository", columns=["id", "full_name"])
+files_chunks = raw_data.read_table_chunks("git_pullrequest_file", columns=["pull_id", "filename"])
+
+if args.approximate:
+    # only pulls merged since the previous run are added to the saved sketches
+    state = sketches.RepositorySketches.load(args.state, capacity=args.capacity)
+    new_merged = state.new_merged(merged)
+    state.add_merged(new_merged)
+    pull_repository = analysis_engine.pull_repository_map(new_merged)
+    for chunk in files_chunks:
+        state.add_files(chunk, pull_repository)
+    state.save(args.state)
+
+    print("Time between Pull Request open and merge percentiles: \n" + str(state.merge_time_quantiles()))
+    print(state.top_files(repositories, k=3))
+else:
+    # 2. Top 3 frequently changed files for each repository, files table is processed in chunks
+    print(analysis_engine.top_files(files_chunks, merged, repositories, k=3))
@@ -1,62 +1,138 @@
-import pandas as pd
-import numpy as np
+import os
+import shutil
+import sys
 import json
+import numpy as np
+import pandas as pd
+import analysis_engine
+import raw_data
+import sketches
 
 
 CONNECTIONS_CONFIG = "config/connections_config_local.json"
+PARTITIONS_DIR = "analysis/python/partitions"
+SKETCHES_STATE = "analysis/python/sketches/state.json"
 
 with open(CONNECTIONS_CONFIG) as f:
     conn_cfg = json.load(f)
 
 cluster_machines = conn_cfg["machines_cluster"]
+# a few buckets per machine, so a slow node does not hold the whole run
+buckets_count = conn_cfg.get("analysis_buckets", 4 * len(cluster_machines))
+
+
+def partition_files(merged, outdir, buckets):
+    """
+    One pass over files table: files of merged pulls are written to per-bucket files by hash of
+    repository_id, so every repository is located in exactly one bucket.
+    """
+    if os.path.isdir(outdir):
+        shutil.rmtree(outdir)
+    os.makedirs(outdir)
+
+    pull_repository = analysis_engine.pull_repository_map(merged)
+    paths = {}
+    for chunk in raw_data.read_table_chunks("git_pullrequest_file", columns=["pull_id", "filename"]):
+        repository_ids = pull_repository.reindex(chunk["pull_id"].to_numpy()).to_numpy()
+        known = ~np.isnan(repository_ids)
+        part = pd.DataFrame({"repository_id": repository_ids[known].astype(np.int64),
+                             "filename": chunk["filename"].to_numpy()[known]})
+
+        for bucket, rows in part.groupby(part["repository_id"] % buckets, sort=False):
+            path = os.path.join(outdir, "bucket_" + str(bucket) + ".csv")
+            rows.to_csv(path, mode="a", header=bucket not in paths, index=False)
+            paths[bucket] = path
+
+    return paths
+
+
+def analyze_partition(path, k):
+    # executed on dispy node, partition file is transferred to the node working directory
+    import os
+    import socket
+    import pandas as pd
 
-# load and build the same data as in single machine case
-repositories = pd.read_csv("analysis/python/raw/git_repository.csv")
-pulls = pd.read_csv("analysis/python/raw/git_pullrequest.csv",
-                    parse_dates=["created_at", "merged_at", "closed_at"])
-pull_files = pd.read_csv("analysis/python/raw/git_pullrequest_file.csv")
-
-pulls = pulls[
-            ~np.isnat(pulls["merged_at"]) & ~np.isnat(pulls["merged_at"])
-        ].loc[:, ["id", "repository_id", "created_at", "merged_at"]]
+    files = pd.read_csv(os.path.basename(path))
+    counts = files.groupby(["repository_id", "filename"], sort=False).size().rename("cnt").reset_index()
+    counts["rank"] = counts.groupby("repository_id")["cnt"].rank(method="min", ascending=False)
 
-pulls["diff"] = pulls["merged_at"] - pulls["created_at"]
+    return socket.gethostname(), counts[counts["rank"] <= k]
 
 
-def analyze_data(data):
+def sketch_partition(path, capacity):
+    # executed on dispy node: Space-Saving sketches of the partition, serialized to be merged by the client
+    import os
     import socket
-    data["cnt"] = 1
-    x = data.loc[:, ["repo_name", "filename", "cnt"]] \
-        .groupby(["repo_name", "filename"], sort=False).count()
-    x["rank"] = x.groupby(["repo_name"])["cnt"].rank(ascending=False)
-    most_used_files = x.loc[x["rank"] <= 3.0].sort_values(by=["repo_name", "rank"])
+    import pandas as pd
+    import sketches
+
+    files = pd.read_csv(os.path.basename(path))
+    state = sketches.RepositorySketches(capacity)
+    state.add_counts(files.groupby(["repository_id", "filename"], sort=False).size())
 
-    return socket.gethostname(), most_used_files
+    return socket.gethostname(), state.to_dict()
 
 
 if __name__ == '__main__':
     import dispy
-    cluster = dispy.JobCluster(analyze_data, nodes=cluster_machines)
-    jobs = []
 
-    jobs_count = len(repositories.index)
+    pulls = raw_data.read_table("git_pullrequest", columns=["id", "repository_id", "created_at", "merged_at"])
+    merged = analysis_engine.merged_pulls(pulls)
+    del pulls
+
+    d = analysis_engine.merge_time_stats(merged)
+    print("Minimum / Average /  Maximum time between Pull Request open and merge: \n" + str(d))
+
+    if "--approximate" in sys.argv:
+        # files of pulls merged since the previous run are sketched on the nodes, sketches are merged into the state
+        state = sketches.RepositorySketches.load(SKETCHES_STATE)
+        new_merged = state.new_merged(merged)
+        state.add_merged(new_merged)
+        partitions = partition_files(new_merged, PARTITIONS_DIR, buckets_count)
+
+        cluster = dispy.JobCluster(sketch_partition, nodes=cluster_machines, depends=[sketches])
+        jobs = []
+        for bucket, path in partitions.items():
+            job = cluster.submit(path, state.capacity, dispy_job_depends=[path])
+            job.id = bucket
+            jobs.append(job)
 
-    for indx in repositories.index:
+        for job in jobs:
+            host, res = job()
+            print('%s executed job %s at %s with %s repositories' % (host, job.id, job.start_time, len(res["files"])))
+            state.merge(sketches.RepositorySketches.from_dict(res))
+        state.save(SKETCHES_STATE)
 
-        repo = repositories.loc[indx, ["id", "full_name"]]
-        one_repo_pulls = pulls[pulls["repository_id"] == repo["id"]]
-        one_repo_files = pull_files[pull_files["pull_id"].isin(one_repo_pulls["id"])]
-        one_repo_files.loc[:, "repo_id"] = repo["id"]
-        one_repo_files.loc[:, "repo_name"] = repo["full_name"]
+        repositories = raw_data.read_table("git_repository", columns=["id", "full_name"])
+        print("Time between Pull Request open and merge percentiles: \n" + str(state.merge_time_quantiles()))
+        print(state.top_files(repositories, k=3))
 
-        job = cluster.submit(one_repo_files)
-        job.id = indx
+        cluster.print_status()
+        cluster.close()
+        sys.exit(0)
+
+    partitions = partition_files(merged, PARTITIONS_DIR, buckets_count)
+
+    cluster = dispy.JobCluster(analyze_partition, nodes=cluster_machines)
+    jobs = []
+    for bucket, path in partitions.items():
+        job = cluster.submit(path, 3, dispy_job_depends=[path])
+        job.id = bucket
         jobs.append(job)
 
+    results = []
     for job in jobs:
         # waits for job to finish and returns results
         host, res = job()
-        print('%s executed job %s at %s with %s' % (host, job.id, job.start_time, res))
+        print('%s executed job %s at %s with %s rows' % (host, job.id, job.start_time, len(res)))
+        results.append(res)
+
+    # repositories do not span buckets, so partial results are final per repository
+    repositories = raw_data.read_table("git_repository", columns=["id", "full_name"])
+    names = pd.Series(repositories["full_name"].to_numpy(), index=repositories["id"].to_numpy())
+    top = pd.concat(results, ignore_index=True)
+    top["repository"] = pd.Categorical(names.reindex(top["repository_id"].to_numpy()).to_numpy())
+    print(top.sort_values(by=["repository", "rank"]).set_index(["repository", "filename"])[["cnt", "rank"]])
 
     cluster.print_status()
     cluster.close()
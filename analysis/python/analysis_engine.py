@@ -0,0 +1,112 @@
+import numpy as np
+import pandas as pd
+
+
+# repository ids and filename codes are packed into one int64 key: repository_id << 32 | filename code
+KEY_SHIFT = 32
+KEY_MASK = (1 << KEY_SHIFT) - 1
+
+
+def merged_pulls(pulls):
+    """
+    Merged pull requests with time between open and merge in "diff" column.
+    """
+    merged = pulls.loc[pulls["merged_at"].notna(), ["id", "repository_id", "created_at", "merged_at"]]
+    return merged.assign(diff=merged["merged_at"] - merged["created_at"])
+
+
+def merge_time_stats(merged):
+    """
+    Minimum / average / maximum time between pull request open and merge.
+    """
+    return merged["diff"].agg(["min", "mean", "max"])
+
+
+class FilenameVocabulary:
+    """
+    Integer codes for file names, shared by all chunks of the files table.
+    """
+
+    def __init__(self):
+        self._index = pd.Index([], dtype=object)
+
+    def encode(self, filenames):
+        codes = self._index.get_indexer(filenames)
+        unknown = codes < 0
+        if unknown.any():
+            self._index = self._index.append(pd.Index(pd.unique(filenames[unknown])))
+            codes = self._index.get_indexer(filenames)
+        return codes
+
+    def decode(self, codes):
+        return self._index.take(codes)
+
+
+class FileCounter:
+    """
+    Changes count per (repository, filename) accumulated over chunks of the files table.
+
+    Every chunk is reduced to value_counts over packed integer keys, partial counts are consolidated
+    when too many of them are collected, so memory depends on the number of distinct (repository, file)
+    pairs and not on the size of the files table.
+    """
+
+    def __init__(self, pull_repository, consolidate_every=16):
+        self.pull_repository = pull_repository
+        self.vocabulary = FilenameVocabulary()
+        self._partials = []
+        self._consolidate_every = consolidate_every
+
+    def add_chunk(self, files):
+        # single join pull_id -> repository_id, files of not merged pulls are dropped
+        repository_ids = self.pull_repository.reindex(files["pull_id"].to_numpy()).to_numpy()
+        known = ~np.isnan(repository_ids)
+        if not known.any():
+            return
+
+        codes = self.vocabulary.encode(files["filename"].to_numpy()[known])
+        keys = (repository_ids[known].astype(np.int64) << KEY_SHIFT) | codes.astype(np.int64)
+        self._partials.append(pd.Series(keys).value_counts(sort=False))
+
+        if len(self._partials) >= self._consolidate_every:
+            self._partials = [self.counts()]
+
+    def counts(self):
+        if not self._partials:
+            return pd.Series([], dtype=np.int64)
+        return pd.concat(self._partials).groupby(level=0, sort=False).sum()
+
+    def top(self, k=3):
+        """
+        Top k files per repository, ties at the last place are kept as rank() in SQL analysis does.
+        """
+        counts = self.counts()
+        keys = counts.index.to_numpy()
+        result = pd.DataFrame({
+            "repository_id": keys >> KEY_SHIFT,
+            "file_code": keys & KEY_MASK,
+            "cnt": counts.to_numpy()
+        })
+        result["rank"] = result.groupby("repository_id")["cnt"].rank(method="min", ascending=False)
+        result = result[result["rank"] <= k]
+        result["filename"] = self.vocabulary.decode(result["file_code"].to_numpy())
+        return result.drop(columns="file_code")
+
+
+def pull_repository_map(merged):
+    return pd.Series(merged["repository_id"].to_numpy(dtype=np.float64), index=merged["id"].to_numpy())
+
+
+def top_files(files_chunks, merged, repositories, k=3):
+    """
+    Top k most often changed files per repository in merged pull requests.
+    files_chunks: iterable of DataFrames with pull_id and filename columns.
+    """
+    counter = FileCounter(pull_repository_map(merged))
+    for chunk in files_chunks:
+        counter.add_chunk(chunk)
+
+    top = counter.top(k)
+    names = pd.Series(repositories["full_name"].to_numpy(), index=repositories["id"].to_numpy())
+    top["repository"] = pd.Categorical(names.reindex(top["repository_id"].to_numpy()).to_numpy())
+    return top.sort_values(by=["repository", "rank"]).set_index(["repository", "filename"])[["cnt", "rank"]]
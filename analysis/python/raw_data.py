@@ -0,0 +1,73 @@
+import os
+import pandas as pd
+
+try:
+    import pyarrow.dataset as ds
+except ImportError:
+    ds = None
+
+
+RAW_DIR = "analysis/python/raw"
+
+DATE_COLUMNS = {
+    "git_pullrequest": ["created_at", "updated_at", "merged_at", "closed_at"]
+}
+
+
+def _parquet_path(name, raw_dir):
+    dataset = os.path.join(raw_dir, name)
+    if os.path.isdir(dataset):
+        return dataset
+    if os.path.isfile(dataset + ".parquet"):
+        return dataset + ".parquet"
+    return None
+
+
+def _csv_path(name, raw_dir):
+    csv_file = os.path.join(raw_dir, name + ".csv")
+    if not os.path.isfile(csv_file):
+        csv_file += ".gz"
+    return csv_file
+
+
+def read_table(name, columns=None, repository_ids=None, raw_dir=RAW_DIR):
+    """
+    Read exported table, Parquet export is preferred over CSV when both are present.
+
+    Parquet export (see GitHubLoader.dump_to_file) is typed and partitioned by repository_id,
+    so only requested columns and repository partitions are read. CSV fallback parses dates
+    of the requested columns only.
+    """
+    parquet_path = _parquet_path(name, raw_dir)
+    if parquet_path:
+        filters = None
+        if repository_ids is not None:
+            filters = [("repository_id", "in", list(repository_ids))]
+        data = pd.read_parquet(parquet_path, columns=columns, filters=filters)
+        if "repository_id" in data.columns:
+            # hive partition key is read as category
+            data["repository_id"] = data["repository_id"].astype("int64")
+        return data
+
+    parse_dates = [c for c in DATE_COLUMNS.get(name, []) if columns is None or c in columns]
+    data = pd.read_csv(_csv_path(name, raw_dir), usecols=columns, parse_dates=parse_dates)
+    if repository_ids is not None and "repository_id" in data.columns:
+        data = data[data["repository_id"].isin(repository_ids)]
+    return data
+
+
+def read_table_chunks(name, columns=None, chunksize=1000000, raw_dir=RAW_DIR):
+    """
+    Iterate over exported table by DataFrame chunks of at most chunksize rows,
+    for tables which do not fit in memory.
+    """
+    parquet_path = _parquet_path(name, raw_dir)
+    if parquet_path and ds is not None:
+        dataset = ds.dataset(parquet_path, format="parquet", partitioning="hive")
+        for batch in dataset.to_batches(columns=columns, batch_size=chunksize):
+            yield batch.to_pandas()
+        return
+
+    parse_dates = [c for c in DATE_COLUMNS.get(name, []) if columns is None or c in columns]
+    for chunk in pd.read_csv(_csv_path(name, raw_dir), usecols=columns, parse_dates=parse_dates, chunksize=chunksize):
+        yield chunk
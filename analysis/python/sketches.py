@@ -0,0 +1,268 @@
+import json
+import math
+import os
+import random
+import numpy as np
+import pandas as pd
+
+
+class SpaceSaving:
+    """
+    Space-Saving heavy hitters sketch: at most `capacity` counters, every item with frequency above
+    n / capacity is kept. Counts are overestimated by at most the `error` of the counter.
+
+    Updates are weighted, so chunks can be reduced with value_counts first. Sketches built on
+    different parts of the data are merged with `merge` (Agarwal et al. mergeable summaries).
+    """
+
+    def __init__(self, capacity=100):
+        self.capacity = capacity
+        self.counters = {}
+
+    def _min_count(self):
+        if len(self.counters) < self.capacity:
+            return 0
+        return min(c[0] for c in self.counters.values())
+
+    def update(self, item, count=1):
+        counter = self.counters.get(item)
+        if counter is not None:
+            counter[0] += count
+        elif len(self.counters) < self.capacity:
+            self.counters[item] = [count, 0]
+        else:
+            victim = min(self.counters, key=lambda k: self.counters[k][0])
+            floor = self.counters.pop(victim)[0]
+            self.counters[item] = [floor + count, floor]
+
+    def update_counts(self, counts):
+        # biggest counts first, so frequent items are not evicted by the tail of the chunk
+        for item, count in sorted(counts.items(), key=lambda kv: -kv[1]):
+            self.update(item, int(count))
+
+    def merge(self, other):
+        floor, other_floor = self._min_count(), other._min_count()
+        merged = {}
+        for item in set(self.counters) | set(other.counters):
+            count, error = self.counters.get(item, (floor, floor))
+            other_count, other_error = other.counters.get(item, (other_floor, other_floor))
+            merged[item] = [count + other_count, error + other_error]
+
+        capacity = max(self.capacity, other.capacity)
+        if len(merged) > capacity:
+            merged = dict(sorted(merged.items(), key=lambda kv: -kv[1][0])[:capacity])
+        self.capacity = capacity
+        self.counters = merged
+        return self
+
+    def top(self, k):
+        """(item, count, error) of k items with the biggest counts."""
+        return [(item, c[0], c[1]) for item, c in sorted(self.counters.items(), key=lambda kv: -kv[1][0])[:k]]
+
+    def to_dict(self):
+        return {"capacity": self.capacity, "counters": [[item, c[0], c[1]] for item, c in self.counters.items()]}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data["capacity"])
+        sketch.counters = {item: [count, error] for item, count, error in data["counters"]}
+        return sketch
+
+
+class KLLSketch:
+    """
+    KLL quantiles sketch (Karnin, Lang, Liberty): a hierarchy of compactors, items of level h have
+    weight 2^h. Memory is O(k) items and rank error is about 1.7 / k for any number of values.
+    Sketches are merged with `merge`, so they can be built on parts of the data and combined.
+    """
+
+    def __init__(self, k=200, seed=None):
+        self.k = k
+        self.n = 0
+        self.compactors = [[]]
+        self._random = random.Random(seed)
+
+    def _capacity(self, level):
+        depth = len(self.compactors) - level - 1
+        return int(math.ceil(self.k * (2.0 / 3.0) ** depth)) + 1
+
+    def _size(self):
+        return sum(len(c) for c in self.compactors)
+
+    def _max_size(self):
+        return sum(self._capacity(level) for level in range(len(self.compactors)))
+
+    def _compress(self):
+        while self._size() >= self._max_size():
+            for level in range(len(self.compactors)):
+                if len(self.compactors[level]) >= self._capacity(level):
+                    if level + 1 == len(self.compactors):
+                        self.compactors.append([])
+                    items = sorted(self.compactors[level])
+                    # odd item stays on its level, half of the rest goes one level up with double weight
+                    rest = [items.pop()] if len(items) % 2 else []
+                    self.compactors[level + 1].extend(items[self._random.randint(0, 1)::2])
+                    self.compactors[level] = rest
+                    break
+
+    def update(self, value):
+        self.compactors[0].append(value)
+        self.n += 1
+        self._compress()
+
+    def update_many(self, values):
+        values = [float(v) for v in values]
+        step = self.k
+        for start in range(0, len(values), step):
+            self.compactors[0].extend(values[start:start + step])
+            self._compress()
+        self.n += len(values)
+
+    def merge(self, other):
+        while len(self.compactors) < len(other.compactors):
+            self.compactors.append([])
+        for level, items in enumerate(other.compactors):
+            self.compactors[level].extend(items)
+        self.n += other.n
+        self._compress()
+        return self
+
+    def quantiles(self, qs):
+        weighted = sorted((v, 2 ** level) for level, items in enumerate(self.compactors) for v in items)
+        if not weighted:
+            return [float("nan")] * len(qs)
+
+        values = np.array([v for v, _ in weighted])
+        ranks = np.cumsum([w for _, w in weighted])
+        return [float(values[min(np.searchsorted(ranks, q * ranks[-1]), len(values) - 1)]) for q in qs]
+
+    def quantile(self, q):
+        return self.quantiles([q])[0]
+
+    def to_dict(self):
+        return {"k": self.k, "n": self.n, "compactors": self.compactors}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data["k"])
+        sketch.n = data["n"]
+        sketch.compactors = [list(c) for c in data["compactors"]]
+        return sketch
+
+
+class RepositorySketches:
+    """
+    Approximate analysis state with fixed memory: per repository a SpaceSaving sketch of changed files
+    and a KLLSketch of merge times (seconds) of merged pull requests.
+
+    The state is saved as JSON with the latest merged_at seen. The next run adds only pulls merged after
+    it, so the sketches are updated incrementally after every crawl; pulls merged earlier but crawled
+    later are not counted until the state is rebuilt (delete the state file).
+    """
+
+    def __init__(self, capacity=100, k=200):
+        self.capacity = capacity
+        self.k = k
+        self.files = {}
+        self.merge_times = {}
+        self.merged_before = None
+
+    def new_merged(self, merged):
+        """Merged pulls (analysis_engine.merged_pulls) which are not in the sketches yet."""
+        if self.merged_before is None:
+            return merged
+        return merged[merged["merged_at"] > pd.Timestamp(self.merged_before)]
+
+    def add_merged(self, merged):
+        for repository_id, diffs in merged.groupby("repository_id", sort=False)["diff"]:
+            sketch = self.merge_times.setdefault(int(repository_id), KLLSketch(self.k))
+            sketch.update_many(diffs.dt.total_seconds().to_numpy())
+        if len(merged):
+            latest = merged["merged_at"].max()
+            if self.merged_before is None or latest > pd.Timestamp(self.merged_before):
+                self.merged_before = latest.isoformat()
+
+    def add_files(self, files, pull_repository):
+        """files: DataFrame with pull_id and filename, pull_repository: analysis_engine.pull_repository_map."""
+        repository_ids = pull_repository.reindex(files["pull_id"].to_numpy()).to_numpy()
+        known = ~np.isnan(repository_ids)
+        if not known.any():
+            return
+
+        part = pd.DataFrame({"repository_id": repository_ids[known].astype(np.int64),
+                             "filename": files["filename"].to_numpy()[known]})
+        self.add_counts(part.groupby(["repository_id", "filename"], sort=False).size())
+
+    def add_counts(self, counts):
+        """counts: Series of changes count indexed by (repository_id, filename)."""
+        for repository_id, repository_counts in counts.groupby(level=0, sort=False):
+            sketch = self.files.setdefault(int(repository_id), SpaceSaving(self.capacity))
+            sketch.update_counts(repository_counts.droplevel(0).to_dict())
+
+    def merge(self, other):
+        for repository_id, sketch in other.files.items():
+            if repository_id in self.files:
+                self.files[repository_id].merge(sketch)
+            else:
+                self.files[repository_id] = sketch
+        for repository_id, sketch in other.merge_times.items():
+            if repository_id in self.merge_times:
+                self.merge_times[repository_id].merge(sketch)
+            else:
+                self.merge_times[repository_id] = sketch
+        if other.merged_before is not None and (self.merged_before is None or
+                                                other.merged_before > self.merged_before):
+            self.merged_before = other.merged_before
+        return self
+
+    def merge_time_quantiles(self, qs=(0.5, 0.9, 0.99)):
+        """Merge time quantiles per repository and over all repositories ("*" row)."""
+        rows = {}
+        total = KLLSketch(self.k)
+        for repository_id, sketch in self.merge_times.items():
+            rows[repository_id] = sketch.quantiles(qs)
+            total.merge(KLLSketch.from_dict(sketch.to_dict()))
+        rows["*"] = total.quantiles(qs)
+
+        result = pd.DataFrame.from_dict(rows, orient="index", columns=["p" + str(round(q * 100)) for q in qs])
+        return result.apply(lambda column: pd.to_timedelta(column, unit="s"))
+
+    def top_files(self, repositories, k=3):
+        """Top k files per repository with estimated count and its maximal overestimation."""
+        names = pd.Series(repositories["full_name"].to_numpy(), index=repositories["id"].to_numpy())
+        rows = []
+        for repository_id, sketch in self.files.items():
+            for rank, (filename, count, error) in enumerate(sketch.top(k), 1):
+                rows.append((names.get(repository_id, repository_id), filename, count, error, rank))
+
+        top = pd.DataFrame(rows, columns=["repository", "filename", "cnt", "error", "rank"])
+        return top.sort_values(by=["repository", "rank"]).set_index(["repository", "filename"])
+
+    def to_dict(self):
+        return {"capacity": self.capacity, "k": self.k, "merged_before": self.merged_before,
+                "files": {str(r): s.to_dict() for r, s in self.files.items()},
+                "merge_times": {str(r): s.to_dict() for r, s in self.merge_times.items()}}
+
+    @classmethod
+    def from_dict(cls, data):
+        state = cls(data["capacity"], data["k"])
+        state.merged_before = data["merged_before"]
+        state.files = {int(r): SpaceSaving.from_dict(s) for r, s in data["files"].items()}
+        state.merge_times = {int(r): KLLSketch.from_dict(s) for r, s in data["merge_times"].items()}
+        return state
+
+    def save(self, path):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.to_dict(), f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, capacity=100, k=200):
+        """Saved state or an empty one when there is no state file."""
+        if not os.path.isfile(path):
+            return cls(capacity, k)
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
@@ -0,0 +1,86 @@
+"""
+Merge time and top changed files answered from summary tables, which GitHubLoader keeps up to date
+during the crawl (git_merge_time_summary, git_file_change_summary). Pull requests and files tables
+are not read, so answers do not slow down as the history grows.
+
+    python analysis/python/summary_analysis.py [--db-url sqlite:///git_pullrequests.db] [--top 3]
+"""
+import argparse
+import json
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+
+CONNECTIONS_CONFIG = "config/connections_config_local.json"
+GITHUB_LOADER_CONFIG = "config/github_monitor_config.json"
+
+MERGE_TIME_QUERY = """
+    select r.full_name repository, s.merged_count, s.merge_seconds_sum, s.merge_seconds_min, s.merge_seconds_max
+    from git_merge_time_summary s join git_repository r on r.id = s.repository_id
+"""
+
+TOP_FILES_QUERY = """
+    select * from (
+        select r.full_name repository, s.filename, s.change_count cnt,
+               rank() over (partition by s.repository_id order by s.change_count desc) use_rank
+        from git_file_change_summary s join git_repository r on r.id = s.repository_id
+    ) tt where use_rank <= :k
+"""
+
+
+def database_url():
+    # the same database as pull_monitor.py
+    with open(GITHUB_LOADER_CONFIG) as f:
+        loader_cfg = json.load(f)
+    if loader_cfg["db_provider"] != "Oracle":
+        return "sqlite:///git_pullrequests.db"
+
+    with open(CONNECTIONS_CONFIG) as f:
+        db = json.load(f)["db"]
+    return "oracle+cx_oracle://{username}:{password}@{host}:{port}/?service_name={service}".format(**db)
+
+
+def read_query(engine, query, **params):
+    with engine.connect() as connection:
+        result = connection.execute(text(query), **params)
+        return pd.DataFrame(result.fetchall(), columns=list(result.keys()))
+
+
+def merge_time_by_repository(engine):
+    stats = read_query(engine, MERGE_TIME_QUERY)
+    return stats.assign(
+        min=pd.to_timedelta(stats["merge_seconds_min"], unit="s"),
+        mean=pd.to_timedelta(stats["merge_seconds_sum"] / stats["merged_count"], unit="s"),
+        max=pd.to_timedelta(stats["merge_seconds_max"], unit="s")
+    ).set_index("repository")[["merged_count", "min", "mean", "max"]]
+
+
+def merge_time_stats(by_repository):
+    """
+    Minimum / average / maximum time between pull request open and merge over all repositories,
+    same as analysis_engine.merge_time_stats.
+    """
+    merged_count = by_repository["merged_count"].sum()
+    mean = (by_repository["mean"] * by_repository["merged_count"]).sum() / merged_count if merged_count else pd.NaT
+    return pd.Series([by_repository["min"].min(), mean, by_repository["max"].max()], index=["min", "mean", "max"])
+
+
+def top_files(engine, k=3):
+    """Top k most often changed files per repository in merged pull requests, ties are kept as rank() does."""
+    top = read_query(engine, TOP_FILES_QUERY, k=k).rename(columns={"use_rank": "rank"})
+    return top.sort_values(by=["repository", "rank"]).set_index(["repository", "filename"])[["cnt", "rank"]]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge time and top files from summary tables")
+    parser.add_argument("--db-url", help="SQLAlchemy database URL, by default the database of pull_monitor.py")
+    parser.add_argument("--top", type=int, default=3, help="files per repository")
+    args = parser.parse_args()
+
+    db_engine = create_engine(args.db_url or database_url())
+
+    by_repository = merge_time_by_repository(db_engine)
+    print("Minimum / Average /  Maximum time between Pull Request open and merge: \n" +
+          str(merge_time_stats(by_repository)))
+    print(by_repository)
+    print(top_files(db_engine, args.top))
@@ -23,4 +23,14 @@ select * from (
         where r.id = pr.repository_id and pr.id = prf.pull_id
         and merged_at is not null and closed_at is not null
         group by filename, full_name ) tt
-) where use_rank <= 3;
\ No newline at end of file
+) where use_rank <= 3;
+
+-- the same on integer keys: files are grouped by path_id, names are looked up for the top rows only
+select r.full_name repository, p.filename, tt.use_count, tt.use_rank from (
+    select pr.repository_id, prf.path_id, count(*) use_count,
+           rank() over (partition by pr.repository_id order by count(*) desc) use_rank
+        from git_pull_file prf, git_pullrequest pr
+        where pr.id = prf.pull_id
+        and merged_at is not null and closed_at is not null
+        group by pr.repository_id, prf.path_id ) tt, git_file_path p, git_repository r
+where p.id = tt.path_id and r.id = tt.repository_id and tt.use_rank <= 3;
@@ -0,0 +1,23 @@
+-- the same answers as analysis_1.sql, read from summary tables maintained by GitHubLoader
+
+-- min / avg / max time to merge pullrequest (minutes / hours / days)
+select round(min(merge_seconds_min) / 60, 3) min_merged_time,
+       round(sum(merge_seconds_sum) / sum(merged_count) / 3600, 2) avg_merged_time,
+       round(max(merge_seconds_max) / 86400, 2) max_merged_time
+    from git_merge_time_summary;
+
+-- min / avg / max time to merge pullrequest for each repository (hours)
+select r.full_name repository, s.merged_count,
+       round(s.merge_seconds_min / 3600, 2) min_merged_time,
+       round(s.merge_seconds_sum / s.merged_count / 3600, 2) avg_merged_time,
+       round(s.merge_seconds_max / 3600, 2) max_merged_time
+    from git_merge_time_summary s, git_repository r
+    where r.id = s.repository_id;
+
+-- top 3 changed files in pull requests for each repository
+select * from (
+    select r.full_name repository, s.filename, s.change_count use_count,
+           rank() over (partition by s.repository_id order by s.change_count desc) use_rank
+        from git_file_change_summary s, git_repository r
+        where r.id = s.repository_id
+) where use_rank <= 3;
@@ -0,0 +1,278 @@
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+class FakeGitHub:
+    """
+    Synthetic GitHub REST API: repositories, pull requests and pull request files.
+    POST /graphql answers the pull requests and files queries of graphql_walker.
+
+    Every repository "<owner>/repo<N>" has the same number of pulls, files count of a pull is drawn
+    from [0, 2 * files_per_pull] by a generator seeded with the pull id, so data is the same on every
+    run. Responses are paginated with per_page/page and Link headers, carry X-RateLimit-* headers
+    and ETag (If-None-Match is answered with 304). Latency and 5xx errors can be injected.
+    """
+
+    def __init__(self, pulls=1000, files_per_pull=5, latency_ms=0, error_rate=0.0, rate_limit=10 ** 7, seed=42):
+        self.pulls = pulls
+        self.files_per_pull = files_per_pull
+        self.latency = latency_ms / 1000.0
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.remaining = rate_limit
+        self.reset_at = int(time.time()) + 3600
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "errors": 0, "not_modified": 0, "bytes": 0}
+
+    @staticmethod
+    def repository_id(full_name):
+        return zlib.crc32(full_name.encode("utf-8")) % 10000 + 1
+
+    def repository(self, full_name):
+        owner, name = full_name.split("/")
+        repository_id = self.repository_id(full_name)
+        return {"id": repository_id, "full_name": full_name, "html_url": "https://github.com/" + full_name,
+                "description": "Synthetic repository " + name, "private": False,
+                "owner": self.user(zlib.crc32(owner.encode("utf-8")) % 100000, owner, "Organization")}
+
+    @staticmethod
+    def user(user_id, login=None, user_type="User"):
+        login = login or "user" + str(user_id)
+        return {"id": user_id, "login": login, "html_url": "https://github.com/" + login, "type": user_type}
+
+    def pull(self, full_name, number):
+        pull_id = self.repository_id(full_name) * 100000 + number
+        created = time.gmtime(1577836800 + number * 3600)
+        updated = time.gmtime(1577836800 + number * 3600 + 86400)
+        merged = number % 3 != 0
+        return {
+            "id": pull_id,
+            "number": number,
+            "url": "https://api.github.com/repos/%s/pulls/%d" % (full_name, number),
+            "state": "closed" if number % 10 else "open",
+            "title": "Synthetic pull request %d" % number,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", created),
+            "updated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", updated),
+            "closed_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", updated) if number % 10 else None,
+            "merged_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", updated) if merged and number % 10 else None,
+            "merge_commit_sha": "%040x" % pull_id,
+            "user": self.user(number % 97 + 1),
+            "head": {"sha": "%040x" % (pull_id * 7)}
+        }
+
+    def files(self, full_name, number):
+        generator = random.Random(self.repository_id(full_name) * 100000 + number)
+        count = generator.randint(0, 2 * self.files_per_pull)
+        files = []
+        # file names are distinct within a pull and repeat across pulls, 20 modules of 50 files
+        for k in generator.sample(range(1000), min(count, 1000)):
+            filename = "src/module%d/file%d.py" % (k // 50, k % 50)
+            additions, deletions = generator.randint(0, 50), generator.randint(0, 50)
+            files.append({"sha": "%040x" % generator.getrandbits(160), "filename": filename,
+                          "status": "modified", "additions": additions, "deletions": deletions,
+                          "changes": additions + deletions,
+                          "contents_url": "https://api.github.com/repos/%s/contents/%s" % (full_name, filename)})
+        return files
+
+    def _graphql_files(self, full_name, number, first, after):
+        files = self.files(full_name, number)[:3000]
+        start = int(after or 0)
+        nodes = [{"path": f["filename"], "additions": f["additions"], "deletions": f["deletions"],
+                  "changeType": "MODIFIED"} for f in files[start:start + first]]
+        end = start + len(nodes)
+        return {"pageInfo": {"hasNextPage": end < len(files), "endCursor": str(end)}, "nodes": nodes}
+
+    def _graphql_pull(self, full_name, number, files):
+        pull = self.pull(full_name, number)
+        user = pull["user"]
+        return {
+            "databaseId": pull["id"], "number": number, "title": pull["title"],
+            "state": "MERGED" if pull["merged_at"] else pull["state"].upper(),
+            "createdAt": pull["created_at"], "updatedAt": pull["updated_at"], "mergedAt": pull["merged_at"],
+            "closedAt": pull["closed_at"], "headRefOid": pull["head"]["sha"],
+            "changedFiles": len(self.files(full_name, number)),
+            "mergeCommit": {"oid": pull["merge_commit_sha"]} if pull["merged_at"] else None,
+            "author": {"__typename": user["type"], "login": user["login"], "url": user["html_url"],
+                       "databaseId": user["id"]},
+            "files": self._graphql_files(full_name, number, files, None)
+        }
+
+    def graphql(self, variables):
+        """Data of the pulls query (cursors are offsets) or of the files query of a pull, when number is given."""
+        full_name = variables["owner"] + "/" + variables["name"]
+        if "number" in variables:
+            if not 0 < variables["number"] <= self.pulls:
+                return {"repository": {"pullRequest": None}}
+            files = self._graphql_files(full_name, variables["number"], variables["files"], variables["after"])
+            return {"repository": {"pullRequest": {"files": files}}}
+
+        # newest first, updated_at grows with the number, so both orders are the same
+        start = int(variables["after"] or 0)
+        numbers = range(self.pulls - start, max(self.pulls - start - variables["pulls"], 0), -1)
+        end = start + len(numbers)
+        return {"repository": {"pullRequests": {
+            "pageInfo": {"hasNextPage": end < self.pulls, "endCursor": str(end)},
+            "nodes": [self._graphql_pull(full_name, n, variables["files"]) for n in numbers]}}}
+
+    def take_budget(self):
+        with self._lock:
+            self.stats["requests"] += 1
+            if time.time() >= self.reset_at:
+                self.remaining = self.rate_limit
+                self.reset_at = int(time.time()) + 3600
+            self.remaining = max(self.remaining - 1, 0)
+            failed = self.error_rate > 0 and self._random.random() < self.error_rate
+            if failed:
+                self.stats["errors"] += 1
+        return failed
+
+
+class PullsView:
+    """Pulls of a repository built on slicing, so a page request does not build the whole list."""
+
+    def __init__(self, api, full_name, numbers):
+        self.api = api
+        self.full_name = full_name
+        self.numbers = numbers
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def __getitem__(self, index):
+        return [self.api.pull(self.full_name, n) for n in self.numbers[index]]
+
+
+def make_handler(api):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # headers and body are written separately, with Nagle algorithm keep-alive responses stall on delayed ACK
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status, body=None, headers=None):
+            data = json.dumps(body).encode("utf-8") if body is not None else b""
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.send_header("X-RateLimit-Limit", str(api.rate_limit))
+            self.send_header("X-RateLimit-Remaining", str(api.remaining))
+            self.send_header("X-RateLimit-Reset", str(api.reset_at))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+            with api._lock:
+                api.stats["bytes"] += len(data)
+
+        def _page(self, url, items, query):
+            per_page = min(int(query.get("per_page", 30)), 100)
+            page = int(query.get("page", 1))
+            body = items[(page - 1) * per_page: page * per_page]
+
+            headers = {"ETag": '"%08x"' % zlib.crc32(json.dumps(body).encode("utf-8"))}
+            last_page = max((len(items) + per_page - 1) // per_page, 1)
+            links = []
+            if page < last_page:
+                links.append('<%s?per_page=%d&page=%d>; rel="next"' % (url, per_page, page + 1))
+                links.append('<%s?per_page=%d&page=%d>; rel="last"' % (url, per_page, last_page))
+            if links:
+                headers["Link"] = ", ".join(links)
+
+            if self.headers.get("If-None-Match") == headers["ETag"]:
+                with api._lock:
+                    api.stats["not_modified"] += 1
+                return self._send(304, None, headers)
+            return self._send(200, body, headers)
+
+        def do_GET(self):
+            if api.latency:
+                time.sleep(api.latency)
+
+            url = urlparse(self.path)
+            query = {k: v[0] for k, v in parse_qs(url.query).items()}
+            if url.path == "/rate_limit":
+                # rate_limit endpoint is not counted against the budget
+                return self._send(200, {"resources": {"core": {"limit": api.rate_limit, "remaining": api.remaining,
+                                                               "reset": api.reset_at}}})
+
+            if api.take_budget():
+                return self._send(502, {"message": "Server Error"})
+
+            match = re.match(r"^/repos/([^/]+/[^/]+)$", url.path)
+            if match:
+                return self._send(200, api.repository(match.group(1)))
+
+            base = "http://" + self.headers.get("Host", "") + url.path
+            match = re.match(r"^/repos/([^/]+/[^/]+)/pulls$", url.path)
+            if match:
+                # newest first; updated_at grows with the number, so sort=updated gives the same order
+                numbers = range(api.pulls, 0, -1)
+                if query.get("direction") == "asc":
+                    numbers = range(1, api.pulls + 1)
+                return self._page(base, PullsView(api, match.group(1), numbers), query)
+
+            match = re.match(r"^/repos/([^/]+/[^/]+)/pulls/(\d+)/files$", url.path)
+            if match and 0 < int(match.group(2)) <= api.pulls:
+                # like GitHub, only the first 3000 files of a pull request are listed
+                return self._page(base, api.files(match.group(1), int(match.group(2)))[:3000], query)
+
+            match = re.match(r"^/repos/([^/]+/[^/]+)/pulls/(\d+)$", url.path)
+            if match and 0 < int(match.group(2)) <= api.pulls:
+                pull = api.pull(match.group(1), int(match.group(2)))
+                pull["changed_files"] = len(api.files(match.group(1), int(match.group(2))))
+                return self._send(200, pull)
+
+            return self._send(404, {"message": "Not Found"})
+
+        def do_POST(self):
+            if api.latency:
+                time.sleep(api.latency)
+
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if urlparse(self.path).path != "/graphql":
+                return self._send(404, {"message": "Not Found"})
+            if api.take_budget():
+                return self._send(502, {"message": "Server Error"})
+            return self._send(200, {"data": api.graphql(body.get("variables", {}))})
+
+    return Handler
+
+
+def start(api, host="127.0.0.1", port=0):
+    """Serves api in a daemon thread, returns the server, its URL is http://host:server.server_address[1]."""
+    server = ThreadingHTTPServer((host, port), make_handler(api))
+    server.daemon_threads = True
+    server.request_queue_size = 128
+    threading.Thread(target=server.serve_forever, name="fake-github", daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in of GitHub REST API for benchmarks")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--pulls", type=int, default=1000)
+    parser.add_argument("--files-per-pull", type=int, default=5)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit", type=int, default=10 ** 7)
+    args = parser.parse_args()
+
+    fake = FakeGitHub(args.pulls, args.files_per_pull, args.latency_ms, args.error_rate, args.rate_limit)
+    srv = start(fake, port=args.port)
+    print("Fake GitHub API is served on http://127.0.0.1:%d" % srv.server_address[1])
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        srv.shutdown()
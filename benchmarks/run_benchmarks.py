@@ -0,0 +1,210 @@
+"""
+End-to-end benchmark of crawl, export and analysis against the local fake GitHub API and SQLite.
+
+    python benchmarks/run_benchmarks.py --pulls 2000 --repositories 2 --crawl-mode pipeline
+
+Every stage runs in its own process, so peak RSS is measured per stage. Results are printed and
+written as JSON to benchmarks/results/ (or --output) to be compared between commits.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import runpy
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCHMARKS_DIR)
+MONITOR_DIR = os.path.join(ROOT_DIR, "pullrequest_monitor")
+ANALYSIS_DIR = os.path.join(ROOT_DIR, "analysis", "python")
+RAW_DIR = os.path.join("analysis", "python", "raw")
+
+
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def open_session(workdir):
+    sys.path.insert(0, MONITOR_DIR)
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    import schema
+
+    engine = create_engine("sqlite:///" + os.path.join(workdir, "benchmark.db"))
+    schema.migrate(engine)
+    return sessionmaker(bind=engine)()
+
+
+def stage_crawl(workdir):
+    session = open_session(workdir)
+    import async_walker
+    import crawl_metrics
+    import github_walker
+    import pipeline_walker
+
+    with open(os.path.join(workdir, "loader.json")) as f:
+        crawl_mode = json.load(f)["crawl_mode"]
+    walker_cls = {"async": async_walker.AsyncGitHubWalker,
+                  "pipeline": pipeline_walker.PipelinedGitHubWalker}.get(crawl_mode, github_walker.GitHubWalker)
+
+    started = time.time()
+    walker = walker_cls(session, loader="loader.json", connections="connections.json")
+    walker.repository_walk()
+    pulls = walker.pull_requests_walk()
+    walker.ghl.flush()
+    seconds = time.time() - started
+
+    summary = crawl_metrics.METRICS.summary()
+    return {"seconds": round(seconds, 3), "pulls": pulls, "db_rows": summary["db_rows"],
+            "pulls_per_second": round(pulls / seconds, 1) if seconds else 0.0,
+            "db_rows_per_second": round(summary["db_rows"] / seconds, 1) if seconds else 0.0,
+            "db_flush_rows_per_second": summary["db_rows_per_second"],
+            "rate_limit_wait_seconds": summary["rate_limit_wait_seconds"],
+            "peak_rss_mb": peak_rss_mb()}
+
+
+def stage_export(workdir, export_format):
+    session = open_session(workdir)
+    import github_loader
+
+    started = time.time()
+    loader = github_loader.GitHubLoader(session, log_level="WARNING")
+    counts = loader.dump_to_file(RAW_DIR, format=export_format)
+    seconds = time.time() - started
+
+    rows = sum(counts.values())
+    return {"seconds": round(seconds, 3), "format": export_format, "rows": rows,
+            "rows_per_second": round(rows / seconds, 1) if seconds else 0.0, "peak_rss_mb": peak_rss_mb()}
+
+
+def stage_analysis(workdir):
+    sys.path.insert(0, ANALYSIS_DIR)
+    started = time.time()
+    with open(os.devnull, "w") as devnull:
+        stdout, sys.stdout = sys.stdout, devnull
+        try:
+            runpy.run_path(os.path.join(ANALYSIS_DIR, "analysis.py"), run_name="__main__")
+        finally:
+            sys.stdout = stdout
+
+    return {"seconds": round(time.time() - started, 3), "peak_rss_mb": peak_rss_mb()}
+
+
+def run_stage(name, workdir, *args):
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), "--stage", name, "--workdir", workdir] +
+                            list(args), cwd=workdir, check=True, stdout=subprocess.PIPE, universal_newlines=True)
+    # the result is the last line, everything before it is output of the stage
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def write_configs(workdir, api_url, options):
+    with open(os.path.join(ROOT_DIR, "config", "github_monitor_config.json")) as f:
+        loader_config = json.load(f)
+
+    loader_config.update({
+        "api_url": api_url,
+        "db_provider": "SQLite",
+        "drop_tables": "N",
+        "log_level": "WARNING",
+        "crawl_mode": options.crawl_mode,
+        "sync_mode": "full",
+        "repositories": ["benchmark/repo%d" % i for i in range(options.repositories)],
+        "write_batch_size": options.write_batch_size
+    })
+    loader_config["request_params"]["concurrency"] = options.concurrency
+    loader_config["http_cache"] = {"enabled": "N"}
+    loader_config["metrics"] = {"enabled": "N"}
+
+    with open(os.path.join(workdir, "loader.json"), "w") as f:
+        json.dump(loader_config, f, indent=2)
+    with open(os.path.join(workdir, "connections.json"), "w") as f:
+        json.dump({"github": {"github_token": ""}}, f)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR,
+                                       universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(options):
+    sys.path.insert(0, BENCHMARKS_DIR)
+    import fake_github
+
+    api = fake_github.FakeGitHub(options.pulls, options.files_per_pull, options.latency_ms, options.error_rate,
+                                 options.rate_limit)
+    server = fake_github.start(api)
+    api_url = "http://127.0.0.1:%d" % server.server_address[1]
+
+    workdir = options.workdir or tempfile.mkdtemp(prefix="github_monitor_benchmark_")
+    os.makedirs(os.path.join(workdir, "logs"), exist_ok=True)
+    if os.path.exists(os.path.join(workdir, "benchmark.db")):
+        os.remove(os.path.join(workdir, "benchmark.db"))
+    write_configs(workdir, api_url, options)
+
+    crawl = run_stage("crawl", workdir)
+    server_stats = dict(api.stats)
+    crawl["requests"] = server_stats["requests"]
+    crawl["requests_per_pull"] = round(server_stats["requests"] / crawl["pulls"], 2) if crawl["pulls"] else None
+    crawl["server_errors"] = server_stats["errors"]
+    crawl["megabytes_downloaded"] = round(server_stats["bytes"] / (1024 * 1024), 2)
+
+    export = run_stage("export", workdir, "--export-format", options.export_format)
+    analysis = run_stage("analysis", workdir)
+    server.shutdown()
+
+    result = {
+        "timestamp": datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {k: v for k, v in vars(options).items() if k not in ("stage", "workdir", "output")},
+        "crawl": crawl,
+        "export": export,
+        "analysis": analysis
+    }
+
+    output = options.output or os.path.join(BENCHMARKS_DIR, "results",
+                                            "benchmark_" + result["timestamp"].replace(":", "") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2)
+
+    print(json.dumps(result, indent=2))
+    print("Results were written to " + output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Crawl / export / analysis benchmark against fake GitHub API")
+    parser.add_argument("--pulls", type=int, default=2000, help="pull requests per repository")
+    parser.add_argument("--repositories", type=int, default=1)
+    parser.add_argument("--files-per-pull", type=int, default=5, help="average files count of a pull request")
+    parser.add_argument("--latency-ms", type=float, default=0, help="latency added to every API response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of API requests answered with 502")
+    parser.add_argument("--rate-limit", type=int, default=10 ** 7, help="X-RateLimit-Limit of the fake API")
+    parser.add_argument("--crawl-mode", choices=["sync", "async", "pipeline"], default="sync")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--write-batch-size", type=int, default=1000)
+    parser.add_argument("--export-format", choices=["csv", "parquet"], default="csv")
+    parser.add_argument("--workdir", help="directory for database, exported files and logs (temporary by default)")
+    parser.add_argument("--output", help="JSON results file")
+    parser.add_argument("--stage", choices=["crawl", "export", "analysis"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.stage == "crawl":
+        print(json.dumps(stage_crawl(args.workdir)))
+    elif args.stage == "export":
+        print(json.dumps(stage_export(args.workdir, args.export_format)))
+    elif args.stage == "analysis":
+        print(json.dumps(stage_analysis(args.workdir)))
+    else:
+        main(args)
@@ -0,0 +1,129 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+import github_walker
+
+
+class AsyncGitHubWalker(github_walker.GitHubWalker):
+    """
+    Concurrent crawl mode for GitHubWalker.
+
+    Pull pages and files of their pulls (FileCollector) are requested concurrently, with at most
+    `request_params.concurrency` requests in flight. HTTP calls are executed in a thread pool
+    using the same requests session as the serial walker, while row creation and database writes
+    stay on the event loop thread, so GitHubLoader and its session are never shared between threads.
+    """
+
+    def __init__(self, db_session, **args):
+        super().__init__(db_session, **args)
+        self._executor = None
+        self._semaphore = None
+        self._logger.info("Async crawl concurrency is: %s", self.concurrency)
+
+    async def _fetch(self, url, params=None):
+        # rate limiter is thread safe, it paces requests inside of executor threads;
+        # payloads are decoded there as well, so the event loop thread only builds rows and writes them
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, functools.partial(self._get_pulls_page, url, params))
+
+    def pull_requests_walk(self, collect_files=True):
+        if self.sync_mode == "incremental":
+            # incremental refresh usually needs a few pages only, it is done by serial walker
+            return super().pull_requests_walk(collect_files)
+
+        return asyncio.run(self._pull_requests_walk(collect_files))
+
+    async def _pull_requests_walk(self, collect_files):
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+
+        loaded_count = 0
+        self.failed_repositories = set()
+        per_page = self.pull_request_parameters["per_page"]
+        for repo in self.repository_list:
+            result = self.ghl.get_repositoryid_by_name(repo)
+            self._logger.info("Get pull requests info. Current repository is: %s", repo)
+
+            if not result:
+                self._logger.warning("Unable to get repository id for repository name = %s", repo)
+                self.failed_repositories.add(repo)
+                continue
+
+            repository_id = result[0]
+            url = self.pull_request_url.format(repo=repo)
+            files_tasks = []
+            page = 1
+            self.file_collector.prepare(repository_id)
+            checkpoints = self.ghl.get_checkpoints(repository_id)
+            if "pulls" in checkpoints:
+                page = checkpoints["pulls"].page
+                self._logger.info("Resuming pull requests walk from page %s", page)
+
+            last_page_reached = False
+            failed_page = None
+            # the first page is requested alone, Link header of its response gives the last page;
+            # without Link header windows are not bounded and the walk stops at a short page
+            window = 1
+            last_page = None
+            while not last_page_reached and failed_page is None:
+                # request a window of pages at once
+                pages = range(page, page + window if last_page is None else min(page + window, last_page + 1))
+                responses = await asyncio.gather(*[self._fetch(url, dict(self.pull_request_parameters, page=p))
+                                                   for p in pages])
+
+                for p, (pulls, last) in zip(pages, responses):
+                    if pulls is None:
+                        failed_page = p
+                        break
+
+                    self._logger.info("Pulls count received for page %s is :%s", p, len(pulls))
+                    # new pulls move older ones to the following pages, the last page may grow during the walk
+                    if last is not None:
+                        last_page = max(last_page or 0, last)
+
+                    for pull in pulls:
+                        if self._process_pull(pull, repository_id):
+                            loaded_count += 1
+
+                    if collect_files:
+                        files_tasks.append(asyncio.ensure_future(self._collect_files(repo, repository_id, pulls)))
+
+                    if len(pulls) < per_page or (last_page is not None and p >= last_page):
+                        last_page_reached = True
+                        break
+
+                page = pages.stop
+                window = self.concurrency
+
+                # keep the number of pages with pending files bounded for repositories with a lot of pulls
+                if len(files_tasks) >= self.concurrency:
+                    await asyncio.gather(*files_tasks)
+                    files_tasks = []
+
+                # all pages before the window start are completely processed when no files tasks are pending
+                if not files_tasks and failed_page is None:
+                    self.ghl.set_checkpoint(repository_id, "pulls", page=page)
+
+            await asyncio.gather(*files_tasks)
+            if failed_page is None:
+                self.ghl.clear_checkpoints(repository_id)
+            else:
+                # pages before the failed one are processed, the next run starts from it
+                self._logger.error("Pull requests walk of %s stopped at page %s, it is resumed from there on "
+                                   "the next run", repo, failed_page)
+                self.failed_repositories.add(repo)
+                self.ghl.set_checkpoint(repository_id, "pulls", page=failed_page)
+                self.ghl.flush()
+            self.file_collector.release(repository_id)
+
+        self._executor.shutdown()
+        return loaded_count
+
+    async def _collect_files(self, repository, repository_id, pulls):
+        # collector waits for its requests in a default executor thread, the requests run in the crawl thread pool
+        pending = self.file_collector.pending(repository_id, pulls)
+        if pending:
+            fetched = await asyncio.get_running_loop().run_in_executor(
+                None, functools.partial(self.file_collector.fetch, repository, pending, self._executor))
+            self.file_collector.load(repository_id, fetched)
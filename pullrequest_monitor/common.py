@@ -1,33 +1,203 @@
+import atexit
+import itertools
+import json
 import logging
 import logging.handlers
+import os
+import queue
+import random
+import threading
 from requests.adapters import HTTPAdapter
 import requests
+from requests.packages.urllib3.exceptions import MaxRetryError
 from requests.packages.urllib3.util.retry import Retry
+from requests.structures import CaseInsensitiveDict
+import http_cache
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+try:
+    import h2
+except ImportError:
+    h2 = None
 
 
 DEFAULT_TIMEOUT = 10
+RETRY_STATUSES = [408, 500, 502, 503, 504]
+RETRY_METHODS = ["HEAD", "GET", "OPTIONS"]
+LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+LOG_FILE = "logs/github_monitor.log"
+
+# extra= of per-item (per pull, per file page, ...) log events, they are thinned out by SamplingFilter
+SAMPLED = {"sampled": True}
+
+# attributes of every LogRecord, everything else was passed with extra= and goes to JSON output as is
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+_logging_lock = threading.Lock()
+_logging_pid = None
+_logging_settings = {"log_format": "text", "sample_every": 1, "path": LOG_FILE}
+_log_listener = None
+_atexit_registered = False
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message and fields passed with extra=."""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Lets through every n-th record of per-item events, records are marked as per-item events with
+    extra={"sampled": True}. Records are counted per message template, so rare events are not hidden
+    behind frequent ones. Records of WARNING level and above always pass.
+    """
 
+    def __init__(self, every=1):
+        super().__init__()
+        self.every = max(int(every), 1)
+        self._counters = {}
 
-def get_console_handler():
+    def filter(self, record):
+        if self.every == 1 or record.levelno >= logging.WARNING or not getattr(record, "sampled", False):
+            return True
+
+        counter = self._counters.get(record.msg)
+        if counter is None:
+            counter = self._counters.setdefault(record.msg, itertools.count())
+        return next(counter) % self.every == 0
+
+
+def get_console_handler(fmt=None):
     console_handler = logging.StreamHandler()
     console_handler.setLevel(logging.DEBUG)
-    fmt = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-    console_handler.setFormatter(fmt)
+    console_handler.setFormatter(fmt or logging.Formatter(LOG_FORMAT))
     return console_handler
 
 
-def get_file_handler():
-    file_handler = logging.handlers.RotatingFileHandler("logs/github_monitor.log", mode='a', maxBytes=1024 * 1024 * 5,
-                                                        backupCount=5)
-    # file_handler = logging.FileHandler("logs/github_monitor.log")
-    fmt = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+def get_file_handler(fmt=None, path=LOG_FILE):
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    file_handler = logging.handlers.RotatingFileHandler(path, mode='a', maxBytes=1024 * 1024 * 5, backupCount=5)
     file_handler.setLevel(logging.DEBUG)
-    file_handler.setFormatter(fmt)
-    # print("file logger created")
+    file_handler.setFormatter(fmt or logging.Formatter(LOG_FORMAT))
     return file_handler
 
 
+def configure_logging(log_format=None, sample_every=None, path=None):
+    """
+    Attach console and file handlers to the root logger once per process. Records are put to a queue
+    by the logging thread and formatted and written by a QueueListener thread, so file I/O is not done
+    on the crawl threads. Loggers of the application only set their level and propagate to the root.
+    Returns False when logging was already configured in this process.
+    """
+    global _logging_pid, _log_listener, _atexit_registered
+
+    with _logging_lock:
+        # a forked worker process inherits configured root logger, but not the listener thread
+        if _logging_pid == os.getpid():
+            return False
+
+        # settings not given are the ones of the parent process or defaults
+        for key, value in (("log_format", log_format), ("sample_every", sample_every), ("path", path)):
+            if value is not None:
+                _logging_settings[key] = value
+
+        json_format = _logging_settings["log_format"] == "json"
+        fmt = JsonFormatter() if json_format else logging.Formatter(LOG_FORMAT)
+        queue_handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+        queue_handler.addFilter(SamplingFilter(_logging_settings["sample_every"]))
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            if isinstance(handler, logging.handlers.QueueHandler):
+                root.removeHandler(handler)
+        root.addHandler(queue_handler)
+
+        _log_listener = logging.handlers.QueueListener(queue_handler.queue, get_console_handler(fmt),
+                                                       get_file_handler(fmt, _logging_settings["path"]),
+                                                       respect_handler_level=True)
+        _log_listener.start()
+        if not _atexit_registered:
+            atexit.register(stop_logging)
+            _atexit_registered = True
+        _logging_pid = os.getpid()
+
+        return True
+
+
+def log_settings(loader_config):
+    """configure_logging() arguments from "logging" section of github_monitor_config.json"""
+    logging_config = loader_config.get("logging", {})
+    return {"log_format": logging_config.get("format"),
+            "sample_every": logging_config.get("sample_every"),
+            "path": logging_config.get("file")}
+
+
+def stop_logging():
+    # writes out records left in the queue, next get_logger() call configures logging again
+    global _logging_pid, _log_listener
+    with _logging_lock:
+        if _log_listener is not None and _logging_pid == os.getpid():
+            _log_listener.stop()
+            _log_listener = None
+            _logging_pid = None
+
+
+def get_logger(name, level=None):
+    """Logger of the application: handlers are configured once, on the root logger."""
+    configure_logging()
+    logger = logging.getLogger(name)
+    if level is not None:
+        logger.setLevel(level)
+    return logger
+
+
+class JitterRetry(Retry):
+    """
+    Retry with exponential backoff and "full jitter": every sleep is drawn from [0, backoff], so
+    concurrent crawl threads hitting the same 5xx do not retry in lockstep.
+    """
+
+    def get_backoff_time(self):
+        backoff = super().get_backoff_time()
+        return random.uniform(0, backoff) if backoff > 0 else 0
+
+
+def retry_strategy(retries=5, backoff_factor=0.5):
+    # 403/429 are not retried here, RateLimiter waits for the reset of the budget and repeats the request
+    options = dict(total=retries, backoff_factor=backoff_factor, status_forcelist=RETRY_STATUSES,
+                   raise_on_status=False)
+    try:
+        return JitterRetry(allowed_methods=RETRY_METHODS, **options)
+    except TypeError:
+        # urllib3 < 1.26
+        return JitterRetry(method_whitelist=RETRY_METHODS, **options)
+
+
 class TimeoutHTTPAdapter(HTTPAdapter):
+    """
+    Transport of the GitHub session: default timeout for every request, retries with backoff on
+    connection errors and 5xx answers, connection pool sized for the crawl concurrency.
+    """
+
     def __init__(self, *args, **kwargs):
         self.timeout = DEFAULT_TIMEOUT
         if "timeout" in kwargs:
@@ -42,28 +212,106 @@ class TimeoutHTTPAdapter(HTTPAdapter):
         return super().send(request, **kwargs)
 
 
-def configure_http_session(key):
+class Http2Adapter(HTTPAdapter):
+    """
+    Transport over HTTP/2 with httpx: concurrent requests of the crawl are multiplexed over one
+    connection per host instead of a pool of HTTP/1.1 connections. Timeout and retries are the same
+    as for TimeoutHTTPAdapter, responses are converted to requests.Response.
+    """
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, max_retries=None, pool_size=10, log_level=None):
+        super().__init__(max_retries=max_retries)
+        self.timeout = timeout
+        self._logger = get_logger("Http2Adapter", log_level)
+        self.client = httpx.Client(http2=True, timeout=timeout,
+                                   limits=httpx.Limits(max_connections=pool_size,
+                                                       max_keepalive_connections=pool_size))
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        retries = self.max_retries
+        while True:
+            try:
+                answer = self.client.request(request.method, request.url, headers=dict(request.headers),
+                                             content=request.body, timeout=timeout or self.timeout)
+            except httpx.TimeoutException as err:
+                retries = self._increment(retries, request, err, requests.exceptions.Timeout)
+                continue
+            except httpx.TransportError as err:
+                retries = self._increment(retries, request, err, requests.exceptions.ConnectionError)
+                continue
+
+            if retries.is_retry(request.method, answer.status_code, "Retry-After" in answer.headers):
+                try:
+                    retries = retries.increment(request.method, request.url)
+                except MaxRetryError:
+                    return self._to_response(request, answer)
+                self._logger.warning("Retrying %s after status %s", request.url, answer.status_code)
+                retries.sleep()
+                continue
+
+            return self._to_response(request, answer)
+
+    @staticmethod
+    def _increment(retries, request, err, exception_class):
+        try:
+            retries = retries.increment(request.method, request.url, error=err)
+        except MaxRetryError:
+            raise exception_class(err, request=request)
+        retries.sleep()
+        return retries
+
+    @staticmethod
+    def _to_response(request, answer):
+        response = requests.Response()
+        response.status_code = answer.status_code
+        # httpx has already decoded gzip body, encoding headers are dropped so content is not decoded twice
+        response.headers = CaseInsensitiveDict((k, v) for k, v in answer.headers.items()
+                                               if k.lower() not in ("content-encoding", "content-length"))
+        response._content = answer.content
+        response.encoding = answer.encoding
+        response.reason = answer.reason_phrase
+        response.url = str(answer.url)
+        response.request = request
+        return response
+
+    def close(self):
+        self.client.close()
+        super().close()
+
 
-    retry_strategy = Retry(
-        total=5,
-        status_forcelist=[408, 429, 500, 502, 503, 504],
-        method_whitelist=["HEAD", "GET", "OPTIONS"]
-    )
-    retry_adapter = HTTPAdapter(max_retries=retry_strategy)
-    timeout_adapter = TimeoutHTTPAdapter(timeout=DEFAULT_TIMEOUT)
+def configure_http_session(key, cache=None, replay=False, timeout=DEFAULT_TIMEOUT, pool_size=10, retries=5,
+                           backoff_factor=0.5, http2=False, log_level=None):
+    """
+    requests session for GitHub API. One adapter is mounted for http and https: timeout, retries with
+    jittered exponential backoff and a pool of pool_size connections, which should not be less than
+    the number of threads sharing the session. With http2 the adapter is Http2Adapter, when httpx with
+    HTTP/2 support is installed.
+    """
+    strategy = retry_strategy(retries, backoff_factor)
+    if http2 and httpx is not None and h2 is not None:
+        adapter = Http2Adapter(timeout=timeout, max_retries=strategy, pool_size=pool_size, log_level=log_level)
+    else:
+        if http2:
+            get_logger("GitHubSession", log_level).warning("HTTP/2 needs httpx[http2] package, HTTP/1.1 is used")
+        adapter = TimeoutHTTPAdapter(timeout=timeout, max_retries=strategy, pool_connections=pool_size,
+                                     pool_maxsize=pool_size)
 
-    http = requests.Session()
+    if cache is not None:
+        http = http_cache.CachedSession(cache, replay=replay)
+    else:
+        http = requests.Session()
 
     git_headers = {
-        "Accept": "application/vnd.github.v3+json"
+        "Accept": "application/vnd.github.v3+json",
+        "Accept-Encoding": "gzip"
     }
 
     if key:
         git_headers["Authorization"] = "token " + key
 
     http.headers.update(git_headers)
-    http.mount("https://", timeout_adapter)
-    http.mount("https://", retry_adapter)
+    http.mount("https://", adapter)
+    http.mount("http://", adapter)
 
     # assert_status_hook = lambda response, *args, **kwargs: response.raise_for_status()
     # def assert_status_hook(response, *args, **kwargs):
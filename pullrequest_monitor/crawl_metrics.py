@@ -0,0 +1,244 @@
+import bisect
+import cProfile
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import common
+
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FLUSH_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0, 10.0)
+
+# REST endpoints of the crawl, by path of request URL
+ENDPOINTS = [
+    ("files", re.compile(r"/repos/[^/]+/[^/]+/pulls/\d+/files$")),
+    ("pulls", re.compile(r"/repos/[^/]+/[^/]+/pulls$")),
+    ("repository", re.compile(r"/repos/[^/]+/[^/]+$")),
+    ("rate_limit", re.compile(r"/rate_limit$")),
+    ("graphql", re.compile(r"/graphql$")),
+]
+
+
+def endpoint_name(url):
+    path = url.split("?", 1)[0]
+    for name, pattern in ENDPOINTS:
+        if pattern.search(path):
+            return name
+    return "other"
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+
+
+class CrawlMetrics:
+    """
+    Counters and histograms of a crawl process, rendered in Prometheus text exposition format.
+
+    Metrics are kept per label set in plain dicts under one lock, observation is a dict update,
+    so instrumentation is cheap enough to stay on for every request and every flush.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+
+    def inc(self, name, labels=(), value=1):
+        with self._lock:
+            key = (name, labels)
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, value, buckets):
+        with self._lock:
+            key = (name, labels)
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def set(self, name, labels, value):
+        with self._lock:
+            self.gauges[(name, labels)] = value
+
+    def observe_request(self, endpoint, response, seconds):
+        source = "cache" if response.headers.get("X-From-Cache") else "network"
+        labels = (("endpoint", endpoint), ("status", str(response.status_code)), ("source", source))
+        self.inc("github_requests_total", labels)
+        self.inc("github_response_bytes_total", (("endpoint", endpoint),), len(response.content or b""))
+        self.observe("github_request_seconds", (("endpoint", endpoint),), seconds, LATENCY_BUCKETS)
+
+    def observe_rate_limit_wait(self, limiter, seconds):
+        if seconds > 0:
+            self.inc("github_rate_limit_wait_seconds_total", (("limiter", limiter),), seconds)
+
+    def observe_flush(self, table, rows, seconds):
+        self.inc("db_rows_total", (("table", table),), rows)
+        self.observe("db_flush_seconds", (("table", table),), seconds, FLUSH_BUCKETS)
+
+    def _sum(self, name, **match):
+        with self._lock:
+            return sum(v for (n, labels), v in self.counters.items()
+                       if n == name and all(dict(labels).get(k) == m for k, m in match.items()))
+
+    def summary(self):
+        requests = self._sum("github_requests_total")
+        answered_locally = self._sum("github_requests_total", status="304") + \
+            self._sum("github_requests_total", source="cache")
+        with self._lock:
+            flush_seconds = sum(h.total for (n, _), h in self.histograms.items() if n == "db_flush_seconds")
+        rows = self._sum("db_rows_total")
+
+        return {
+            "requests": requests,
+            "bytes": self._sum("github_response_bytes_total"),
+            "not_modified_or_cached_ratio": round(answered_locally / requests, 3) if requests else 0.0,
+            "rate_limit_wait_seconds": round(self._sum("github_rate_limit_wait_seconds_total"), 1),
+            "db_rows": rows,
+            "db_rows_per_second": round(rows / flush_seconds, 1) if flush_seconds else 0.0,
+            "elapsed_seconds": round(time.time() - self.started_at, 1)
+        }
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        labels = tuple(labels) + tuple(extra)
+        if not labels:
+            return ""
+        return "{" + ",".join('%s="%s"' % (k, v) for k, v in labels) + "}"
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                lines.append("%s%s %s" % (name, self._labels(labels), value))
+
+            for (name, labels), value in sorted(self.gauges.items()):
+                lines.append("%s%s %s" % (name, self._labels(labels), value))
+
+            for (name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+                    cumulative += count
+                    lines.append("%s_bucket%s %s" % (name, self._labels(labels, (("le", bound),)), cumulative))
+                lines.append("%s_sum%s %s" % (name, self._labels(labels), histogram.total))
+                lines.append("%s_count%s %s" % (name, self._labels(labels), cumulative))
+
+        lines.append("crawl_uptime_seconds %s" % round(time.time() - self.started_at, 1))
+        return "\n".join(lines) + "\n"
+
+
+# metrics of this process, shared by walkers and loaders
+METRICS = CrawlMetrics()
+
+
+class MetricsExporter(threading.Thread):
+    """
+    Periodically writes METRICS to a file in Prometheus text format (atomic replace, suitable for
+    node_exporter textfile collector) and optionally serves them on http://<host>:<port>/metrics.
+    """
+
+    def __init__(self, path=None, interval=15, port=0):
+        super().__init__(name="metrics-exporter", daemon=True)
+        self._logger = common.get_logger("CrawlMetrics", logging.INFO)
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.server = None
+
+        if port:
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    body = METRICS.render().encode("utf-8")
+                    self.send_response(200 if self.path == "/metrics" else 404)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, *args):
+                    pass
+
+            self.server = ThreadingHTTPServer(("", port), Handler)
+            threading.Thread(target=self.server.serve_forever, name="metrics-http", daemon=True).start()
+            self._logger.info("Metrics are served on port %s", port)
+
+    def write(self):
+        if not self.path:
+            return
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(METRICS.render())
+        os.replace(tmp_path, self.path)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.write()
+
+    def stop(self):
+        self.stopped.set()
+        self.write()
+        if self.server is not None:
+            self.server.shutdown()
+        self._logger.info("Crawl metrics summary: %s", METRICS.summary())
+
+
+def start_exporter(loader_config, suffix=""):
+    """Starts exporter configured by "metrics" section of github_monitor_config.json, None when it is off."""
+    metrics_config = loader_config.get("metrics", {})
+    if metrics_config.get("enabled", "N") != "Y":
+        return None
+
+    path = metrics_config.get("file")
+    port = metrics_config.get("port", 0)
+    if suffix:
+        # worker processes write their own files, the port is taken by the main process
+        root, ext = os.path.splitext(path or "logs/crawl_metrics.prom")
+        path = root + "_" + suffix + ext
+        port = 0
+    exporter = MetricsExporter(path, metrics_config.get("interval", 15), port)
+    exporter.start()
+    return exporter
+
+
+@contextmanager
+def phase(name, profile_dir=None):
+    """
+    Times a phase of the crawl. With profile_dir the phase runs under cProfile and stats are
+    dumped to <profile_dir>/<name>.prof (snakeviz, pstats). The phase name is also the name of
+    the calling thread while the phase runs, so py-spy dumps show the phase of the crawl.
+    """
+    thread = threading.current_thread()
+    thread_name = thread.name
+    thread.name = "phase-" + name
+
+    profiler = None
+    if profile_dir:
+        os.makedirs(profile_dir, exist_ok=True)
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    started = time.time()
+    try:
+        yield
+    finally:
+        METRICS.set("crawl_phase_seconds", (("phase", name),), round(time.time() - started, 3))
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(os.path.join(profile_dir, name + ".prof"))
+        thread.name = thread_name
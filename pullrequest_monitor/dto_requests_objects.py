@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Index, case, func, literal, select
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.ext.automap import automap_base
 from sqlalchemy import ForeignKey
@@ -21,6 +21,9 @@ class GitUser(Base):
 
 class GitRepository(Base):
     __tablename__ = "git_repository"
+    # GitHubLoader.get_repositoryid_by_name
+    __table_args__ = (Index("ix_git_repository_full_name", "full_name"),)
+
     id = Column(Integer, primary_key=True)
     full_name = Column(String(200), nullable=False)
     private = Column(Integer, default=0)
@@ -36,6 +39,12 @@ class GitRepository(Base):
 
 class GitPullRequest(Base):
     __tablename__ = "git_pullrequest"
+    __table_args__ = (
+        # joins with git_repository, per repository analysis
+        Index("ix_git_pullrequest_repo_id", "repository_id"),
+        # merged pulls filter of analysis queries and summaries
+        Index("ix_git_pullrequest_merged_at", "merged_at", "closed_at"),
+    )
 
     id = Column(Integer, primary_key=True)
     pull_number = Column(Integer, nullable=False)
@@ -44,11 +53,14 @@ class GitPullRequest(Base):
     state = Column(String(20))
     title = Column(String(2000))
 
-    created_at = Column(DateTime)
+    # partitioning key of git_pullrequest on Oracle, it can not be NULL
+    created_at = Column(DateTime, nullable=False)
     updated_at = Column(DateTime)
     merged_at = Column(DateTime)
     closed_at = Column(DateTime)
     merge_commit_sha = Column(String(100))
+    # head commit of the pull, contents_url of its files refer to it
+    head_sha = Column(String(100))
 
     user_id = Column(Integer, ForeignKey("git_user.id"))
     user = relationship("GitUser", back_populates="pulls")
@@ -60,11 +72,28 @@ class GitPullRequest(Base):
         return "PullRequest ID: " + str(self.id)
 
 
-class PullRequestFile(Base):
-    __tablename__ = "git_pullrequest_file"
+class GitFilePath(Base):
+    """Dictionary of file paths of a repository, files of pulls refer to it by id."""
+    __tablename__ = "git_file_path"
+
+    # id_index.path_id(repository_id, filename)
+    id = Column(BigInteger, primary_key=True, autoincrement=False)
+    repository_id = Column(Integer, ForeignKey("git_repository.id"), nullable=False)
+    filename = Column(String(2000), nullable=False)
+
+    def __repr__(self):
+        return str(self.id) + ":" + self.filename
+
 
-    pull_id = Column(Integer, ForeignKey('git_pullrequest.id'), primary_key=True)
-    filename = Column(String(2000), nullable=False, primary_key=True)
+class PullRequestFile(Base):
+    # rows with file names and contents_url are in git_pullrequest_file view (PULL_FILE_VIEW)
+    __tablename__ = "git_pull_file"
+
+    # joins on pull_id use the primary key index, pull_id is its leading column;
+    # the foreign key is named for reference partitioning on Oracle (see schema.py)
+    pull_id = Column(Integer, ForeignKey("git_pullrequest.id", name="fk_git_pull_file_pull"), primary_key=True)
+    path_id = Column(BigInteger, ForeignKey("git_file_path.id", name="fk_git_pull_file_path"), primary_key=True,
+                     autoincrement=False)
     sha = Column(String(100))
     # pull_number = Column(Integer, ForeignKey('git_pullrequest.pull_number'), primary_key=True)
 
@@ -72,18 +101,141 @@ class PullRequestFile(Base):
     additions = Column(Integer)
     deletions = Column(Integer)
     changes = Column(Integer)
-    contents_url = Column(String(2000), nullable=False)
 
     pullrequest = relationship("GitPullRequest", back_populates="files")
+    path = relationship("GitFilePath")
+
+    def __repr__(self):
+        return str(self.pull_id) + ":" + str(self.path_id)
+
+
+class GitSyncState(Base):
+    __tablename__ = "git_sync_state"
+
+    repository_id = Column(Integer, ForeignKey("git_repository.id"), primary_key=True)
+    resource = Column(String(50), primary_key=True)
+
+    watermark = Column(DateTime)
+    etag = Column(String(200))
+    last_modified = Column(String(100))
+    synced_at = Column(DateTime)
+
+    def __repr__(self):
+        return str(self.repository_id) + ":" + self.resource + ":" + str(self.watermark)
+
+
+class GitCrawlCheckpoint(Base):
+    __tablename__ = "git_crawl_checkpoint"
+
+    repository_id = Column(Integer, ForeignKey("git_repository.id"), primary_key=True)
+    # pulls: next page to request; graphql_pulls: cursor of the next batch of GraphQL fetch mode
+    phase = Column(String(20), primary_key=True)
+    page = Column(Integer)
+    cursor = Column(String(200))
+    updated_at = Column(DateTime)
+
+    def __repr__(self):
+        return str(self.repository_id) + ":" + self.phase + ":" + str(self.page) + ":" + str(self.cursor)
+
+
+class GitPullFilesState(Base):
+    """Files collection of a pull request, see file_collector.FileCollector."""
+    __tablename__ = "git_pull_files_state"
+
+    pull_id = Column(Integer, ForeignKey("git_pullrequest.id"), primary_key=True)
+    # head commit the files were collected for, files are collected again when the pull gets new commits
+    head_sha = Column(String(100))
+    # complete, or truncated: GitHub API returned only the first 3000 files
+    status = Column(String(20), nullable=False)
+    files_count = Column(Integer)
+    # changed files count reported by GitHub, requested for truncated pulls only
+    changed_files = Column(Integer)
+    collected_at = Column(DateTime)
 
     def __repr__(self):
-        return str(self.pull_id) + ":" + self.filename
+        return str(self.pull_id) + ":" + self.status + ":" + str(self.files_count)
+
+
+class GitCrawlQueue(Base):
+    __tablename__ = "git_crawl_queue"
+
+    repository = Column(String(200), primary_key=True)
+    status = Column(String(20), nullable=False, default="pending")
+    worker_id = Column(String(200))
+    heartbeat_at = Column(DateTime)
+    attempts = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return self.repository + ":" + self.status
+
+
+class GitMergeTimeSummary(Base):
+    """Time between open and merge of merged pull requests per repository, maintained by GitHubLoader."""
+    __tablename__ = "git_merge_time_summary"
+
+    repository_id = Column(Integer, ForeignKey("git_repository.id"), primary_key=True)
+    merged_count = Column(Integer, nullable=False, default=0)
+    # seconds between created_at and merged_at
+    merge_seconds_sum = Column(BigInteger, nullable=False, default=0)
+    merge_seconds_min = Column(Integer)
+    merge_seconds_max = Column(Integer)
+
+    def __repr__(self):
+        return str(self.repository_id) + ":" + str(self.merged_count)
+
+
+class GitFileChangeSummary(Base):
+    """Changes count of a file in merged pull requests of a repository, maintained by GitHubLoader."""
+    __tablename__ = "git_file_change_summary"
+    # top files per repository: rank() over (partition by repository_id order by change_count desc)
+    __table_args__ = (Index("ix_git_file_change_rank", "repository_id", "change_count"),)
+
+    repository_id = Column(Integer, ForeignKey("git_repository.id"), primary_key=True)
+    filename = Column(String(2000), primary_key=True)
+    change_count = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return str(self.repository_id) + ":" + self.filename + ":" + str(self.change_count)
+
+
+# git_pullrequest_file as it was before file paths were moved to git_file_path: view over files, paths,
+# pulls and repositories with the same columns, contents_url is derived from repository, path and head commit
+CONTENTS_URL_PREFIX = "https://api.github.com/repos/"
+PULL_FILE_VIEW_NAME = "git_pullrequest_file"
+# characters of the path percent-encoded in contents_url: "%" and the URL path percent-encode set,
+# non-ASCII characters are kept as they are
+CONTENTS_URL_QUOTED = "% \"#<>?`{}"
+
+
+def _quote_path(path):
+    for char in CONTENTS_URL_QUOTED:
+        path = func.replace(path, char, "%%%02X" % ord(char))
+    return path
+
+
+def _pull_file_select():
+    files, paths = PullRequestFile.__table__, GitFilePath.__table__
+    pulls, repositories = GitPullRequest.__table__, GitRepository.__table__
+    contents_url = literal(CONTENTS_URL_PREFIX) + repositories.c.full_name + "/contents/" + \
+        _quote_path(paths.c.filename) + case([(pulls.c.head_sha.isnot(None), "?ref=" + pulls.c.head_sha)], else_="")
+
+    return select([files.c.pull_id, paths.c.filename, files.c.sha, files.c.status, files.c.additions,
+                   files.c.deletions, files.c.changes, contents_url.label("contents_url")]) \
+        .select_from(files.join(paths, paths.c.id == files.c.path_id)
+                     .join(pulls, pulls.c.id == files.c.pull_id)
+                     .join(repositories, repositories.c.id == pulls.c.repository_id))
+
+
+PULL_FILE_SELECT = _pull_file_select()
+PULL_FILE_VIEW = PULL_FILE_SELECT.alias(PULL_FILE_VIEW_NAME)
 
+# tables with crawled data, service tables are not exported; files are exported as PULL_FILE_VIEW
+DATA_TABLES = [GitUser, GitRepository, GitPullRequest]
 
 GitRepository.pulls = relationship("GitPullRequest", order_by=GitPullRequest.pull_number, back_populates="repository")
 GitUser.repositories = relationship("GitRepository", order_by=GitRepository.id, back_populates="owner")
 GitUser.pulls = relationship("GitPullRequest", order_by=GitPullRequest.pull_number, back_populates="user")
-GitPullRequest.files = relationship("PullRequestFile", order_by=PullRequestFile.filename, back_populates="pullrequest")
+GitPullRequest.files = relationship("PullRequestFile", order_by=PullRequestFile.path_id, back_populates="pullrequest")
 
 # Base.prepare()
 
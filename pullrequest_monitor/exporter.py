@@ -0,0 +1,168 @@
+import csv
+import gzip
+import logging
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import select, DateTime, Integer
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+
+PARTITION_COLUMN = "repository_id"
+
+
+class TableExporter:
+    """
+    Streaming export of database tables to CSV files.
+
+    Rows are read with Core selects over server side cursors (stream_results) in fetch_size chunks
+    and written with csv.writerows per chunk, so neither ORM objects nor whole tables are kept in memory.
+    Every table is exported by its own thread over its own connection.
+
+    With format="parquet" (requires pyarrow) tables are written with typed integer and timestamp columns,
+    tables having repository_id column are partitioned by it in hive layout:
+    <outdir>/<table>/repository_id=<id>/part-0.parquet, so readers can load only needed partitions.
+    Tables without repository_id are written to <outdir>/<table>.parquet, unless a partition query adding
+    repository_id (e.g. joined from parent table) is given for them.
+    """
+
+    def __init__(self, engine, **args):
+        self.engine = engine
+
+        self.fetch_size = 10000
+        if "fetch_size" in args.keys():
+            self.fetch_size = args["fetch_size"]
+
+        self.compress = False
+        if "compress" in args.keys():
+            self.compress = args["compress"]
+
+        self.workers = 4
+        if "workers" in args.keys():
+            self.workers = args["workers"]
+
+        self.format = "csv"
+        if "format" in args.keys():
+            self.format = args["format"]
+
+        if self.format == "parquet" and pa is None:
+            raise ValueError("Parquet export requires pyarrow module")
+
+        self._logger = logging.getLogger("GitHubLoader.TableExporter")
+
+    def _open(self, outdir, table_name):
+        if self.compress:
+            filename = os.path.join(outdir, table_name + ".csv.gz")
+            return filename, gzip.open(filename, "wt", newline="", encoding="utf-8", compresslevel=6)
+
+        filename = os.path.join(outdir, table_name + ".csv")
+        return filename, open(filename, "w", newline="", encoding="utf-8", buffering=1024 * 1024)
+
+    @staticmethod
+    def _arrow_type(column):
+        if isinstance(column.type, Integer):
+            return pa.int64()
+        if isinstance(column.type, DateTime):
+            return pa.timestamp("s")
+        return pa.string()
+
+    def export_table(self, table, outdir, query=None):
+        if self.format == "parquet":
+            return self.export_table_parquet(table, outdir, query)
+
+        return self.export_table_csv(table, outdir)
+
+    def export_table_csv(self, table, outdir):
+        rows_count = 0
+        filename, outfile = self._open(outdir, table.name)
+        with outfile, self.engine.connect() as conn:
+            outcsv = csv.writer(outfile)
+            outcsv.writerow([column.name for column in table.columns])
+
+            result = conn.execution_options(stream_results=True).execute(select([table]))
+            while True:
+                rows = result.fetchmany(self.fetch_size)
+                if not rows:
+                    break
+                outcsv.writerows(rows)
+                rows_count += len(rows)
+
+        self._logger.info("Table %s was exported to %s. Rows count: %s", table.name, filename, rows_count)
+        return rows_count
+
+    def export_table_parquet(self, table, outdir, query=None):
+        rows_count = 0
+        if query is None:
+            query = select([table])
+        columns = list(query.c)
+        names = [column.name for column in columns]
+        partitioned = PARTITION_COLUMN in names
+        if partitioned:
+            pos = names.index(PARTITION_COLUMN)
+            schema = pa.schema([(c.name, self._arrow_type(c)) for c in columns if c.name != PARTITION_COLUMN])
+            target = os.path.join(outdir, table.name)
+            if os.path.isdir(target):
+                shutil.rmtree(target)
+        else:
+            schema = pa.schema([(c.name, self._arrow_type(c)) for c in columns])
+            target = os.path.join(outdir, table.name + ".parquet")
+
+        writers = {}
+        try:
+            with self.engine.connect() as conn:
+                result = conn.execution_options(stream_results=True).execute(query)
+                while True:
+                    rows = result.fetchmany(self.fetch_size)
+                    if not rows:
+                        break
+                    rows_count += len(rows)
+
+                    if not partitioned:
+                        if None not in writers:
+                            writers[None] = pq.ParquetWriter(target, schema)
+                        writers[None].write_table(self._to_arrow(rows, names, schema))
+                        continue
+
+                    partitions = {}
+                    for row in rows:
+                        partitions.setdefault(row[pos], []).append(row)
+
+                    for key, part_rows in partitions.items():
+                        if key not in writers:
+                            part_dir = os.path.join(target, PARTITION_COLUMN + "=" +
+                                                    (str(key) if key is not None else "__HIVE_DEFAULT_PARTITION__"))
+                            os.makedirs(part_dir, exist_ok=True)
+                            writers[key] = pq.ParquetWriter(os.path.join(part_dir, "part-0.parquet"), schema)
+                        writers[key].write_table(self._to_arrow(part_rows, names, schema))
+        finally:
+            for writer in writers.values():
+                writer.close()
+
+        self._logger.info("Table %s was exported to %s. Rows count: %s", table.name, target, rows_count)
+        return rows_count
+
+    @staticmethod
+    def _to_arrow(rows, names, schema):
+        columns = {name: [] for name in schema.names}
+        positions = [(names.index(name), columns[name]) for name in schema.names]
+        for row in rows:
+            for pos, values in positions:
+                values.append(row[pos])
+
+        return pa.Table.from_pydict(columns, schema=schema)
+
+    def export(self, tables, outdir, queries=None):
+        """
+        queries: optional {table name: select} used instead of full table select for parquet format
+        """
+        queries = queries or {}
+        os.makedirs(outdir, exist_ok=True)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            counts = executor.map(lambda t: self.export_table(t, outdir, queries.get(t.name)), tables)
+            return dict(zip([t.name for t in tables], counts))
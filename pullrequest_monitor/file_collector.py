@@ -0,0 +1,187 @@
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from urllib.parse import parse_qs, urlparse
+import common
+import payload
+
+
+# GitHub API returns at most 3000 files of a pull request, pages after them come back empty
+MAX_PULL_FILES = 3000
+
+
+def head_sha(pull):
+    return pull["head"]["sha"] if pull.get("head") else None
+
+
+def last_page(response, files, per_page):
+    """
+    Number of the last files page from Link header of the first page. None when it is unknown
+    (full page without Link header, e.g. a proxy dropped it), then pages are requested one by one.
+    """
+    last = response.links.get("last")
+    if last is not None:
+        return int(parse_qs(urlparse(last["url"]).query).get("page", ["1"])[0])
+    if "next" in response.links or ("Link" not in response.headers and len(files) >= per_page):
+        return None
+    return 1
+
+
+class FileCollector:
+    """
+    Collects files of pull requests for GitHubWalker.
+
+    Files of a pull are requested once per head commit: git_pull_files_state keeps the head commit of
+    every pull with collected files, so pulls loaded before, refreshed by upsert or crawled again after
+    a restart are skipped until they get new commits. Files of the pulls of a page are requested
+    concurrently: first pages of all pulls at once, then the remaining pages of every pull in parallel,
+    their count is taken from Link header of the first page. GitHub API returns at most MAX_PULL_FILES files,
+    pulls with more files are marked truncated with the changed files count reported by GitHub.
+
+    Requests run in a thread pool of `concurrency` threads; states are read and rows are loaded
+    by the thread owning the database session (prepare, collect, load, mark). Collected pulls are
+    guarded by a lock, pending may be called from another thread (fetch stage of the pipeline).
+    """
+
+    def __init__(self, walker, concurrency=8, log_level=None):
+        self.walker = walker
+        self.concurrency = concurrency
+        self._logger = common.get_logger("FileCollector", log_level)
+        self._executor = None
+        # repository_id -> {(pull_id, head_sha)} of pulls with collected files
+        self._collected = {}
+        self._lock = threading.Lock()
+
+    def prepare(self, repository_id):
+        collected = self.walker.ghl.get_files_states(repository_id)
+        with self._lock:
+            self._collected[repository_id] = collected
+        self._logger.info("Pulls with collected files in repository %s: %s", repository_id, len(collected))
+
+    def release(self, repository_id):
+        with self._lock:
+            self._collected.pop(repository_id, None)
+
+    def pending(self, repository_id, pulls):
+        """Pulls whose files are not collected for their head commit yet."""
+        with self._lock:
+            collected = self._collected.get(repository_id, ())
+            return [pull for pull in pulls if (pull["id"], head_sha(pull)) not in collected]
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def _fetch_page(self, url, page):
+        response = self.walker._get_response(url, params=dict(self.walker.files_request_parameters, page=page))
+        if response is None or response.status_code != 200:
+            return None, None
+
+        files = payload.files(response.content)
+        if not isinstance(files, list):
+            return None, None
+        return files, response
+
+    def _changed_files(self, repository, pull_number):
+        pull = self.walker._make_request(url=self.walker.pull_request_url.format(repo=repository) + "/" +
+                                         str(pull_number))
+        return pull.get("changed_files")
+
+    def fetch(self, repository, pulls, executor=None):
+        """
+        Files of the pulls as dicts with pull, files (payload dicts), complete (every page was received) and
+        changed_files (GitHub count, requested for pulls with MAX_PULL_FILES files only).
+        Does not use the database session, requests run in `executor` or in the own thread pool.
+        """
+        if not pulls:
+            return []
+        if executor is None:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.concurrency)
+            executor = self._executor
+
+        per_page = self.walker.files_request_parameters["per_page"]
+        max_pages = int(math.ceil(MAX_PULL_FILES / float(per_page)))
+        urls = [self.walker.pull_files_url.format(repo=repository, pull_number=pull["number"]) for pull in pulls]
+        results = [{"pull": pull, "pages": {}, "complete": True, "sequential": False} for pull in pulls]
+
+        futures = {executor.submit(self._fetch_page, url, 1): (i, 1) for i, url in enumerate(urls)}
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                i, page = futures.pop(future)
+                result = results[i]
+                files, response = future.result()
+                if files is None:
+                    result["complete"] = False
+                    continue
+                result["pages"][page] = files
+
+                next_pages = []
+                if page == 1:
+                    last = last_page(response, files, per_page)
+                    result["sequential"] = last is None
+                    if last is not None:
+                        next_pages = range(2, min(last, max_pages) + 1)
+                if result["sequential"] and len(files) >= per_page and page < max_pages:
+                    next_pages = [page + 1]
+
+                for next_page in next_pages:
+                    futures[executor.submit(self._fetch_page, urls[i], next_page)] = (i, next_page)
+
+        fetched = []
+        for result in results:
+            pages = result["pages"]
+            files = [f for page in sorted(pages) for f in pages[page]]
+            changed_files = None
+            if result["complete"] and len(files) >= MAX_PULL_FILES:
+                changed_files = self._changed_files(repository, result["pull"]["number"])
+            fetched.append({"pull": result["pull"], "files": files, "complete": result["complete"],
+                            "changed_files": changed_files})
+
+        return fetched
+
+    def mark(self, repository_id, pull, files_count, changed_files=None):
+        """Files of the pull are collected, as many as GitHub API returns."""
+        status = "complete"
+        if (changed_files is None and files_count >= MAX_PULL_FILES) or \
+                (changed_files is not None and changed_files > files_count):
+            status = "truncated"
+            self._logger.warning("Files of pull request %s are truncated by GitHub API: %s of %s files were collected",
+                                 pull["number"], files_count, changed_files if changed_files is not None else "?")
+
+        self.walker.ghl.set_files_state(pull["id"], head_sha(pull), status, files_count, changed_files)
+        with self._lock:
+            collected = self._collected.get(repository_id)
+            if collected is not None:
+                collected.add((pull["id"], head_sha(pull)))
+
+    def load(self, repository_id, fetched):
+        """Load results of fetch, rows are built here unless they are given in "rows"."""
+        for result in fetched:
+            pull = result["pull"]
+            rows = result.get("rows")
+            if rows is None:
+                rows = self.walker._build_files(pull["id"], repository_id, result["files"])
+            self.walker.ghl.add_pull_request_files(rows)
+
+            if result["complete"]:
+                self.mark(repository_id, pull, len(rows), result["changed_files"])
+            else:
+                self._logger.warning("Files of pull request %s are incomplete, they are requested again on the next run",
+                                     pull["number"])
+
+    def collect(self, repository, repository_id, pulls):
+        """Request and load files of the pulls which are not collected yet. Returns count of such pulls."""
+        with self._lock:
+            prepared = repository_id in self._collected
+        if not prepared:
+            self.prepare(repository_id)
+
+        pending = self.pending(repository_id, pulls)
+        if len(pending) < len(pulls):
+            self._logger.info("Files are already collected for %s of %s pull requests", len(pulls) - len(pending),
+                              len(pulls), extra=common.SAMPLED)
+        self.load(repository_id, self.fetch(repository, pending))
+        return len(pending)
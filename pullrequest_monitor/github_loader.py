@@ -1,9 +1,16 @@
 import logging
+import time
 import common
+import crawl_metrics
 import dto_requests_objects as dto
+import exporter
+import id_index
+import summaries
+import upsert
+from sqlalchemy import and_, literal, select
 from sqlalchemy.exc import SQLAlchemyError
-import csv
-import os
+from collections import OrderedDict
+from datetime import datetime
 
 
 class GitHubLoader:
@@ -13,141 +20,437 @@ class GitHubLoader:
         if "log_level" in args.keys():
             log_level = args["log_level"]
 
-        self._logger = logging.getLogger("GitHubLoader")
-        self._logger.addHandler(common.get_file_handler())
-        self._logger.addHandler(common.get_console_handler())
-        self._logger.setLevel(log_level)
-        self._logger.info("Configured log level is: " + logging.getLevelName(self._logger.getEffectiveLevel()))
+        self.batch_size = 1000
+        if "batch_size" in args.keys():
+            self.batch_size = args["batch_size"]
+
+        self.load_chunk_size = 50000
+        if "load_chunk_size" in args.keys():
+            self.load_chunk_size = args["load_chunk_size"]
+
+        use_summaries = args.get("summaries", True)
+
+        # (repository_id, filename) -> git_file_path.id of recently seen paths
+        self.path_cache_size = args.get("path_cache_size", 100000)
+
+        self._logger = common.get_logger("GitHubLoader", log_level)
+        self._logger.info("Configured log level is: %s", logging.getLevelName(self._logger.getEffectiveLevel()))
 
         self.session = session
 
-        self.repositories = set()
-        self.users = set()
-        self.pulls = set()
-        self.files = set()
+        self.repositories = id_index.IdIndex()
+        self.users = id_index.IdIndex()
+        self.pulls = id_index.IdIndex()
+        self.files = id_index.IdIndex()
+        self.paths = OrderedDict()
+
+        # rows waiting for bulk insert, flushed in foreign keys order
+        self._buffers = OrderedDict((cls, []) for cls in (dto.GitUser, dto.GitRepository, dto.GitFilePath,
+                                                            dto.GitPullRequest, dto.PullRequestFile))
+        self._buffered_count = 0
+        self._pull_upserts = []
+        self._pull_upsert_statement = None
+        self._insert_statements = {}
+        self._checkpoints = {}
+        self._checkpoint_upsert_statement = None
+        self._files_states = {}
+        self._files_state_upsert_statement = None
+        # pulls with file rows which failed to load, they are not marked collected
+        self._pulls_missing_files = set()
 
         self._get_existed_data()
 
+        # merge time and file change summaries, updated on every flush
+        self.summaries = None
+        if use_summaries and self.session:
+            self.summaries = summaries.SummaryTracker(
+                self.session, self._chunked_loader([dto.GitPullRequest.id], lambda r: r[0],
+                                                   dto.GitPullRequest.merged_at.isnot(None)))
+
         # if self.loader_config["augmented_load"] == "Y":
         #     self._logger.info("--- Augmented load was used. Load all existing users from database. ---")
         #     self.users.extend([e[0] for e in self.session.query(dto.GitUser.login).all()])
         #     self._logger.info("Users loaded count: " + str(len(self.users)))
 
+    def _chunked_loader(self, columns, key, criterion=None):
+        def load():
+            query = self.session.query(*columns)
+            if criterion is not None:
+                query = query.filter(criterion)
+            query = query.yield_per(self.load_chunk_size)
+            chunk = []
+            for row in query:
+                chunk.append(key(row))
+                if len(chunk) >= self.load_chunk_size:
+                    yield chunk
+                    chunk = []
+            yield chunk
+            self._logger.info("Existing keys were loaded for: %s", columns[0].class_.__tablename__)
+
+        return load
+
     def _get_existed_data(self):
+        # ids are read from database on first lookup, in chunks
         if self.session:
-            self.repositories.add(r for r in self.session.query(dto.GitRepository.id).all())
-            self.users.add(u for u in self.session.query(dto.GitUser.id).all())
-            self.pulls.add(r for r in self.session.query(dto.GitPullRequest.id).all())
-
-    def _load_data(self, values):
-        if values:
-            try:
-                self.session.add_all(values)
-                self.session.commit()
+            self.repositories = id_index.IdIndex(self._chunked_loader([dto.GitRepository.id], lambda r: r[0]))
+            self.users = id_index.IdIndex(self._chunked_loader([dto.GitUser.id], lambda r: r[0]))
+            self.pulls = id_index.IdIndex(self._chunked_loader([dto.GitPullRequest.id], lambda r: r[0]))
+            self.files = id_index.IdIndex(self._chunked_loader([dto.PullRequestFile.pull_id,
+                                                               dto.PullRequestFile.path_id],
+                                                              lambda r: id_index.file_key(r[0], r[1])))
+
+    @staticmethod
+    def _to_mapping(obj):
+        # rows built by the walker (dicts with all columns of the table) are inserted as they are
+        if isinstance(obj, dict):
+            return obj
+        return {column.key: getattr(obj, column.key) for column in obj.__mapper__.column_attrs}
+
+    def _buffer(self, cls, row):
+        self._buffers[cls].append(row)
+        self._buffered_count += 1
+        if self._buffered_count >= self.batch_size:
+            self.flush()
+
+    def _forget(self, cls, row):
+        if cls is dto.GitUser:
+            self.users.discard(row["id"])
+        elif cls is dto.GitRepository:
+            self.repositories.discard(row["id"])
+        elif cls is dto.GitPullRequest:
+            self.pulls.discard(row["id"])
+        elif cls is dto.GitFilePath:
+            self.paths.pop((row["repository_id"], row["filename"]), None)
+        elif cls is dto.PullRequestFile:
+            self.files.discard(id_index.file_key(row["pull_id"], row["path_id"]))
+            self._pulls_missing_files.add(row["pull_id"])
+
+    def _statement(self, cls):
+        # users, repositories and paths are shared by crawl processes, so an existing row is not an error
+        if cls not in (dto.GitUser, dto.GitRepository, dto.GitFilePath):
+            return None
+        if cls not in self._insert_statements:
+            self._insert_statements[cls] = upsert.upsert_statement(self.session.get_bind().dialect.name,
+                                                                   cls.__table__, ["id"], {})
+        return self._insert_statements[cls]
+
+    def _exists(self, cls, row):
+        table = cls.__table__
+        query = select([literal(1)]).where(and_(*[c == row[c.name] for c in table.primary_key.columns]))
+        try:
+            return self.session.execute(query).first() is not None
+        except SQLAlchemyError:
+            self.session.rollback()
+            return False
 
-                self._logger.debug("Values were loaded to database: " + str(len(values)))
-                return True
+    def _bulk_insert(self, cls, rows, statement=None):
+        try:
+            self.session.execute(statement if statement is not None else cls.__table__.insert(), rows)
+            self.session.commit()
+            return len(rows)
 
-            except SQLAlchemyError as err:
-                self._logger.error("Values were not loaded to database:\n" +
-                                   "    --> Values:" + str(values) + "\n" +
-                                   "    --> Error text:" + str(err))
-                return False
+        except SQLAlchemyError as err:
+            self.session.rollback()
+            if len(rows) == 1:
+                self._logger.error("Value was not loaded to %s:\n    --> Value:%s\n    --> Error text:%s",
+                                   cls.__tablename__, rows[0], err)
+                # summaries count only rows written by this process
+                if self.summaries is not None:
+                    self.summaries.discard(cls, rows[0])
+                # row loaded by another process is known, it is not queued again
+                if (statement is None or cls in self._insert_statements) and not self._exists(cls, rows[0]):
+                    self._forget(cls, rows[0])
+                return 0
+
+            # isolate bad rows: split failed batch until failed rows are loaded one by one
+            middle = len(rows) // 2
+            return self._bulk_insert(cls, rows[:middle], statement) + self._bulk_insert(cls, rows[middle:], statement)
+
+    def _get_pull_upsert_statement(self):
+        if self._pull_upsert_statement is None:
+            table = dto.GitPullRequest.__table__
+            update_columns = ["state", "title", "updated_at", "merged_at", "closed_at", "merge_commit_sha", "head_sha"]
+            self._pull_upsert_statement = upsert.upsert_statement(
+                self.session.get_bind().dialect.name, table, ["id"],
+                {c: "{new}." + c for c in update_columns},
+                "{new}.updated_at > {old}.updated_at OR {old}.updated_at IS NULL")
+
+        return self._pull_upsert_statement
+
+    def flush(self):
+        loaded_count = 0
+        for cls, rows in self._buffers.items():
+            if rows:
+                started = time.time()
+                loaded = self._bulk_insert(cls, rows, self._statement(cls))
+                crawl_metrics.METRICS.observe_flush(cls.__tablename__, loaded, time.time() - started)
+                self._logger.debug("Values were loaded to %s: %s of %s", cls.__tablename__, loaded, len(rows))
+                loaded_count += loaded
+                self._buffers[cls] = []
+
+        if self._pull_upserts:
+            started = time.time()
+            loaded = self._bulk_insert(dto.GitPullRequest, self._pull_upserts, self._get_pull_upsert_statement())
+            crawl_metrics.METRICS.observe_flush(dto.GitPullRequest.__tablename__ + "_upsert", loaded,
+                                                time.time() - started)
+            self._logger.debug("Values were upserted to %s: %s of %s", dto.GitPullRequest.__tablename__, loaded,
+                               len(self._pull_upserts))
+            loaded_count += loaded
+            self._pull_upserts = []
+
+        # summary deltas are computed from rows which are already in the database
+        if self.summaries is not None:
+            for cls, rows, statement in self.summaries.collect():
+                started = time.time()
+                loaded = self._bulk_insert(cls, rows, statement)
+                crawl_metrics.METRICS.observe_flush(cls.__tablename__, loaded, time.time() - started)
+
+        # files states are written after the files, so a pull is never marked collected without its files;
+        # pulls with file rows which failed to load keep their previous state and are collected again
+        if self._files_states:
+            states = [state for pull_id, state in self._files_states.items()
+                      if pull_id not in self._pulls_missing_files]
+            if len(states) < len(self._files_states):
+                self._logger.warning("Files of %s pull requests were not loaded completely, they are collected "
+                                     "again on the next run", len(self._files_states) - len(states))
+            if states:
+                self._bulk_insert(dto.GitPullFilesState, states, self._get_files_state_upsert_statement())
+            self._pulls_missing_files.difference_update(self._files_states)
+            self._files_states = {}
+
+        # checkpoints are written after the data they point to, so a restart never skips data
+        if self._checkpoints:
+            self._bulk_insert(dto.GitCrawlCheckpoint, list(self._checkpoints.values()),
+                              self._get_checkpoint_upsert_statement())
+            self._checkpoints = {}
+
+        self._buffered_count = 0
+        return loaded_count
 
     def add_repository(self, repository):
         if not repository or not isinstance(repository, dto.GitRepository):
-            self._logger.error("Repository value is None or wrong type argument: " + str(type(repository)))
+            self._logger.error("Repository value is None or wrong type argument: %s", type(repository))
             raise ValueError("Repository value is None or wrong type argument: " + str(type(repository)))
 
         if repository.owner_id is None:
-            self._logger.error("Repository owner is empty: " + str(repository))
+            self._logger.error("Repository owner is empty: %s", repository)
             raise ValueError("Repository owner is empty: " + str(repository))
 
         if repository.id in self.repositories:
-            self._logger.warning(">> SKIP: Repository was already loaded: " + str(repository))
+            self._logger.warning(">> SKIP: Repository was already loaded: %s", repository)
             return True
 
-        if self._load_data([repository]):
+        if repository.owner is not None and repository.owner_id not in self.users:
             self.users.add(repository.owner_id)
-            self.repositories.add(repository.id)
+            self._buffer(dto.GitUser, self._to_mapping(repository.owner))
 
-            self._logger.info("Repository was loaded to database: " + str(repository))
-        else:
-            self.session.rollback()
-            self._logger.error("Repository was not loaded: " + str(repository))
+        self.repositories.add(repository.id)
+        self._buffer(dto.GitRepository, self._to_mapping(repository))
+
+        # repositories are looked up by name right after loading, so do not keep them in buffer
+        self.flush()
+        if repository.id not in self.repositories:
+            self._logger.error("Repository was not loaded: %s", repository)
             return False
 
+        self._logger.info("Repository was loaded to database: %s", repository)
         return True
 
     def add_user(self, user):
-        if not user or not isinstance(user, dto.GitUser):
-            self._logger.error("User value is None or wrong type argument: " + str(type(user)))
+        """Buffer GitUser object or git_user row dict."""
+        if not user or not isinstance(user, (dto.GitUser, dict)):
+            self._logger.error("User value is None or wrong type argument: %s", type(user))
             raise ValueError("User value is None or wrong type argument: " + str(type(user)))
 
-        if user.id in self.users:
-            self._logger.warning(">> SKIP: User was already loaded: " + str(user))
+        row = self._to_mapping(user)
+        if row["id"] in self.users:
+            self._logger.warning(">> SKIP: User was already loaded: %s", user)
             return True
 
-        if self._load_data([user]):
-            self.users.add(user.id)
-            self._logger.info("User was loaded to database: " + str(user))
-        else:
-            self.session.rollback()
-            self._logger.error("User was not added to user list: " + str(user))
-            return False
+        self.users.add(row["id"])
+        self._buffer(dto.GitUser, row)
+        self._logger.info("User was added to load buffer: %s", user, extra=common.SAMPLED)
 
         return True
 
     def add_pull_request(self, pull):
-        if not pull or not isinstance(pull, dto.GitPullRequest):
-            self._logger.error("User value is None or wrong type argument: " + str(type(pull)))
+        """Buffer GitPullRequest object or git_pullrequest row dict."""
+        if not pull or not isinstance(pull, (dto.GitPullRequest, dict)):
+            self._logger.error("User value is None or wrong type argument: %s", type(pull))
             raise ValueError("User value is None or wrong type argument: " + str(type(pull)))
 
-        if pull.user_id is None or pull.repository_id is None:
-            self._logger.error("Pull request user or repository are empty: " + str(pull))
+        row = self._to_mapping(pull)
+        if row["user_id"] is None or row["repository_id"] is None:
+            self._logger.error("Pull request user or repository are empty: %s", pull)
             raise ValueError("Pull request user or repository are empty: " + str(pull))
 
-        if pull.id in self.pulls:
-            self._logger.warning(">> SKIP: Pull Request was already loaded: " + str(pull))
+        if row["id"] in self.pulls:
+            self._logger.warning(">> SKIP: Pull Request was already loaded: %s", pull)
             return True
 
-        if self._load_data([pull]):
-            self.users.add(pull.user_id)
-            self.pulls.add(pull.id)
-            self._logger.info("Pull Request was loaded to database: " + str(pull))
-        else:
-            self._logger.error("Pull Request was not added to user list: " + str(pull))
-            return False
+        self.pulls.add(row["id"])
+        if self.summaries is not None:
+            self.summaries.add_pull(row)
+        self._buffer(dto.GitPullRequest, row)
+        self._logger.info("Pull Request was added to load buffer: %s", pull, extra=common.SAMPLED)
+
+        return True
+
+    def upsert_pull_request(self, pull):
+        """
+        Refresh already loaded pull request. Row is updated in bulk on flush and only when
+        updated_at moved forward, so state changes (merged_at, closed_at, ...) are not lost.
+        """
+        if not pull or not isinstance(pull, (dto.GitPullRequest, dict)):
+            self._logger.error("Pull Request value is None or wrong type argument: %s", type(pull))
+            raise ValueError("Pull Request value is None or wrong type argument: " + str(type(pull)))
+
+        row = self._to_mapping(pull)
+        self.pulls.add(row["id"])
+        if self.summaries is not None:
+            self.summaries.add_pull(row, existing=True)
+        self._pull_upserts.append(row)
+        self._buffered_count += 1
+        self._logger.info("Pull Request was added to upsert buffer: %s", pull, extra=common.SAMPLED)
+        if self._buffered_count >= self.batch_size:
+            self.flush()
 
         return True
 
+    def get_path_id(self, repository_id, filename):
+        """Id of the file path in git_file_path, new paths are buffered for insert."""
+        key = (repository_id, filename)
+        path_id = self.paths.get(key)
+        if path_id is not None:
+            self.paths.move_to_end(key)
+            return path_id
+
+        # ids are hashes of the path, so they are known without a lookup and are the same in every process
+        path_id = self.paths[key] = id_index.path_id(repository_id, filename)
+        if len(self.paths) > self.path_cache_size:
+            self.paths.popitem(last=False)
+        self._buffer(dto.GitFilePath, {"id": path_id, "repository_id": repository_id, "filename": filename})
+        return path_id
+
     def add_pull_request_files(self, files):
-        if self._load_data(files):
-            self._logger.info("Pull Request files were loaded to database. Count: " + str(len(files)))
-            return True
-        else:
-            self.session.rollback()
-            self._logger.error("Pull Request files were not loaded to database. Count: " + str(len(files)))
-            return False
+        """
+        Buffer PullRequestFile objects or file row dicts. Rows with repository_id and filename
+        (see GitHubWalker._build_files) get path_id of git_file_path.
+        """
+        added_count = 0
+        for f in files:
+            row = self._to_mapping(f)
+            if "path_id" in row:
+                file_row = row
+            else:
+                file_row = {"pull_id": row["pull_id"],
+                            "path_id": self.get_path_id(row["repository_id"], row["filename"]),
+                            "sha": row["sha"], "status": row["status"], "additions": row["additions"],
+                            "deletions": row["deletions"], "changes": row["changes"]}
+            key = id_index.file_key(file_row["pull_id"], file_row["path_id"])
+            if key in self.files:
+                continue
+
+            self.files.add(key)
+            if self.summaries is not None and "filename" in row:
+                self.summaries.add_file(row)
+            self._buffer(dto.PullRequestFile, file_row)
+            added_count += 1
+
+        self._logger.info("Pull Request files were added to load buffer. Count: %s, skipped as already loaded: %s",
+                          added_count, len(files) - added_count, extra=common.SAMPLED)
+        return True
 
     def get_repositoryid_by_name(self, name):
         repo_id = self.session.query(dto.GitRepository.id).filter(dto.GitRepository.full_name == name).first()
         return repo_id
 
-    def _read_table(self, cls):
-        for row in self.session.query(cls):
-            yield row
+    def _get_checkpoint_upsert_statement(self):
+        if self._checkpoint_upsert_statement is None:
+            self._checkpoint_upsert_statement = upsert.upsert_statement(
+                self.session.get_bind().dialect.name, dto.GitCrawlCheckpoint.__table__, ["repository_id", "phase"],
+                {c: "{new}." + c for c in ["page", "cursor", "updated_at"]})
+
+        return self._checkpoint_upsert_statement
+
+    def get_checkpoints(self, repository_id):
+        rows = self.session.query(dto.GitCrawlCheckpoint).filter(dto.GitCrawlCheckpoint.repository_id == repository_id)
+        return {row.phase: row for row in rows}
+
+    def set_checkpoint(self, repository_id, phase, page=None, cursor=None):
+        self._checkpoints[(repository_id, phase)] = {
+            "repository_id": repository_id,
+            "phase": phase,
+            "page": page,
+            "cursor": cursor,
+            "updated_at": datetime.utcnow()
+        }
+
+    def clear_checkpoints(self, repository_id):
+        self.flush()
+        try:
+            self.session.query(dto.GitCrawlCheckpoint) \
+                .filter(dto.GitCrawlCheckpoint.repository_id == repository_id).delete(synchronize_session=False)
+            self.session.commit()
+            self._logger.info("Crawl checkpoints were cleared for repository: %s", repository_id)
+
+        except SQLAlchemyError as err:
+            self.session.rollback()
+            self._logger.error("Crawl checkpoints were not cleared for repository: %s. Error text:%s", repository_id,
+                               err)
+
+    def _get_files_state_upsert_statement(self):
+        if self._files_state_upsert_statement is None:
+            self._files_state_upsert_statement = upsert.upsert_statement(
+                self.session.get_bind().dialect.name, dto.GitPullFilesState.__table__, ["pull_id"],
+                {c: "{new}." + c for c in ["head_sha", "status", "files_count", "changed_files", "collected_at"]})
+
+        return self._files_state_upsert_statement
+
+    def get_files_states(self, repository_id):
+        """(pull_id, head_sha) of pulls of the repository with collected files."""
+        states, pulls = dto.GitPullFilesState, dto.GitPullRequest
+        query = self.session.query(states.pull_id, states.head_sha).join(pulls, pulls.id == states.pull_id) \
+            .filter(pulls.repository_id == repository_id).yield_per(self.load_chunk_size)
+        return set((row[0], row[1]) for row in query)
+
+    def set_files_state(self, pull_id, head_sha, status, files_count, changed_files=None):
+        self._files_states[pull_id] = {
+            "pull_id": pull_id,
+            "head_sha": head_sha,
+            "status": status,
+            "files_count": files_count,
+            "changed_files": changed_files,
+            "collected_at": datetime.utcnow()
+        }
+
+    def get_sync_state(self, repository_id, resource):
+        return self.session.query(dto.GitSyncState).get((repository_id, resource))
+
+    def save_sync_state(self, state):
+        # watermark must not get ahead of data, so buffered rows are loaded first
+        self.flush()
+        try:
+            self.session.merge(state)
+            self.session.commit()
+            self._logger.info("Sync state was saved: %s", state)
+            return True
+
+        except SQLAlchemyError as err:
+            self.session.rollback()
+            self._logger.error("Sync state was not saved: %s. Error text:%s", state, err)
+            return False
 
-    def dump_to_file(self, outdir):
+    def dump_to_file(self, outdir, **args):
+        self.flush()
 
-        for cls in dto.Base.__subclasses__():
+        table_exporter = exporter.TableExporter(self.session.get_bind(), **args)
 
-            filename = os.path.join(outdir, cls.__tablename__ + ".csv")
+        # files are exported with file names (git_pullrequest_file view) and partitioned by repository of their pull
+        files, pulls = dto.PULL_FILE_VIEW, dto.GitPullRequest.__table__
+        files_query = select([files, pulls.c.repository_id]).select_from(files.join(pulls, files.c.pull_id == pulls.c.id))
 
-            outfile = open(filename, 'w', newline="\n", encoding="utf-8")
-            outcsv = csv.writer(outfile)
-            outcsv.writerow([column.name for column in cls.__mapper__.columns])
-            [outcsv.writerow([getattr(curr, column.name) for column in cls.__mapper__.columns])
-             for curr in self._read_table(cls)]
-            # outcsv.writerows(records)
-            outfile.close()
+        counts = table_exporter.export([cls.__table__ for cls in dto.DATA_TABLES] + [files], outdir,
+                                       queries={files.name: files_query})
+        self._logger.info("Tables were exported to %s: %s", outdir, counts)
+        return counts
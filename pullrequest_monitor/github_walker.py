@@ -1,9 +1,15 @@
 import json
+import requests
+import time
 import common
+import crawl_metrics
 import logging
 import dto_requests_objects as dto
+import file_collector
 import github_loader
-import time
+import http_cache
+import payload
+import rate_limiter
 from datetime import datetime
 
 
@@ -11,18 +17,26 @@ class GitHubWalker:
 
     # def __init__(self, db_session, loader_config, connection_config):
     def __init__(self, db_session, **args):
-        self.rate_limits_url = "https://api.github.com/rate_limit"
-        self.repositiry_url = "https://api.github.com/repos/{repo}"
-        self.pull_request_url = "https://api.github.com/repos/{repo}/pulls"
-        self.pull_files_url = "https://api.github.com/repos/{repo}/pulls/{pull_number}/files"
-
         # set some defaults
+        self.api_url = "https://api.github.com"
         batch_size = 100
+        write_batch_size = 1000
+        load_chunk_size = 50000
+        path_cache_size = 100000
+        use_summaries = True
         log_level = "INFO"
         request_status = "all"
+        self.sync_mode = "full"
+        self.upsert_pulls = True
         self.repository_list = []
-        self.request_timeout = 0.5
-        self.rate_limit_timeout = 3600
+        self.concurrency = 8
+        self.transport = {}
+        self.rate_limit_burst = 10
+        self.rate_limit_retries = 3
+        self.response_cache = None
+        self.replay = False
+        log_settings = {}
+        cache_config = {}
 
         if "loader" in args.keys():
             loader_config_file = args["loader"]
@@ -30,17 +44,51 @@ class GitHubWalker:
                 self.loader_config = json.load(json_file)
 
             log_level = self.loader_config["log_level"]
+            log_settings = common.log_settings(self.loader_config)
             batch_size = self.loader_config["batch_size"]
+            write_batch_size = self.loader_config.get("write_batch_size", write_batch_size)
+            load_chunk_size = self.loader_config.get("load_chunk_size", load_chunk_size)
+            path_cache_size = self.loader_config.get("path_cache_size", path_cache_size)
+            use_summaries = self.loader_config.get("summary_tables", "Y") == "Y"
             request_status = self.loader_config["request_params"]["request_status"]
             self.repository_list = self.loader_config["repositories"]
-            self.request_timeout = self.loader_config["request_params"]["timeout"]
-
-        self._logger = logging.getLogger("GitHubWalker")
-        self._logger.addHandler(common.get_file_handler())
-        self._logger.addHandler(common.get_console_handler())
-        self._logger.setLevel(log_level)
-        self._logger.info("Configured log level is: " + logging.getLevelName(self._logger.getEffectiveLevel()))
-        self._logger.info("Repositories list is: " + str(self.repository_list))
+            self.api_url = self.loader_config.get("api_url", self.api_url).rstrip("/")
+            self.sync_mode = self.loader_config.get("sync_mode", self.sync_mode)
+            self.upsert_pulls = self.loader_config.get("upsert_pulls", "Y") == "Y"
+            self.rate_limit_burst = self.loader_config["request_params"].get("rate_limit_burst",
+                                                                             self.rate_limit_burst)
+            self.rate_limit_retries = self.loader_config["request_params"].get("rate_limit_retries",
+                                                                               self.rate_limit_retries)
+            self.concurrency = self.loader_config["request_params"].get("concurrency", self.concurrency)
+            self.transport = {k: self.loader_config["request_params"][k]
+                              for k in ("retries", "backoff_factor", "pool_size")
+                              if k in self.loader_config["request_params"]}
+            if "http_timeout" in self.loader_config["request_params"]:
+                self.transport["timeout"] = self.loader_config["request_params"]["http_timeout"]
+            self.transport["http2"] = self.loader_config["request_params"].get("http2", "N") == "Y"
+
+            cache_config = self.loader_config.get("http_cache", {})
+
+        common.configure_logging(**log_settings)
+        self.log_level = log_level
+        self._logger = common.get_logger("GitHubWalker", log_level)
+        # the cache is opened after logging is configured, its logger would configure logging with defaults
+        if cache_config.get("enabled", "N") == "Y":
+            self.response_cache = http_cache.ResponseCache(
+                cache_config.get("path", "cache/github_responses.db"),
+                max_age=cache_config.get("max_age_days", 30) * 24 * 3600,
+                max_size=cache_config.get("max_size_mb", 2048) * 1024 * 1024, log_level=log_level)
+            self.replay = cache_config.get("replay", "N") == "Y"
+        self._logger.info("Configured log level is: %s", logging.getLevelName(self._logger.getEffectiveLevel()))
+        self._logger.info("Repositories list is: %s", self.repository_list)
+        if "loader" in args.keys() and "timeout" in self.loader_config["request_params"]:
+            # the key used to be a pause between requests, it is not taken as HTTP timeout
+            self._logger.warning("request_params.timeout is ignored, HTTP timeout is set by request_params.http_timeout")
+
+        self.rate_limits_url = self.api_url + "/rate_limit"
+        self.repositiry_url = self.api_url + "/repos/{repo}"
+        self.pull_request_url = self.api_url + "/repos/{repo}/pulls"
+        self.pull_files_url = self.api_url + "/repos/{repo}/pulls/{pull_number}/files"
 
         github_key = ""
         if "connections" in args.keys():
@@ -50,65 +98,138 @@ class GitHubWalker:
 
             github_key = self.security_config["github"]["github_token"]
 
+        # explicit token has priority over connections config, e.g. token pool of sharded crawl
+        if "github_token" in args.keys():
+            github_key = args["github_token"]
+
         self.pull_request_parameters = {
             "page": 1,
             "per_page": batch_size,
             "state": request_status
         }
-        self._logger.info("Pull Requests parameters are: " + str(self.pull_request_parameters))
+        self._logger.info("Pull Requests parameters are: %s", self.pull_request_parameters)
+
+        # incremental mode: most recently updated pulls first, so paging can stop at the watermark
+        self.incremental_request_parameters = dict(self.pull_request_parameters, sort="updated", direction="desc")
+        self._logger.info("Sync mode is: %s", self.sync_mode)
 
         self.files_request_parameters = {
             "page": 1,
             "per_page": batch_size
         }
-        self._logger.info("Files Request parameters are: " + str(self.files_request_parameters))
-
-        self.request_session = common.configure_http_session(github_key)
-        self.rate_limit, self.reset_period = self._get_rate_limits()
-        self.ghl = github_loader.GitHubLoader(db_session, log_level=log_level)
+        self._logger.info("Files Request parameters are: %s", self.files_request_parameters)
+
+        # every crawl thread may hold a connection, fetch stage of pipeline mode runs one more thread
+        self.transport.setdefault("pool_size", self.concurrency + 2)
+        self._logger.info("HTTP transport settings are: %s", self.transport)
+        self.request_session = common.configure_http_session(github_key, cache=self.response_cache,
+                                                             replay=self.replay, log_level=log_level,
+                                                             **self.transport)
+        # nothing is sent to GitHub in replay mode, so requests are not paced
+        self.rate_limiter = rate_limiter.RateLimiter(burst=self.rate_limit_burst, enabled=not self.replay,
+                                                     log_level=log_level)
+        if self.replay:
+            self._logger.info("Replay mode: responses are served from cache only")
+        self._get_rate_limits()
+        self.ghl = github_loader.GitHubLoader(db_session, log_level=log_level, batch_size=write_batch_size,
+                                              load_chunk_size=load_chunk_size, path_cache_size=path_cache_size,
+                                              summaries=use_summaries)
+        self.file_collector = file_collector.FileCollector(self, concurrency=self.concurrency, log_level=log_level)
+        # repositories of the last pull_requests_walk which were not walked to the end, e.g. stopped at a failed page
+        self.failed_repositories = set()
 
     def _get_rate_limits(self):
+        # rate_limit endpoint is not counted against the budget, use it to seed the limiter
         rsp = self.request_session.get(self.rate_limits_url)
-        remaining = 0
-        reset = time.time()
-        if rsp.status_code == 200:
-            rsp = rsp.json()
-            remaining = rsp["resources"]["core"]["remaining"]
-            reset = rsp["resources"]["core"]["reset"]
-            self._logger.info("Remaining rate limit for CORE is: " + str(remaining))
-
-        return remaining, reset
-
-    def _make_request(self, url, params=None):
-        result = {}
+        self.rate_limiter.update(rsp)
+        self._logger.info("Remaining rate limit for CORE is: %s", self.rate_limiter.remaining)
+
+        return self.rate_limiter.remaining, self.rate_limiter.reset_at
+
+    def _send_request(self, url, params=None, headers=None):
+        endpoint = crawl_metrics.endpoint_name(url)
+        for attempt in range(self.rate_limit_retries + 1):
+            crawl_metrics.METRICS.observe_rate_limit_wait(self.rate_limiter.name, self.rate_limiter.acquire())
+            started = time.time()
+            response = self.request_session.get(url, params=params, headers=headers)
+            crawl_metrics.METRICS.observe_request(endpoint, response, time.time() - started)
+            if not self.rate_limiter.update(response):
+                break
+            self._logger.warning("Request was rate limited: %s with params :%s. Attempt: %s", url, params, attempt + 1)
+
+        return response
+
+    def _get_response(self, url, params=None, headers=None):
         try:
-            response = self.request_session.get(url, params=params)
-            if response.status_code == 200:
-                result = response.json()
+            response = self._send_request(url, params=params, headers=headers)
+            if response.status_code in (200, 304):
+                return response
             elif response.status_code == 404:
-                self._logger.error("Object Not Found:  " + url + " with params :" + str(params) + ". Status code: " +
-                                   str(response.status_code))
+                self._logger.error("Object Not Found:  %s with params :%s. Status code: %s", url, params,
+                                   response.status_code)
             else:
-                self._logger.error("Error occurred for:  " + url + " with params :" + str(params) + ". Status code: " +
-                                   str(response.status_code))
-
-        except self.request_session.exceptions.HTTPError or self.request_session.exceptions.ConnectionError or \
-                self.request_session.exceptions.Timeout or self.request_session.exceptions.RequestException as errh:
-            self._logger.error("Error occurred while sending requests to " + url + " with params :" + str(params) +
-                               ". Error :" + str(errh))
-
-        return result
+                self._logger.error("Error occurred for:  %s with params :%s. Status code: %s", url, params,
+                                   response.status_code)
+
+        except requests.exceptions.RequestException as err:
+            # connection errors and timeouts which are left after retries of the transport
+            self._logger.error("Error occurred while sending requests to %s with params :%s. Error :%s", url, params,
+                               err)
+
+        return None
+
+    def _make_request(self, url, params=None, decode=payload.loads):
+        """
+        Decoded body of 200 response or {} on error. Pages of pulls and files are decoded with payload.pulls
+        and payload.files, which keep only the fields used by the walker.
+        """
+        response = self._get_response(url, params=params)
+        if response is not None and response.status_code == 200:
+            return decode(response.content)
+
+        return {}
+
+    def _get_pulls(self, url, params):
+        """
+        Page of pull requests or None when it was not received. A failed page is not an empty one:
+        the walk of the repository stops there and is resumed from the checkpoint on the next run.
+        """
+        return self._get_pulls_page(url, params)[0]
+
+    def _get_pulls_page(self, url, params):
+        """Page of pull requests (see _get_pulls) and number of the last page from its Link header or None."""
+        response = self._get_response(url, params=params)
+        if response is None or response.status_code != 200:
+            return None, None
+
+        pulls = payload.pulls(response.content)
+        if not isinstance(pulls, list):
+            return None, None
+        return pulls, file_collector.last_page(response, pulls, params["per_page"])
+
+    def _make_conditional_request(self, url, params=None, state=None):
+        """
+        GET with validators stored in sync state. 304 Not Modified answers are not counted against rate limit.
+        Returns response or None on error.
+        """
+        headers = {}
+        if state is not None:
+            if state.etag:
+                headers["If-None-Match"] = state.etag
+            if state.last_modified:
+                headers["If-Modified-Since"] = state.last_modified
+
+        return self._get_response(url, params=params, headers=headers)
 
     def repository_walk(self):
         loaded_count = 0
         for repo in self.repository_list:
-            if self.rate_limit <= 0:
-                self._logger.info("Rate limits exceeded")
-                self.rate_limit, self.reset_period = self._get_rate_limits()
-                time.sleep(self.reset_period - round(time.time()))
-                self._logger.info("Rate limits refreshed")
+            self._logger.info("Current repository is: %s", repo)
+            result = self.ghl.get_repositoryid_by_name(repo)
+            if result and self.ghl.get_checkpoints(result[0]):
+                self._logger.info("Crawl of repository %s is resumed, repository is already loaded", repo)
+                continue
 
-            self._logger.info("Current repository is: " + repo)
             rr = self._make_request(url=self.repositiry_url.format(repo=repo))
 
             # consider correct answer if we have "id" field
@@ -126,131 +247,214 @@ class GitHubWalker:
                 gr.owner_id = owner.id
                 gr.owner = owner
 
-                self._logger.info("Repository object created: " + str(gr))
-                self._logger.info("Repository owner object created: " + str(owner))
+                self._logger.info("Repository object created: %s", gr)
+                self._logger.info("Repository owner object created: %s", owner)
 
                 if self.ghl.add_repository(gr):
                     loaded_count += 1
-
-                self.rate_limit -= 1
             else:
-                self._logger.error("Repository not found: " + repo)
-
-            time.sleep(self.request_timeout)
+                self._logger.error("Repository not found: %s", repo)
 
         return loaded_count
 
+    def _build_files(self, pull_id, repository_id, files):
+        # git_pull_file rows with file names, loader replaces names with ids of git_file_path
+        received_files = []
+        debug = self._logger.isEnabledFor(logging.DEBUG)
+        for f in files:
+            if debug:
+                self._logger.debug("    --> Filename is :%s", f["filename"], extra=common.SAMPLED)
+            received_files.append({
+                "pull_id": pull_id,
+                "repository_id": repository_id,
+                "filename": f["filename"],
+                "sha": f["sha"],
+                "status": f["status"],
+                "additions": f["additions"],
+                "deletions": f["deletions"],
+                "changes": f["changes"]
+            })
+
+        return received_files
+
+    def _parse_pull(self, pull, repository_id):
+        """
+        git_user and git_pullrequest rows from pull payload. Loader is not used here,
+        so parsing may run outside of the thread owning the database session.
+        """
+        self._logger.info("   --> Starting processing pull with ID=%s", pull["id"], extra=common.SAMPLED)
+        gu = pull["user"]
+        user = {"id": gu["id"], "login": gu["login"], "user_url": gu["html_url"], "user_type": gu["type"]}
+
+        row = {
+            "id": pull["id"],
+            "pull_number": pull["number"],
+            "url": pull["url"],
+            "state": pull["state"],
+            "title": pull["title"],
+            "created_at": payload.parse_timestamp(pull["created_at"]),
+            "updated_at": payload.parse_timestamp(pull["updated_at"]),
+            "merged_at": payload.parse_timestamp(pull["merged_at"]),
+            "closed_at": payload.parse_timestamp(pull["closed_at"]),
+            "merge_commit_sha": pull["merge_commit_sha"],
+            "head_sha": pull["head"]["sha"] if pull.get("head") else None,
+            "user_id": gu["id"],
+            "repository_id": repository_id
+        }
+
+        return user, row
+
+    def _load_pull(self, user, row):
+        pull_id = row["id"]
+        debug = self._logger.isEnabledFor(logging.DEBUG)
+        if user["id"] not in self.ghl.users:
+            self.ghl.add_user(user)
+            if debug:
+                self._logger.debug("   --> User %s added to git_user table.", user["login"], extra=common.SAMPLED)
+
+        if pull_id in self.ghl.pulls and not self.upsert_pulls:
+            self._logger.warning("   --> Pull request with ID=%s skipped", pull_id)
+            return False
+
+        if pull_id in self.ghl.pulls:
+            if debug:
+                self._logger.debug("   --> Pull request %s already exists, refreshing it.", pull_id,
+                                   extra=common.SAMPLED)
+            self.ghl.upsert_pull_request(row)
+            return False
+
+        if self.ghl.add_pull_request(row):
+            self._logger.info("Pull request with ID=%s added", pull_id, extra=common.SAMPLED)
+            return True
+
+        return False
+
+    def _process_pull(self, pull, repository_id):
+        user, row = self._parse_pull(pull, repository_id)
+        return self._load_pull(user, row)
+
     def pull_requests_walk(self, collect_files=True):
         loaded_count = 0
-        dt_fmt = "%Y-%m-%dT%H:%M:%SZ"
+        self.failed_repositories = set()
         for repo in self.repository_list:
             result = self.ghl.get_repositoryid_by_name(repo)
-            self._logger.info("Get pull requests info. Current repository is: " + repo)
+            self._logger.info("Get pull requests info. Current repository is: %s", repo)
 
-            if result:
+            if result and self.sync_mode == "incremental":
+                loaded_count += self._incremental_pull_requests_walk(repo, result[0], collect_files)
+            elif result:
                 repository_id = result[0]
-                while True:
-                    if self.rate_limit <= 0:
-                        self._logger.info("Rate limits exceeded")
-                        self.rate_limit, self.reset_period = self._get_rate_limits()
-                        time.sleep(self.reset_period - round(time.time()))
-                        self._logger.info("Rate limits refreshed")
+                params = dict(self.pull_request_parameters)
 
-                    pulls = self._make_request(url=self.pull_request_url.format(repo=repo),
-                                               params=self.pull_request_parameters)
-                    self.rate_limit -= 1
+                checkpoints = self.ghl.get_checkpoints(repository_id)
+                if "pulls" in checkpoints:
+                    params["page"] = checkpoints["pulls"].page
+                    self._logger.info("Resuming pull requests walk from page %s", params["page"])
 
-                    self._logger.info("Pulls count received for page " + str(self.pull_request_parameters["page"])
-                                      + " is :" + str(len(pulls)))
+                completed = False
+                while True:
+                    pulls = self._get_pulls(self.pull_request_url.format(repo=repo), params)
+                    if pulls is None:
+                        self._logger.error("Pull requests walk of %s stopped at page %s, it is resumed from there on "
+                                           "the next run", repo, params["page"])
+                        self.failed_repositories.add(repo)
+                        break
 
-                    if len(pulls) > 0:
-                        self.pull_request_parameters["page"] += 1
+                    self._logger.info("Pulls count received for page %s is :%s", params["page"], len(pulls))
 
+                    if len(pulls) > 0:
                         for pull in pulls:
-                            pull_id = pull["id"]
-                            pull_number = pull["number"]
-                            self._logger.info("   --> Starting processing pull with ID=" + str(pull_id))
-                            gu = pull["user"]
-                            if gu["id"] not in self.ghl.users:
-                                self._logger.debug("   --> User " + gu["login"] + " doesn't exist in git_user table.")
-                                git_user = dto.GitUser(id=gu["id"], login=gu["login"])
-                                git_user.user_url = gu["html_url"]
-                                git_user.user_type = gu["type"]
-                                self._logger.debug("   --> User " + gu["login"] + " added to git_user table.")
-
-                                self.ghl.add_user(git_user)
-
-                            if pull["id"] not in self.ghl.pulls:
-
-                                self._logger.debug("   --> Pull request " + str(pull_id) +
-                                                   " doesn't exist in git_pullrequest table.")
-
-                                gpr = dto.GitPullRequest(url=pull["url"], id=pull_id)
-                                gpr.user_id = gu["id"]
-                                gpr.state = pull["state"]
-                                gpr.created_at = datetime.strptime(pull["created_at"], dt_fmt)
-                                gpr.merge_commit_sha = pull["merge_commit_sha"]
-                                gpr.title = pull["title"]
-                                gpr.repository_id = repository_id
-                                gpr.pull_number = pull_number
-                                # print(">>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>> " + str(pull["updated_at"]))
-
-                                if pull["updated_at"]:
-                                    gpr.updated_at = datetime.strptime(pull["updated_at"], dt_fmt)
-                                if pull["closed_at"]:
-                                    gpr.closed_at = datetime.strptime(pull["closed_at"], dt_fmt)
-                                if pull["merged_at"]:
-                                    gpr.merged_at = datetime.strptime(pull["merged_at"], dt_fmt)
-
-                                if self.ghl.add_pull_request(gpr):
-                                    loaded_count += 1
-                                    self._logger.info("Pull request with ID=" + str(pull["id"]) + " added")
-                            else:
-                                self._logger.warning("   --> Pull request with ID=" + str(pull["id"]) + " skipped")
-
-                            if collect_files:
-                                self.pull_request_files_walk(repo, pull_id, pull_number)
+                            if self._process_pull(pull, repository_id):
+                                loaded_count += 1
+
+                        # files of pulls collected before restart are skipped by the collector
+                        if collect_files:
+                            self.file_collector.collect(repo, repository_id, pulls)
+
+                        params["page"] += 1
+                        self.ghl.set_checkpoint(repository_id, "pulls", page=params["page"])
 
                     else:
+                        completed = True
                         break
+
+                if completed:
+                    self.ghl.clear_checkpoints(repository_id)
+                self.file_collector.release(repository_id)
             else:
-                self._logger.warning("Unable to get repository id for repository name = " + repo)
-            self.pull_request_parameters["page"] = 1
+                self._logger.warning("Unable to get repository id for repository name = %s", repo)
+                self.failed_repositories.add(repo)
+            self.ghl.flush()
 
+        self.file_collector.close()
         return loaded_count
 
-    def pull_request_files_walk(self, repository, pull_id, pull_number):
-        self._logger.info("    --> Starting pull request files processing for request number: " + str(pull_number))
+    def _incremental_pull_requests_walk(self, repo, repository_id, collect_files=True):
+        loaded_count = 0
+        state = self.ghl.get_sync_state(repository_id, "pulls")
+        if state is None:
+            state = dto.GitSyncState(repository_id=repository_id, resource="pulls")
+        self._logger.info("Incremental pulls walk. Current sync state is: %s", state)
+
+        url = self.pull_request_url.format(repo=repo)
+        params = dict(self.incremental_request_parameters)
+        new_watermark = state.watermark
+        etag, last_modified = state.etag, state.last_modified
+        completed = True
         while True:
-            self._logger.info("    --> Processing page : " + str(self.files_request_parameters["page"]))
-            if self.rate_limit <= 0:
-                self._logger.warning("Rate limits exceeded")
-                self.rate_limit, self.reset_period = self._get_rate_limits()
-                time.sleep(self.reset_period - round(time.time()))
-                self._logger.info("Rate limits refreshed")
-
-            files = self._make_request(url=self.pull_files_url.format(repo=repository, pull_number=pull_number),
-                                       params=self.files_request_parameters)
-            received_files = []
-            for f in files:
-                self._logger.debug("    --> Filename is :" + f["filename"])
-                # github_logger.info("File recieved: " + str(f))
-                ghf = dto.PullRequestFile(pull_id=pull_id, sha=f["sha"], filename=f["filename"])
-                ghf.status = f["status"]
-                ghf.additions = f["additions"]
-                ghf.changes = f["changes"]
-                ghf.deletions = f["deletions"]
-                ghf.contents_url = f["contents_url"]
-
-                received_files.append(ghf)
-
-            self.ghl.add_pull_request_files(received_files)
-            self.rate_limit -= 1
-            time.sleep(self.request_timeout)
-
-            if len(received_files) < self.files_request_parameters["per_page"]:
-                break
+            if params["page"] == 1:
+                response = self._make_conditional_request(url, params=params, state=state)
             else:
-                self.files_request_parameters["page"] += 1
+                response = self._get_response(url, params=params)
+
+            if response is None:
+                # watermark is not moved forward after failed request, next run will repeat the pages
+                self.failed_repositories.add(repo)
+                completed = False
+                break
+
+            if response.status_code == 304:
+                self._logger.info("Pull requests were not modified since last sync for repository: %s", repo)
+                break
 
-        self.files_request_parameters["page"] = 1
+            pulls = payload.pulls(response.content)
+            self._logger.info("Pulls count received for page %s is :%s", params["page"], len(pulls))
+
+            if params["page"] == 1:
+                etag = response.headers.get("ETag")
+                last_modified = response.headers.get("Last-Modified")
+
+            watermark_reached = False
+            processed = []
+            for pull in pulls:
+                updated_at = payload.parse_timestamp(pull["updated_at"])
+                # equal timestamps are processed again, pulls updated within the same second could be missed otherwise
+                if state.watermark is not None and updated_at < state.watermark:
+                    watermark_reached = True
+                    break
+
+                if new_watermark is None or updated_at > new_watermark:
+                    new_watermark = updated_at
+
+                if self._process_pull(pull, repository_id):
+                    loaded_count += 1
+                processed.append(pull)
+
+            # pulls refreshed without new commits keep their files
+            if collect_files:
+                self.file_collector.collect(repo, repository_id, processed)
+
+            if watermark_reached or len(pulls) < params["per_page"]:
+                break
+
+            params["page"] += 1
+
+        if completed:
+            state.watermark = new_watermark
+            state.etag = etag
+            state.last_modified = last_modified
+            state.synced_at = datetime.utcnow()
+            self.ghl.save_sync_state(state)
+        self.file_collector.release(repository_id)
+
+        return loaded_count
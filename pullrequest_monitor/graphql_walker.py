@@ -0,0 +1,252 @@
+import requests
+import time
+from datetime import datetime
+import common
+import crawl_metrics
+import dto_requests_objects as dto
+import github_walker
+import payload
+import rate_limiter
+
+
+PULLS_QUERY = """
+query($owner: String!, $name: String!, $pulls: Int!, $after: String, $files: Int!, $order: IssueOrderField!) {
+  repository(owner: $owner, name: $name) {
+    pullRequests(first: $pulls, after: $after, orderBy: {field: $order, direction: DESC}) {
+      pageInfo { hasNextPage endCursor }
+      nodes {
+        databaseId number state title createdAt updatedAt mergedAt closedAt headRefOid changedFiles
+        mergeCommit { oid }
+        author { __typename login url ... on User { databaseId } ... on Bot { databaseId } }
+        files(first: $files) {
+          pageInfo { hasNextPage endCursor }
+          nodes { path additions deletions changeType }
+        }
+      }
+    }
+  }
+}
+"""
+
+FILES_QUERY = """
+query($owner: String!, $name: String!, $number: Int!, $after: String, $files: Int!) {
+  repository(owner: $owner, name: $name) {
+    pullRequest(number: $number) {
+      files(first: $files, after: $after) {
+        pageInfo { hasNextPage endCursor }
+        nodes { path additions deletions changeType }
+      }
+    }
+  }
+}
+"""
+
+# GraphQL enums to values used by REST API and stored in database
+PULL_STATES = {"OPEN": "open", "CLOSED": "closed", "MERGED": "closed"}
+FILE_STATUSES = {"ADDED": "added", "DELETED": "removed", "MODIFIED": "modified", "RENAMED": "renamed",
+                 "COPIED": "copied", "CHANGED": "changed"}
+
+# deleted accounts are returned as null author, REST API shows them as "ghost" user
+GHOST_USER = {"id": 10137, "login": "ghost", "html_url": "https://github.com/ghost", "type": "User"}
+
+
+class GraphQLGitHubWalker(github_walker.GitHubWalker):
+    """
+    GraphQL v4 fetch mode: pull requests are requested in batches together with their changed files,
+    so collecting files does not need a REST call per pull. Files connections of pulls with more files
+    than fit into the batch query are paged by cursor with a separate query per pull. Pulls whose files are
+    collected for their head commit are not paged (FileCollector), changedFiles marks truncated files lists.
+
+    Results are converted to REST payload shape and loaded by the same code as REST mode.
+    GraphQL does not return blob sha of files, so PullRequestFile.sha stays empty, head commit of the pull
+    request is kept in head_sha for contents_url of git_pullrequest_file view.
+
+    Full sync keeps the end cursor of the last loaded batch in git_crawl_checkpoint (phase "graphql_pulls"),
+    an interrupted walk is resumed from it. Incremental sync orders pulls by update time, cursors of such
+    walk are not stable, so it starts from the most recently updated pull on every run and moves the watermark
+    only after the walk is completed, the same as REST incremental sync.
+    """
+
+    def __init__(self, db_session, **args):
+        super().__init__(db_session, **args)
+        self.graphql_url = self.api_url + "/graphql"
+
+        self.graphql_pulls = 50
+        self.graphql_files = 100
+        if "loader" in args.keys():
+            graphql_config = self.loader_config.get("graphql", {})
+            self.graphql_pulls = graphql_config.get("pulls_per_query", self.graphql_pulls)
+            self.graphql_files = graphql_config.get("files_per_query", self.graphql_files)
+
+        # GraphQL API has its own budget of points
+        self.graphql_rate_limiter = rate_limiter.RateLimiter(burst=self.rate_limit_burst, name="graphql",
+                                                             enabled=not self.replay, log_level=self.log_level)
+        self._logger.info("GraphQL fetch mode. Pulls per query: %s, files per query: %s", self.graphql_pulls,
+                          self.graphql_files)
+
+    def _graphql(self, query, variables):
+        try:
+            for attempt in range(self.rate_limit_retries + 1):
+                crawl_metrics.METRICS.observe_rate_limit_wait(self.graphql_rate_limiter.name,
+                                                              self.graphql_rate_limiter.acquire())
+                started = time.time()
+                response = self.request_session.post(self.graphql_url, json={"query": query, "variables": variables})
+                crawl_metrics.METRICS.observe_request("graphql", response, time.time() - started)
+                if not self.graphql_rate_limiter.update(response):
+                    break
+                self._logger.warning("GraphQL request was rate limited. Attempt: %s", attempt + 1)
+
+        except requests.exceptions.RequestException as err:
+            self._logger.error("Error occurred while sending GraphQL request with variables :%s. Error :%s", variables,
+                               err)
+            return None
+
+        if response.status_code != 200:
+            self._logger.error("GraphQL request failed with variables :%s. Status code: %s", variables,
+                               response.status_code)
+            return None
+
+        body = payload.loads(response.content)
+        if body.get("errors"):
+            self._logger.error("GraphQL request returned errors for variables :%s. Errors: %s", variables,
+                               body["errors"])
+        return body.get("data")
+
+    def _to_rest_pull(self, repo, node):
+        author = node["author"]
+        if author is None or author.get("databaseId") is None:
+            user = GHOST_USER
+        else:
+            user = {"id": author["databaseId"], "login": author["login"], "html_url": author["url"],
+                    "type": author["__typename"]}
+
+        return {
+            "id": node["databaseId"],
+            "number": node["number"],
+            "url": self.pull_request_url.format(repo=repo) + "/" + str(node["number"]),
+            "state": PULL_STATES.get(node["state"], node["state"].lower()),
+            "title": node["title"],
+            "created_at": node["createdAt"],
+            "updated_at": node["updatedAt"],
+            "closed_at": node["closedAt"],
+            "merged_at": node["mergedAt"],
+            "merge_commit_sha": node["mergeCommit"]["oid"] if node["mergeCommit"] else None,
+            "head": {"sha": node["headRefOid"]},
+            "user": user
+        }
+
+    def _to_rest_files(self, nodes):
+        return [{
+            "sha": None,
+            "filename": f["path"],
+            "status": FILE_STATUSES.get(f["changeType"], f["changeType"].lower()),
+            "additions": f["additions"],
+            "deletions": f["deletions"],
+            "changes": f["additions"] + f["deletions"]
+        } for f in nodes]
+
+    def _pull_files_walk(self, owner, name, repository_id, pull, node):
+        # called for pulls with pending files only, files of the batch query are the first page
+        pull_id = pull["id"]
+        files = node["files"]
+        self.ghl.add_pull_request_files(self._build_files(pull_id, repository_id, self._to_rest_files(files["nodes"])))
+        files_count = len(files["nodes"])
+
+        while files["pageInfo"]["hasNextPage"]:
+            self._logger.info("    --> Requesting next files page for request number: %s", node["number"],
+                              extra=common.SAMPLED)
+            data = self._graphql(FILES_QUERY, {"owner": owner, "name": name, "number": node["number"],
+                                               "after": files["pageInfo"]["endCursor"], "files": self.graphql_files})
+            if not data or not data["repository"]["pullRequest"]:
+                self._logger.warning("Files of pull request %s are incomplete, they are requested again on the next run",
+                                     node["number"])
+                return
+
+            files = data["repository"]["pullRequest"]["files"]
+            self.ghl.add_pull_request_files(self._build_files(pull_id, repository_id,
+                                                              self._to_rest_files(files["nodes"])))
+            files_count += len(files["nodes"])
+
+        self.file_collector.mark(repository_id, pull, files_count, node.get("changedFiles"))
+
+    def pull_requests_walk(self, collect_files=True):
+        loaded_count = 0
+        self.failed_repositories = set()
+        for repo in self.repository_list:
+            result = self.ghl.get_repositoryid_by_name(repo)
+            self._logger.info("Get pull requests info with GraphQL. Current repository is: %s", repo)
+            if not result:
+                self._logger.warning("Unable to get repository id for repository name = %s", repo)
+                self.failed_repositories.add(repo)
+                continue
+
+            repository_id = result[0]
+            owner, name = repo.split("/")
+            if collect_files:
+                self.file_collector.prepare(repository_id)
+
+            state = None
+            new_watermark = None
+            if self.sync_mode == "incremental":
+                state = self.ghl.get_sync_state(repository_id, "pulls")
+                if state is None:
+                    state = dto.GitSyncState(repository_id=repository_id, resource="pulls")
+                new_watermark = state.watermark
+
+            variables = {"owner": owner, "name": name, "pulls": self.graphql_pulls, "after": None,
+                         "files": self.graphql_files if collect_files else 0,
+                         "order": "UPDATED_AT" if state is not None else "CREATED_AT"}
+            if state is None:
+                checkpoints = self.ghl.get_checkpoints(repository_id)
+                if "graphql_pulls" in checkpoints:
+                    variables["after"] = checkpoints["graphql_pulls"].cursor
+                    self._logger.info("Resuming pull requests walk from cursor %s", variables["after"])
+            completed = True
+            while True:
+                data = self._graphql(PULLS_QUERY, variables)
+                if not data or not data["repository"]:
+                    completed = False
+                    self.failed_repositories.add(repo)
+                    break
+
+                pulls = data["repository"]["pullRequests"]
+                self._logger.info("Pulls count received for cursor %s is :%s", variables["after"], len(pulls["nodes"]))
+
+                watermark_reached = False
+                for node in pulls["nodes"]:
+                    pull = self._to_rest_pull(repo, node)
+                    if state is not None:
+                        updated_at = payload.parse_timestamp(pull["updated_at"])
+                        if state.watermark is not None and updated_at < state.watermark:
+                            watermark_reached = True
+                            break
+                        if new_watermark is None or updated_at > new_watermark:
+                            new_watermark = updated_at
+
+                    if self._process_pull(pull, repository_id):
+                        loaded_count += 1
+
+                    if collect_files and self.file_collector.pending(repository_id, [pull]):
+                        self._pull_files_walk(owner, name, repository_id, pull, node)
+
+                if watermark_reached or not pulls["pageInfo"]["hasNextPage"]:
+                    break
+                variables["after"] = pulls["pageInfo"]["endCursor"]
+                if state is None:
+                    # batch is loaded with its files, restart continues from the next one
+                    self.ghl.set_checkpoint(repository_id, "graphql_pulls", cursor=variables["after"])
+
+            if state is not None and completed:
+                state.watermark = new_watermark
+                state.synced_at = datetime.utcnow()
+                self.ghl.save_sync_state(state)
+            elif state is None and completed:
+                self.ghl.clear_checkpoints(repository_id)
+            elif state is None:
+                self._logger.error("Pull requests walk of %s stopped at cursor %s, it is resumed from there on "
+                                   "the next run", repo, variables["after"])
+
+            self.ghl.flush()
+            self.file_collector.release(repository_id)
+
+        return loaded_count
@@ -0,0 +1,170 @@
+import json
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from urllib.parse import urlencode
+import requests
+from requests.structures import CaseInsensitiveDict
+import common
+
+
+# response headers worth keeping, rate limit headers are not replayed
+CACHED_HEADERS = ["Content-Type", "ETag", "Last-Modified", "Link"]
+
+
+class ResponseCache:
+    """
+    On-disk cache of GitHub API responses in a sqlite file.
+
+    Entries are keyed by URL and sorted query parameters and keep zlib compressed body, ETag and fetch time.
+    Entries older than max_age seconds are evicted, then the oldest entries are evicted while total
+    body size is over max_size bytes. Eviction runs on open and every evict_every stored responses.
+    """
+
+    def __init__(self, path, max_age=None, max_size=None, evict_every=1000, log_level=None):
+        self._logger = common.get_logger("ResponseCache", log_level)
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS responses ("
+                           "  key TEXT PRIMARY KEY, url TEXT NOT NULL, status INTEGER NOT NULL,"
+                           "  headers TEXT, etag TEXT, body BLOB, size INTEGER NOT NULL, fetched_at REAL NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_fetched_at ON responses (fetched_at)")
+        self._conn.commit()
+
+        self.max_age = max_age
+        self.max_size = max_size
+        self.evict_every = evict_every
+        self._puts = 0
+        self.hits = 0
+        self.misses = 0
+
+        self.evict()
+
+    @staticmethod
+    def key(url, params=None):
+        if params:
+            url += "?" + urlencode(sorted((k, str(v)) for k, v in params.items()))
+        return hashlib.sha1(url.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT status, headers, etag, body, fetched_at FROM responses WHERE key = ?",
+                                     (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return {"status": row[0], "headers": json.loads(row[1]), "etag": row[2],
+                "body": zlib.decompress(row[3]), "fetched_at": row[4]}
+
+    def put(self, key, url, response):
+        body = zlib.compress(response.content)
+        headers = {h: response.headers[h] for h in CACHED_HEADERS if h in response.headers}
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO responses (key, url, status, headers, etag, body, size, fetched_at)"
+                               " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                               (key, url, response.status_code, json.dumps(headers), response.headers.get("ETag"),
+                                body, len(body), time.time()))
+            self._conn.commit()
+            self._puts += 1
+
+        if self._puts % self.evict_every == 0:
+            self.evict()
+
+    def touch(self, key):
+        with self._lock:
+            self._conn.execute("UPDATE responses SET fetched_at = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+
+    def evict(self):
+        with self._lock:
+            if self.max_age:
+                self._conn.execute("DELETE FROM responses WHERE fetched_at < ?", (time.time() - self.max_age,))
+
+            if self.max_size:
+                total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+                if total > self.max_size:
+                    # oldest entries first, until the cache fits into the limit
+                    cursor = self._conn.execute("SELECT key, size FROM responses ORDER BY fetched_at")
+                    evicted = []
+                    for key, size in cursor:
+                        if total <= self.max_size:
+                            break
+                        evicted.append((key,))
+                        total -= size
+                    self._conn.executemany("DELETE FROM responses WHERE key = ?", evicted)
+                    self._logger.info("Responses evicted from cache: %s", len(evicted))
+
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def build_response(entry, url, status=None):
+    response = requests.Response()
+    response.status_code = status or entry["status"]
+    response._content = entry["body"]
+    response.headers = CaseInsensitiveDict(entry["headers"])
+    response.headers["X-From-Cache"] = "1"
+    response.url = url
+    response.encoding = "utf-8"
+    return response
+
+
+class CachedSession(requests.Session):
+    """
+    requests session backed by ResponseCache.
+
+    GET responses are stored in the cache and revalidated with If-None-Match, a 304 answer is served
+    from the cache as 200 (304 answers do not count against rate limit). When the caller sends its own
+    validators, 304 is returned to the caller as is. In replay mode nothing is sent to the network:
+    cached responses are served and not cached ones are answered with 404.
+    """
+
+    def __init__(self, cache, replay=False):
+        super().__init__()
+        self.cache = cache
+        self.replay = replay
+
+    def request(self, method, url, params=None, headers=None, **kwargs):
+        if method.upper() != "GET":
+            if self.replay:
+                return build_response({"status": 404, "headers": {}, "body": b'{"message": "Not cached"}'}, url)
+            return super().request(method, url, params=params, headers=headers, **kwargs)
+
+        key = self.cache.key(url, params)
+        entry = self.cache.get(key)
+
+        if self.replay:
+            if entry is None:
+                return build_response({"status": 404, "headers": {}, "body": b'{"message": "Not cached"}'}, url)
+            return build_response(entry, url)
+
+        headers = dict(headers or {})
+        own_validators = "If-None-Match" in headers or "If-Modified-Since" in headers
+        if entry is not None and entry["etag"] and not own_validators:
+            headers["If-None-Match"] = entry["etag"]
+
+        response = super().request(method, url, params=params, headers=headers, **kwargs)
+
+        if response.status_code == 200:
+            self.cache.put(key, url, response)
+        elif response.status_code == 304 and entry is not None and not own_validators:
+            self.cache.touch(key)
+            cached = build_response(entry, url, status=200)
+            # budget headers of the real answer are kept for rate limiter
+            for h, v in response.headers.items():
+                if h.lower().startswith("x-ratelimit"):
+                    cached.headers[h] = v
+            return cached
+
+        return response
@@ -0,0 +1,95 @@
+import json
+import threading
+from datetime import datetime
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import simdjson
+except ImportError:
+    simdjson = None
+
+
+# fields of API payloads used by the walker, everything else (base, _links, patch, ...) is dropped
+PULL_FIELDS = ("id", "number", "url", "state", "title", "created_at", "updated_at", "closed_at", "merged_at",
+               "merge_commit_sha")
+HEAD_FIELDS = ("sha",)
+USER_FIELDS = ("id", "login", "html_url", "type")
+FILE_FIELDS = ("sha", "filename", "status", "additions", "deletions", "changes")
+
+_local = threading.local()
+
+
+def loads(content):
+    """Decode JSON body with the fastest available parser: orjson, then standard json."""
+    if not content:
+        return {}
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+def _parser():
+    # simdjson parser reuses its buffers and invalidates the previous document, so one parser per thread
+    parser = getattr(_local, "parser", None)
+    if parser is None:
+        parser = _local.parser = simdjson.Parser()
+    return parser
+
+
+def _slim(items, fields, nested=None):
+    slim = []
+    for item in items:
+        record = {f: item.get(f) for f in fields}
+        if nested:
+            for name, nested_fields in nested.items():
+                value = item.get(name)
+                record[name] = {f: value.get(f) for f in nested_fields} if value is not None else None
+        slim.append(record)
+    return slim
+
+
+def _extract(content, fields, nested=None):
+    if not content:
+        return []
+    if simdjson is not None:
+        # lazy document: only the extracted fields are converted to Python objects
+        document = _parser().parse(content)
+        if not isinstance(document, simdjson.Array):
+            return document.as_dict()
+        return _slim(document, fields, nested)
+
+    document = loads(content)
+    if not isinstance(document, list):
+        return document
+    return _slim(document, fields, nested)
+
+
+def pulls(content):
+    """Pull requests page as a list of dicts with PULL_FIELDS, "user" with USER_FIELDS and "head" with HEAD_FIELDS."""
+    return _extract(content, PULL_FIELDS, {"user": USER_FIELDS, "head": HEAD_FIELDS})
+
+
+def files(content):
+    """Pull request files page as a list of dicts with FILE_FIELDS."""
+    return _extract(content, FILE_FIELDS)
+
+
+def parse_timestamp(value):
+    """
+    GitHub timestamp "YYYY-MM-DDTHH:MM:SSZ" to naive UTC datetime, same as
+    datetime.strptime(value, "%Y-%m-%dT%H:%M:%SZ") for this format, but an order of magnitude faster.
+    """
+    if not value:
+        return None
+    if len(value) == 20 and value[19] == "Z":
+        return datetime.fromisoformat(value[:19])
+
+    # other ISO 8601 forms (fractions of second, offsets) are converted to naive UTC
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is not None:
+        parsed = (parsed - parsed.utcoffset()).replace(tzinfo=None)
+    return parsed
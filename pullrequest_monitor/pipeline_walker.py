@@ -0,0 +1,252 @@
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import github_walker
+
+
+class PipelineAborted(Exception):
+    """Raised inside of a pipeline stage when another stage has failed."""
+
+
+class StageStats:
+    """
+    Throughput of a pipeline stage and depth of its input queue.
+
+    Busy share close to 100% and a full input queue mark the bottleneck stage, stages after it
+    mostly wait for input with an empty queue.
+    """
+
+    def __init__(self, name, inbox=None):
+        self.name = name
+        self.inbox = inbox
+        self.items = 0
+        self.busy = 0.0
+        self.started_at = time.time()
+        self._depth_total = 0
+        self._depth_max = 0
+        self._depth_samples = 0
+
+    def sample_depth(self):
+        if self.inbox is not None:
+            depth = self.inbox.qsize()
+            self._depth_total += depth
+            self._depth_max = max(self._depth_max, depth)
+            self._depth_samples += 1
+
+    def record(self, busy):
+        self.items += 1
+        self.busy += busy
+
+    def report(self):
+        elapsed = max(time.time() - self.started_at, 1e-6)
+        text = (self.name + ": items " + str(self.items) + ", " + str(round(self.items / elapsed, 2)) +
+                " items/s, busy " + str(round(100 * self.busy / elapsed)) + "%")
+        if self.inbox is not None:
+            average = self._depth_total / self._depth_samples if self._depth_samples else 0
+            text += (", input queue depth avg " + str(round(average, 1)) + " max " + str(self._depth_max) +
+                     " of " + str(self.inbox.maxsize))
+        return text
+
+
+class PipelinedGitHubWalker(github_walker.GitHubWalker):
+    """
+    Pipelined crawl mode for GitHubWalker.
+
+    Crawl runs as three stages connected by bounded queues, so network, parsing and database writes overlap:
+      - fetch: requests pull pages and files of the pulls of a page which are not collected yet
+        (FileCollector, up to `request_params.concurrency` files requests in flight), in its own thread;
+      - parse: converts JSON payloads to table rows, in its own thread;
+      - write: loads rows with GitHubLoader and sets crawl checkpoints, in the calling thread, which owns
+        the database session.
+    A full queue blocks the stage before it, so memory use is bounded by `pipeline.queue_size` pages
+    per queue. Every stage reports throughput and input queue depth every `pipeline.stats_interval` seconds
+    and at the end of the walk.
+    """
+
+    def __init__(self, db_session, **args):
+        super().__init__(db_session, **args)
+        self.queue_size = 4
+        self.stats_interval = 30
+        if "loader" in args.keys():
+            pipeline_config = self.loader_config.get("pipeline", {})
+            self.queue_size = pipeline_config.get("queue_size", self.queue_size)
+            self.stats_interval = pipeline_config.get("stats_interval", self.stats_interval)
+
+        self._failed = threading.Event()
+        self._stats = []
+        self._logger.info("Pipeline queue size is: %s", self.queue_size)
+
+    def _put(self, target, item):
+        while not self._failed.is_set():
+            try:
+                target.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+        raise PipelineAborted()
+
+    def _get(self, source, stats):
+        stats.sample_depth()
+        while not self._failed.is_set():
+            try:
+                return source.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+        raise PipelineAborted()
+
+    def _start_stage(self, name, target, *args):
+        def run():
+            try:
+                target(*args)
+            except PipelineAborted:
+                pass
+            except Exception:
+                self._logger.exception("Pipeline stage %s failed", name)
+                self._failed.set()
+
+        thread = threading.Thread(target=run, name="pipeline-" + name, daemon=True)
+        thread.start()
+        return thread
+
+    def _report_stats(self):
+        for stats in self._stats:
+            self._logger.info("Pipeline stage %s", stats.report())
+
+    def _fetch_stage(self, repositories, collect_files, outbox, stats):
+        per_page = self.pull_request_parameters["per_page"]
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            for repo, repository_id, page in repositories:
+                url = self.pull_request_url.format(repo=repo)
+                completed = False
+                while True:
+                    started = time.time()
+                    pulls = self._get_pulls(url, dict(self.pull_request_parameters, page=page))
+                    if pulls is None:
+                        stats.record(time.time() - started)
+                        self._logger.error("Pull requests walk of %s stopped at page %s, it is resumed from there on "
+                                           "the next run", repo, page)
+                        break
+                    self._logger.info("Pulls count received for page %s is :%s", page, len(pulls))
+
+                    files = []
+                    if collect_files and pulls:
+                        files = self.file_collector.fetch(repo, self.file_collector.pending(repository_id, pulls), pool)
+                    stats.record(time.time() - started)
+
+                    if pulls:
+                        self._put(outbox, {"repository_id": repository_id, "page": page, "pulls": pulls,
+                                           "files": files})
+                    if len(pulls) < per_page:
+                        completed = True
+                        break
+                    page += 1
+
+                # checkpoint of a repository stopped at a failed page is kept
+                self._put(outbox, {"repository": repo, "repository_id": repository_id, "done": True,
+                                   "completed": completed})
+
+        self._put(outbox, None)
+
+    def _parse_stage(self, inbox, outbox, stats):
+        while True:
+            item = self._get(inbox, stats)
+            if item is None:
+                break
+
+            if not item.get("done"):
+                started = time.time()
+                pulls = item["pulls"]
+                item = dict(item,
+                            pulls=[self._parse_pull(pull, item["repository_id"]) for pull in pulls],
+                            files=[dict(result, rows=self._build_files(result["pull"]["id"], item["repository_id"],
+                                                                       result["files"]))
+                                   for result in item["files"]])
+                stats.record(time.time() - started)
+
+            self._put(outbox, item)
+
+        self._put(outbox, None)
+
+    def _write_stage(self, inbox, stats):
+        loaded_count = 0
+        reported_at = time.time()
+        while True:
+            item = self._get(inbox, stats)
+            if item is None:
+                return loaded_count
+
+            started = time.time()
+            repository_id = item["repository_id"]
+            if item.get("done"):
+                if item["completed"]:
+                    self.ghl.clear_checkpoints(repository_id)
+                else:
+                    self.failed_repositories.add(item["repository"])
+                self.file_collector.release(repository_id)
+            else:
+                for user, row in item["pulls"]:
+                    if self._load_pull(user, row):
+                        loaded_count += 1
+                self.file_collector.load(repository_id, item["files"])
+
+                # pages are written as a whole, restart continues from the next page
+                self.ghl.set_checkpoint(repository_id, "pulls", page=item["page"] + 1)
+            stats.record(time.time() - started)
+
+            if time.time() - reported_at >= self.stats_interval:
+                self._report_stats()
+                reported_at = time.time()
+
+    def pull_requests_walk(self, collect_files=True):
+        if self.sync_mode == "incremental":
+            # incremental refresh usually needs a few pages only, it is done by serial walker
+            return super().pull_requests_walk(collect_files)
+
+        repositories = []
+        self.failed_repositories = set()
+        for repo in self.repository_list:
+            result = self.ghl.get_repositoryid_by_name(repo)
+            self._logger.info("Get pull requests info. Current repository is: %s", repo)
+            if not result:
+                self._logger.warning("Unable to get repository id for repository name = %s", repo)
+                self.failed_repositories.add(repo)
+                continue
+
+            page = self.pull_request_parameters["page"]
+            checkpoints = self.ghl.get_checkpoints(result[0])
+            if "pulls" in checkpoints:
+                page = checkpoints["pulls"].page
+                self._logger.info("Resuming pull requests walk from page %s", page)
+            # fetch stage checks pulls against collected files states, they are read here with the database session
+            if collect_files:
+                self.file_collector.prepare(result[0])
+            repositories.append((repo, result[0], page))
+
+        fetched = queue.Queue(maxsize=self.queue_size)
+        parsed = queue.Queue(maxsize=self.queue_size)
+        self._failed.clear()
+        self._stats = [StageStats("fetch"), StageStats("parse", fetched), StageStats("write", parsed)]
+
+        stages = [self._start_stage("fetch", self._fetch_stage, repositories, collect_files, fetched, self._stats[0]),
+                  self._start_stage("parse", self._parse_stage, fetched, parsed, self._stats[1])]
+        loaded_count = None
+        try:
+            loaded_count = self._write_stage(parsed, self._stats[2])
+        except PipelineAborted:
+            pass
+        except Exception:
+            self._failed.set()
+            raise
+        finally:
+            for stage in stages:
+                stage.join()
+            self.ghl.flush()
+            self._report_stats()
+
+        if loaded_count is None:
+            raise RuntimeError("Pull requests walk was aborted: pipeline stage failed")
+
+        return loaded_count
@@ -1,10 +1,18 @@
 import cx_Oracle
 from sqlalchemy.orm import sessionmaker
-import dto_requests_objects as dto
 from sqlalchemy import create_engine
 import logging
 import json
+import common
+import crawl_metrics
 import github_walker
+import async_walker
+import graphql_walker
+import pipeline_walker
+import github_loader
+import schema
+import sharded_crawl
+import summaries
 
 
 github_logger = logging.getLogger("github_monitor")
@@ -19,15 +27,13 @@ with open(GITHUB_LOADER_CONFIG) as f:
     loader_cfg = json.load(f)
 
 
-def ora_connect():
+def ora_engine():
     host = conn_cfg["db"]["host"]
     port = conn_cfg["db"]["port"]
     database = conn_cfg["db"]["service"]
     username = conn_cfg["db"]["username"]
     password = conn_cfg["db"]["password"]
 
-    drop_tables = loader_cfg["drop_tables"]
-
     dsnstr = cx_Oracle.makedsn(host, port, database).replace("SID", "SERVICE_NAME")
     cstr = 'oracle+cx_oracle://{username}:{password}@{dsnstr}'.format(
         username=username,
@@ -41,9 +47,29 @@ def ora_connect():
         pool_size=50,
         echo=False if loader_cfg["dml_echo"] == "N" else True
     )
-    if drop_tables == "Y":
-        dto.Base.metadata.drop_all(bind=engine, checkfirst=True)
-        dto.Base.metadata.create_all(bind=engine, checkfirst=True)
+    return engine
+
+
+def sqllite_engine():
+    return create_engine('sqlite:///git_pullrequests.db')
+
+
+def get_engine():
+    if loader_cfg["db_provider"] == "Oracle":
+        return ora_engine()
+    return sqllite_engine()
+
+
+def prepare_schema(engine):
+    if loader_cfg["drop_tables"] == "Y":
+        schema.drop(engine)
+    # tables, columns and indexes added after the schema was created are created when missing
+    schema.migrate(engine, oracle_partitioning=loader_cfg.get("oracle_partitioning", "N") == "Y")
+
+
+def ora_connect():
+    engine = ora_engine()
+    prepare_schema(engine)
 
     db_session = sessionmaker(bind=engine)
     session = db_session()
@@ -51,33 +77,85 @@ def ora_connect():
 
 
 def sqllite_connect():
-    engine = create_engine('sqlite:///git_pullrequests.db')
+    engine = sqllite_engine()
     db_session = sessionmaker(bind=engine)
     session = db_session()
 
-    if loader_cfg["drop_tables"] == "Y":
-        dto.Base.metadata.drop_all(bind=engine, checkfirst=True)
-        dto.Base.metadata.create_all(bind=engine, checkfirst=True)
+    prepare_schema(engine)
 
     return session
 
 
+def get_walker_class():
+    if loader_cfg.get("fetch_mode", "rest") == "graphql":
+        return graphql_walker.GraphQLGitHubWalker
+    if loader_cfg.get("crawl_mode", "sync") == "async":
+        return async_walker.AsyncGitHubWalker
+    if loader_cfg.get("crawl_mode", "sync") == "pipeline":
+        return pipeline_walker.PipelinedGitHubWalker
+    return github_walker.GitHubWalker
+
+
+def get_github_tokens():
+    # several tokens can be used by sharded crawl, every worker has its own token and rate budget
+    tokens = conn_cfg["github"].get("github_tokens") or [conn_cfg["github"]["github_token"]]
+    return tokens
+
+
+def export_data(loader):
+    export_cfg = loader_cfg.get("export", {})
+    loader.dump_to_file("analysis/python/raw",
+                        fetch_size=export_cfg.get("fetch_size", 10000),
+                        compress=export_cfg.get("compress", "N") == "Y",
+                        workers=export_cfg.get("workers", 4),
+                        format=export_cfg.get("format", "csv"))
+
+
 def main():
+    common.configure_logging(**common.log_settings(loader_cfg))
     github_logger.setLevel(loader_cfg["log_level"])
+    sharded_cfg = loader_cfg.get("sharded", {})
+
+    # every phase is profiled to <dir>/<phase>.prof when profiling is on
+    profiling_cfg = loader_cfg.get("profiling", {})
+    profile_dir = profiling_cfg.get("dir", "logs/profiles") if profiling_cfg.get("enabled", "N") == "Y" else None
+    metrics_exporter = crawl_metrics.start_exporter(loader_cfg)
+
+    with crawl_metrics.phase("connect", profile_dir):
+        if loader_cfg["db_provider"] == "Oracle":
+            db_session = ora_connect()
+        else:
+            db_session = sqllite_connect()
+
+    if db_session and loader_cfg.get("summary_tables", "Y") == "Y":
+        # database loaded before summary tables were added gets them computed once
+        with crawl_metrics.phase("summaries", profile_dir):
+            summaries.ensure(db_session)
+
+    if db_session and sharded_cfg.get("workers", 0) > 0:
+        with crawl_metrics.phase("sharded_crawl", profile_dir):
+            sharded_crawl.run(get_engine, get_walker_class(), loader_cfg["repositories"], get_github_tokens(),
+                              workers=sharded_cfg["workers"], lease_seconds=sharded_cfg.get("lease_seconds", 900),
+                              loader=GITHUB_LOADER_CONFIG, connections=CONNECTIONS_CONFIG)
+        with crawl_metrics.phase("export", profile_dir):
+            export_data(github_loader.GitHubLoader(db_session, log_level=loader_cfg["log_level"]))
 
-    if loader_cfg["db_provider"] == "Oracle":
-        db_session = ora_connect()
-    else:
-        db_session = sqllite_connect()
+        db_session.close()
 
-    if db_session:
-        ghw = github_walker.GitHubWalker(db_session, loader=GITHUB_LOADER_CONFIG, connections=CONNECTIONS_CONFIG)
-        ghw.repository_walk()
-        ghw.pull_requests_walk()
-        ghw.ghl.dump_to_file("analysis/python/raw")
+    elif db_session:
+        ghw = get_walker_class()(db_session, loader=GITHUB_LOADER_CONFIG, connections=CONNECTIONS_CONFIG)
+        with crawl_metrics.phase("repository_walk", profile_dir):
+            ghw.repository_walk()
+        with crawl_metrics.phase("pull_requests_walk", profile_dir):
+            ghw.pull_requests_walk()
+        with crawl_metrics.phase("export", profile_dir):
+            export_data(ghw.ghl)
 
         db_session.close()
 
+    if metrics_exporter is not None:
+        metrics_exporter.stop()
+
 
 if __name__ == "__main__":
     main()
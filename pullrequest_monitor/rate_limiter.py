@@ -0,0 +1,117 @@
+import threading
+import time
+import common
+
+
+class RateLimiter:
+    """
+    Token bucket shared by all requests of a walker.
+
+    The bucket is refilled with the remaining GitHub budget spread evenly over the time left until
+    the reset of the current rate limit window, so requests are paced at the highest allowed rate
+    instead of bursting until the budget is exhausted. Budget values are taken from
+    X-RateLimit-* headers of every response, secondary rate limits are honored via Retry-After.
+    A 429 answer without Retry-After is repeated after backoff seconds, doubled on every next such answer.
+
+    acquire() may be called from several threads: every caller reserves a token under the lock
+    and sleeps outside of it until its token is available.
+    """
+
+    def __init__(self, limit=60, window=3600, burst=10, name="core", enabled=True, backoff=60, log_level=None):
+        self._logger = common.get_logger("RateLimiter", log_level)
+        self._lock = threading.Lock()
+
+        self.name = name
+        self.enabled = enabled
+        self.limit = limit
+        self.window = window
+        self.burst = burst
+        self.backoff = backoff
+        self.backoff_count = 0
+
+        now = time.time()
+        self.remaining = limit
+        self.reset_at = now + window
+        self.blocked_until = 0.0
+        self.tokens = float(burst)
+        self.refilled_at = now
+        self.total_wait = 0.0
+
+    def _rate(self, now):
+        return max(self.remaining, 0) / max(self.reset_at - now, 1.0)
+
+    def _refill(self, now):
+        if now >= self.reset_at:
+            # window is over, assume full budget until the next response tells the actual values
+            self.remaining = self.limit
+            self.reset_at = now + self.window
+
+        self.tokens = min(float(self.burst), self.tokens + (now - self.refilled_at) * self._rate(now))
+        self.refilled_at = now
+
+    def acquire(self):
+        if not self.enabled:
+            return 0.0
+
+        with self._lock:
+            now = time.time()
+            self._refill(now)
+
+            self.tokens -= 1
+            self.remaining -= 1
+
+            wait = 0.0
+            if self.remaining < 0:
+                wait = self.reset_at - now
+            elif self.tokens < 0:
+                wait = -self.tokens / max(self._rate(now), 1.0 / self.window)
+            wait = max(wait, self.blocked_until - now)
+            self.total_wait += wait
+
+        if wait > 0:
+            if wait > 1:
+                self._logger.info("Rate limit [%s]: waiting for %.1f sec", self.name, wait)
+            time.sleep(wait)
+
+        return wait
+
+    def update(self, response):
+        """
+        Refresh budget from response headers.
+        Returns True when the response was rejected by a rate limit and the request should be repeated.
+        """
+        headers = response.headers
+        now = time.time()
+        with self._lock:
+            if "X-RateLimit-Limit" in headers:
+                self.limit = int(headers["X-RateLimit-Limit"])
+            if "X-RateLimit-Reset" in headers:
+                self.reset_at = float(headers["X-RateLimit-Reset"])
+            if "X-RateLimit-Remaining" in headers:
+                self.remaining = int(headers["X-RateLimit-Remaining"])
+
+            if response.status_code not in (403, 429):
+                self.backoff_count = 0
+                return False
+
+            if "Retry-After" in headers:
+                self.blocked_until = now + float(headers["Retry-After"])
+                self._logger.warning("Secondary rate limit [%s] hit, retry after %s sec", self.name,
+                                     headers["Retry-After"])
+                return True
+
+            if self.remaining <= 0:
+                self.blocked_until = max(self.reset_at, now)
+                self._logger.warning("Rate limit [%s] exceeded, reset at %s", self.name, self.reset_at)
+                return True
+
+            # secondary rate limit without Retry-After: GitHub asks to wait at least a minute and back off
+            if response.status_code == 429:
+                wait = min(self.backoff * 2 ** self.backoff_count, self.window)
+                self.backoff_count += 1
+                self.blocked_until = now + wait
+                self._logger.warning("Secondary rate limit [%s] hit without Retry-After, retry after %s sec",
+                                     self.name, wait)
+                return True
+
+        return False
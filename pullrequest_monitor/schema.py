@@ -0,0 +1,188 @@
+from collections import OrderedDict
+from urllib.parse import unquote
+from sqlalchemy import Table, MetaData, func, inspect, select, text
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.schema import CreateTable
+import common
+import dto_requests_objects as dto
+import id_index
+import upsert
+
+
+# git_pullrequest_file table of schemas created before git_file_path, it is kept under this name after migration
+LEGACY_FILES_TABLE = "git_pullrequest_file_legacy"
+
+
+# Oracle partitioning of the biggest tables: pulls by year of creation (new partitions are added by
+# INTERVAL automatically), files follow partitions of their pulls by reference, so a partition of
+# pulls and its files can be scanned, compressed or dropped together. Partitioning key created_at is NOT NULL
+# (ORA-14300 otherwise), pull_id of files is a part of their primary key
+ORACLE_PARTITIONS = {
+    dto.GitPullRequest.__table__: "PARTITION BY RANGE (created_at) INTERVAL (NUMTOYMINTERVAL(1, 'YEAR')) "
+                                  "(PARTITION p_before_2008 VALUES LESS THAN (DATE '2008-01-01'))",
+    dto.PullRequestFile.__table__: "PARTITION BY REFERENCE (fk_git_pull_file_pull)"
+}
+
+
+@compiles(CreateTable, "oracle")
+def _create_table(create, compiler, **kw):
+    # PARTITION BY clause of table info is appended to CREATE TABLE, other dialects ignore it
+    sql = compiler.visit_create_table(create, **kw)
+    partition_by = create.element.info.get("oracle_partition_by")
+    if partition_by:
+        sql = sql.rstrip() + "\n" + partition_by + "\n\n"
+    return sql
+
+
+def enable_oracle_partitioning():
+    for table, partition_by in ORACLE_PARTITIONS.items():
+        table.info["oracle_partition_by"] = partition_by
+
+
+def _add_column_statement(dialect, table, column):
+    column_type = column.type.compile(dialect=dialect)
+    return "ALTER TABLE " + table.name + " ADD " + column.name + " " + column_type
+
+
+def _create_view(engine, name, query):
+    sql = query.compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True})
+    with engine.begin() as connection:
+        connection.execute(text("CREATE VIEW " + name + " AS " + str(sql)))
+
+
+def migrate_legacy_files(engine, chunk_size=10000, cache_size=100000):
+    """
+    Move rows of legacy git_pullrequest_file table (file name in every row) to git_file_path and git_pull_file,
+    head_sha of pulls is restored from "?ref=" of contents_url. Rows are inserted if missing, so an interrupted
+    migration is repeated from the start. The legacy table is renamed to LEGACY_FILES_TABLE at the end,
+    it is not dropped.
+    """
+    logger = common.get_logger("SchemaMigration")
+    legacy = Table(dto.PULL_FILE_VIEW_NAME, MetaData(), autoload_with=engine)
+    pulls = dto.GitPullRequest.__table__
+    dialect = engine.dialect.name
+    path_statement = upsert.upsert_statement(dialect, dto.GitFilePath.__table__, ["id"], {})
+    file_statement = upsert.upsert_statement(dialect, dto.PullRequestFile.__table__, ["pull_id", "path_id"], {})
+    head_statement = pulls.update().where(pulls.c.id == text(":pull_id")).where(pulls.c.head_sha.is_(None)) \
+        .values(head_sha=text(":head_sha"))
+
+    query = select([legacy, pulls.c.repository_id]).select_from(legacy.join(pulls, pulls.c.id == legacy.c.pull_id))
+    known_paths = OrderedDict()
+    rows_count = 0
+    with engine.connect() as reader:
+        result = reader.execution_options(stream_results=True).execute(query)
+        while True:
+            rows = result.fetchmany(chunk_size)
+            if not rows:
+                break
+
+            paths, files, heads = [], [], {}
+            for row in rows:
+                path_key = (row["repository_id"], row["filename"])
+                path = known_paths.get(path_key)
+                if path is None:
+                    path = known_paths[path_key] = id_index.path_id(*path_key)
+                    paths.append({"id": path, "repository_id": row["repository_id"], "filename": row["filename"]})
+                    if len(known_paths) > cache_size:
+                        known_paths.popitem(last=False)
+                files.append({"pull_id": row["pull_id"], "path_id": path, "sha": row["sha"], "status": row["status"],
+                              "additions": row["additions"], "deletions": row["deletions"], "changes": row["changes"]})
+                if row["contents_url"] and "?ref=" in row["contents_url"]:
+                    heads[row["pull_id"]] = unquote(row["contents_url"].rsplit("?ref=", 1)[1])
+
+            with engine.begin() as connection:
+                if paths:
+                    connection.execute(path_statement, paths)
+                connection.execute(file_statement, files)
+                if heads:
+                    connection.execute(head_statement, [{"pull_id": k, "head_sha": v} for k, v in heads.items()])
+            rows_count += len(rows)
+            logger.info("Legacy files rows migrated: %s", rows_count)
+
+    with engine.begin() as connection:
+        connection.execute(text("ALTER TABLE " + dto.PULL_FILE_VIEW_NAME + " RENAME TO " + LEGACY_FILES_TABLE))
+    return rows_count
+
+
+def check_not_null(engine, table, column):
+    """
+    Count of rows with NULL in a column which is NOT NULL in the metadata. Nullability of existing columns
+    is not altered by migrate, rows without a value have to be fixed before the constraint is added.
+    """
+    query = select([func.count()]).select_from(table).where(table.c[column].is_(None))
+    with engine.connect() as connection:
+        return connection.execute(query).scalar()
+
+
+def migrate(engine, oracle_partitioning=False):
+    """
+    Bring existing schema to the metadata of dto_requests_objects: missing tables are created, missing
+    nullable columns are added and missing indexes are created. Legacy git_pullrequest_file table is moved
+    to git_file_path and git_pull_file (see migrate_legacy_files) and git_pullrequest_file view is created
+    in its place. Nothing is dropped, so it is safe to run on every start. Partitioning applies to tables
+    created here; existing Oracle tables are partitioned online with ALTER TABLE ... MODIFY PARTITION BY
+    or DBMS_REDEFINITION by DBA.
+    Returns list of applied changes.
+    """
+    logger = common.get_logger("SchemaMigration")
+    if oracle_partitioning and engine.dialect.name == "oracle":
+        enable_oracle_partitioning()
+
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    dto.Base.metadata.create_all(bind=engine, checkfirst=True)
+
+    changes = [table.name for table in dto.Base.metadata.sorted_tables if table.name not in existing_tables]
+    for table in dto.Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+
+        columns = set(c["name"].lower() for c in inspector.get_columns(table.name))
+        for column in table.columns:
+            if column.name.lower() in columns:
+                continue
+            if not column.nullable:
+                logger.error("Column %s.%s is missing and is not nullable, it is not added", table.name,
+                             column.name)
+                continue
+            with engine.begin() as connection:
+                connection.execute(text(_add_column_statement(engine.dialect, table, column)))
+            changes.append(table.name + "." + column.name)
+
+        indexes = set(i["name"].lower() for i in inspector.get_indexes(table.name) if i["name"])
+        for index in table.indexes:
+            if index.name.lower() not in indexes:
+                index.create(bind=engine)
+                changes.append(index.name)
+
+    pulls = dto.GitPullRequest.__table__
+    if oracle_partitioning and pulls.name in existing_tables:
+        nulls_count = check_not_null(engine, pulls, "created_at")
+        if nulls_count:
+            logger.error("Pull requests without created_at: %s, %s can not be partitioned by it until they are "
+                         "filled or deleted", nulls_count, pulls.name)
+
+    if dto.PULL_FILE_VIEW_NAME in existing_tables:
+        rows_count = migrate_legacy_files(engine)
+        changes.append(LEGACY_FILES_TABLE + " (" + str(rows_count) + " rows moved to " +
+                       dto.PullRequestFile.__tablename__ + ")")
+
+    if dto.PULL_FILE_VIEW_NAME not in inspect(engine).get_view_names():
+        _create_view(engine, dto.PULL_FILE_VIEW_NAME, dto.PULL_FILE_SELECT)
+        changes.append(dto.PULL_FILE_VIEW_NAME + " view")
+
+    for change in changes:
+        logger.info("Schema migration: %s was created", change)
+    return changes
+
+
+def drop(engine):
+    """Drop views, legacy tables and all tables of dto_requests_objects."""
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        if dto.PULL_FILE_VIEW_NAME in inspector.get_view_names():
+            connection.execute(text("DROP VIEW " + dto.PULL_FILE_VIEW_NAME))
+        for name in (dto.PULL_FILE_VIEW_NAME, LEGACY_FILES_TABLE):
+            if name in inspector.get_table_names():
+                connection.execute(text("DROP TABLE " + name))
+    dto.Base.metadata.drop_all(bind=engine, checkfirst=True)
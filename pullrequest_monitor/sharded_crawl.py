@@ -0,0 +1,176 @@
+import logging
+import os
+import socket
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy import and_, or_, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker
+import common
+import crawl_metrics
+import dto_requests_objects as dto
+
+
+class CrawlQueue:
+    """
+    Work queue of repositories in git_crawl_queue table, shared by all crawl workers (processes or hosts).
+
+    A worker claims a repository with a conditional UPDATE, so only one worker gets it. Claimed repositories
+    are leased: worker refreshes heartbeat_at while crawling, repositories with expired lease (crashed worker)
+    and failed repositories with attempts left are claimed again by other workers.
+    """
+
+    def __init__(self, engine, lease_seconds=900, max_attempts=3, log_level=logging.INFO):
+        self.engine = engine
+        self.table = dto.GitCrawlQueue.__table__
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._logger = common.get_logger("CrawlQueue", log_level)
+
+    def _claimable(self, now):
+        t = self.table
+        return or_(t.c.status == "pending",
+                   and_(t.c.status == "running", t.c.heartbeat_at < now - timedelta(seconds=self.lease_seconds)),
+                   and_(t.c.status == "failed", t.c.attempts < self.max_attempts))
+
+    def enqueue(self, repositories):
+        t = self.table
+        with self.engine.connect() as conn:
+            existing = set(r[0] for r in conn.execute(select([t.c.repository])))
+            for repo in repositories:
+                if repo not in existing:
+                    try:
+                        conn.execute(t.insert().values(repository=repo, status="pending", attempts=0))
+                    except IntegrityError:
+                        # enqueued by another host at the same time
+                        pass
+
+            # previous run is finished, start a new one
+            active = conn.execute(select([t.c.repository]).where(t.c.status.in_(["pending", "running"]))).first()
+            if active is None:
+                conn.execute(t.update().where(t.c.repository.in_(repositories))
+                             .values(status="pending", attempts=0, worker_id=None))
+
+    def claim(self, worker_id):
+        t = self.table
+        with self.engine.connect() as conn:
+            while True:
+                now = datetime.utcnow()
+                candidate = conn.execute(select([t.c.repository]).where(self._claimable(now))).first()
+                if candidate is None:
+                    return None
+
+                result = conn.execute(t.update()
+                                      .where(and_(t.c.repository == candidate[0], self._claimable(now)))
+                                      .values(status="running", worker_id=worker_id, heartbeat_at=now,
+                                              attempts=t.c.attempts + 1))
+                if result.rowcount == 1:
+                    self._logger.info("Repository %s was claimed by %s", candidate[0], worker_id)
+                    return candidate[0]
+
+    def heartbeat(self, worker_id, repository):
+        t = self.table
+        with self.engine.connect() as conn:
+            conn.execute(t.update().where(and_(t.c.repository == repository, t.c.worker_id == worker_id))
+                         .values(heartbeat_at=datetime.utcnow()))
+
+    def complete(self, worker_id, repository, success):
+        t = self.table
+        with self.engine.connect() as conn:
+            conn.execute(t.update().where(and_(t.c.repository == repository, t.c.worker_id == worker_id))
+                         .values(status="done" if success else "failed", heartbeat_at=datetime.utcnow()))
+
+
+class Heartbeat(threading.Thread):
+
+    def __init__(self, queue, worker_id, repository):
+        super().__init__(daemon=True)
+        self.queue = queue
+        self.worker_id = worker_id
+        self.repository = repository
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.queue.lease_seconds / 3):
+            self.queue.heartbeat(self.worker_id, self.repository)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def crawl_worker(get_engine, walker_cls, token, lease_seconds, walker_args):
+    """
+    Crawl repositories from the queue until it is empty. Runs in its own process with its own
+    database engine, session and GitHub token (so its own rate budget).
+    """
+    worker_id = socket.gethostname() + ":" + str(os.getpid())
+    logger = common.get_logger("CrawlWorker", logging.INFO)
+
+    engine = get_engine()
+    queue = CrawlQueue(engine, lease_seconds)
+    session = sessionmaker(bind=engine)()
+    walker = walker_cls(session, github_token=token, **walker_args)
+    # metrics of every worker process go to their own file
+    metrics_exporter = crawl_metrics.start_exporter(getattr(walker, "loader_config", {}), suffix=str(os.getpid()))
+
+    crawled = 0
+    while True:
+        repo = queue.claim(worker_id)
+        if repo is None:
+            break
+
+        heartbeat = Heartbeat(queue, worker_id, repo)
+        heartbeat.start()
+        try:
+            walker.repository_list = [repo]
+            walker.repository_walk()
+            walker.pull_requests_walk()
+            if repo in walker.failed_repositories:
+                # the walk stopped at a failed page and kept its checkpoint, the next claim resumes it
+                queue.complete(worker_id, repo, False)
+                logger.warning("Worker %s did not finish repository %s, it is claimed again", worker_id, repo)
+            else:
+                queue.complete(worker_id, repo, True)
+                crawled += 1
+                logger.info("Worker %s finished repository %s", worker_id, repo)
+        except Exception as err:
+            session.rollback()
+            queue.complete(worker_id, repo, False)
+            logger.error("Worker %s failed on repository %s. Error :%s", worker_id, repo, err)
+        finally:
+            heartbeat.stop()
+
+    session.close()
+    engine.dispose()
+    if metrics_exporter is not None:
+        metrics_exporter.stop()
+    # pool processes exit without atexit handlers, write out queued log records now
+    common.stop_logging()
+    return crawled
+
+
+def run(get_engine, walker_cls, repositories, tokens, workers=4, lease_seconds=900, **walker_args):
+    """
+    Sharded crawl of repositories by a pool of processes. get_engine must be a module level function
+    creating database engine in worker process. Other hosts may run the same crawl against
+    the same database, they share the work queue. Every worker has a token of its own, so there are
+    at most as many workers as tokens.
+    """
+    if workers > len(tokens):
+        # rate limiter of a worker paces requests by the whole budget of its token, workers sharing a token
+        # would spend it several times too fast
+        common.get_logger("CrawlWorker").warning("Workers count %s is reduced to tokens count %s", workers,
+                                                 len(tokens))
+        workers = len(tokens)
+
+    engine = get_engine()
+    dto.GitCrawlQueue.__table__.create(bind=engine, checkfirst=True)
+    CrawlQueue(engine, lease_seconds).enqueue(repositories)
+    engine.dispose()
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(crawl_worker, get_engine, walker_cls, tokens[i], lease_seconds, walker_args)
+                   for i in range(workers)]
+        return sum(f.result() for f in futures)
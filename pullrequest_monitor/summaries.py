@@ -0,0 +1,246 @@
+from collections import OrderedDict
+from sqlalchemy import select, func
+import common
+import dto_requests_objects as dto
+import id_index
+import upsert
+
+
+# Oracle does not accept more than 1000 expressions in IN list
+IN_LIST_SIZE = 1000
+
+
+def merge_seconds(row):
+    return int((row["merged_at"] - row["created_at"]).total_seconds())
+
+
+def _chunks(values, size=IN_LIST_SIZE):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+class SummaryTracker:
+    """
+    Incremental maintenance of git_merge_time_summary and git_file_change_summary.
+
+    GitHubLoader reports every pull and file row it buffers, the tracker keeps their contributions until
+    GitHubLoader.flush adds them to summary rows after the data rows were written. Rows which failed to load
+    are reported with discard and are not counted. A pull is counted once, when it is seen merged for the
+    first time (ids of counted pulls are kept in an id index). Files are counted for merged pulls only:
+    files loaded while their pull was open are counted from the database when the merged pull arrives with
+    an upsert. Updates are additive (count = count + delta), so several crawl processes can maintain
+    the same summary rows.
+    """
+
+    def __init__(self, session, merged_loader=None, cache_size=100000):
+        self.session = session
+        self._logger = common.get_logger("SummaryTracker")
+        self.merged = id_index.IdIndex(merged_loader)
+
+        # repository_id of recently buffered pulls, 0 for not merged ones; files follow their pull closely
+        self._pulls = OrderedDict()
+        self._cache_size = cache_size
+
+        # contributions of buffered rows: pull_id -> (repository_id, merge seconds),
+        # file key -> (pull_id, repository_id, filename)
+        self._merges = {}
+        self._files = {}
+        # files of pulls which fell out of the cache, resolved with a query on flush: file key -> (pull_id, filename)
+        self._unresolved_files = {}
+        # pulls merged after their files were loaded: pull_id -> repository_id
+        self._merged_later = {}
+
+        self._merge_statement = None
+        self._file_statement = None
+
+    def _remember(self, pull_id, repository_id):
+        self._pulls[pull_id] = repository_id
+        self._pulls.move_to_end(pull_id)
+        if len(self._pulls) > self._cache_size:
+            self._pulls.popitem(last=False)
+
+    def add_pull(self, row, existing=False):
+        """Pull row was buffered for insert, or for upsert when existing is True."""
+        pull_id, repository_id = row["id"], row["repository_id"]
+        merged = row["merged_at"] is not None and row["created_at"] is not None
+        if merged and pull_id not in self.merged:
+            self.merged.add(pull_id)
+            self._merges[pull_id] = (repository_id, merge_seconds(row))
+            if existing:
+                self._merged_later[pull_id] = repository_id
+
+        self._remember(pull_id, repository_id if merged else 0)
+
+    def add_file(self, row):
+        pull_id = row["pull_id"]
+        if pull_id in self._merged_later:
+            # counted together with files loaded before the merge
+            return
+
+        key = id_index.file_key(pull_id, id_index.path_id(row["repository_id"], row["filename"]))
+        repository_id = self._pulls.get(pull_id)
+        if repository_id is None:
+            self._unresolved_files[key] = (pull_id, row["filename"])
+        elif repository_id:
+            self._files[key] = (pull_id, repository_id, row["filename"])
+
+    def discard(self, cls, row):
+        """Buffered row was not written, its contribution is dropped."""
+        if cls is dto.GitPullRequest:
+            pull_id = row["id"]
+            if self._merges.pop(pull_id, None) is not None:
+                # counted again when the pull is loaded later
+                self.merged.discard(pull_id)
+            self._merged_later.pop(pull_id, None)
+            if pull_id in self._pulls:
+                self._pulls[pull_id] = 0
+            # files without their pull are not in the summary
+            for files in (self._files, self._unresolved_files):
+                for key in [k for k, v in files.items() if v[0] == pull_id]:
+                    del files[key]
+        elif cls is dto.PullRequestFile:
+            key = id_index.file_key(row["pull_id"], row["path_id"])
+            self._files.pop(key, None)
+            self._unresolved_files.pop(key, None)
+
+    def _file_deltas(self):
+        pulls = dto.GitPullRequest.__table__
+        files = dto.PullRequestFile.__table__
+        paths = dto.GitFilePath.__table__
+
+        deltas = {}
+        for _, repository_id, filename in self._files.values():
+            key = (repository_id, filename)
+            deltas[key] = deltas.get(key, 0) + 1
+
+        if self._unresolved_files:
+            repositories = {}
+            for ids in _chunks(set(pull_id for pull_id, _ in self._unresolved_files.values())):
+                query = select([pulls.c.id, pulls.c.repository_id]).where(pulls.c.id.in_(ids)) \
+                    .where(pulls.c.merged_at.isnot(None))
+                repositories.update((r[0], r[1]) for r in self.session.execute(query))
+            for pull_id, filename in self._unresolved_files.values():
+                if pull_id in repositories:
+                    key = (repositories[pull_id], filename)
+                    deltas[key] = deltas.get(key, 0) + 1
+
+        for ids in _chunks(self._merged_later):
+            query = select([pulls.c.repository_id, paths.c.filename, func.count()]) \
+                .select_from(files.join(pulls, pulls.c.id == files.c.pull_id).join(paths, paths.c.id == files.c.path_id)) \
+                .where(files.c.pull_id.in_(ids)) \
+                .group_by(pulls.c.repository_id, paths.c.filename)
+            for repository_id, filename, count in self.session.execute(query):
+                key = (repository_id, filename)
+                deltas[key] = deltas.get(key, 0) + count
+
+        return deltas
+
+    def _get_statements(self):
+        if self._merge_statement is None:
+            dialect = self.session.get_bind().dialect.name
+            lower = "CASE WHEN {old}.{c} IS NULL OR {new}.{c} < {old}.{c} THEN {new}.{c} ELSE {old}.{c} END"
+            upper = "CASE WHEN {old}.{c} IS NULL OR {new}.{c} > {old}.{c} THEN {new}.{c} ELSE {old}.{c} END"
+            self._merge_statement = upsert.upsert_statement(
+                dialect, dto.GitMergeTimeSummary.__table__, ["repository_id"],
+                {"merged_count": "{old}.merged_count + {new}.merged_count",
+                 "merge_seconds_sum": "{old}.merge_seconds_sum + {new}.merge_seconds_sum",
+                 "merge_seconds_min": lower.replace("{c}", "merge_seconds_min"),
+                 "merge_seconds_max": upper.replace("{c}", "merge_seconds_max")})
+            self._file_statement = upsert.upsert_statement(
+                dialect, dto.GitFileChangeSummary.__table__, ["repository_id", "filename"],
+                {"change_count": "{old}.change_count + {new}.change_count"})
+
+        return self._merge_statement, self._file_statement
+
+    def collect(self):
+        """
+        Summary deltas of the flushed batch as (table class, rows, upsert statement) tuples.
+        Must be called after pulls and files of the batch were written.
+        """
+        merge_statement, file_statement = self._get_statements()
+
+        merge_deltas = {}
+        for repository_id, seconds in self._merges.values():
+            delta = merge_deltas.get(repository_id)
+            if delta is None:
+                merge_deltas[repository_id] = [1, seconds, seconds, seconds]
+            else:
+                delta[0] += 1
+                delta[1] += seconds
+                delta[2] = min(delta[2], seconds)
+                delta[3] = max(delta[3], seconds)
+
+        merge_rows = [{"repository_id": r, "merged_count": d[0], "merge_seconds_sum": d[1],
+                       "merge_seconds_min": d[2], "merge_seconds_max": d[3]} for r, d in merge_deltas.items()]
+        file_rows = [{"repository_id": r, "filename": f, "change_count": c}
+                     for (r, f), c in self._file_deltas().items()]
+
+        self._merges = {}
+        self._files = {}
+        self._unresolved_files = {}
+        self._merged_later = {}
+
+        return [(cls, rows, statement) for cls, rows, statement in
+                ((dto.GitMergeTimeSummary, merge_rows, merge_statement),
+                 (dto.GitFileChangeSummary, file_rows, file_statement)) if rows]
+
+
+def rebuild(session, chunk_size=50000):
+    """Recompute summary tables from git_pullrequest, git_pull_file and git_file_path."""
+    logger = common.get_logger("SummaryTracker")
+    pulls = dto.GitPullRequest.__table__
+    files = dto.PullRequestFile.__table__
+    paths = dto.GitFilePath.__table__
+    merge_summary = dto.GitMergeTimeSummary.__table__
+    file_summary = dto.GitFileChangeSummary.__table__
+
+    session.execute(merge_summary.delete())
+    session.execute(file_summary.delete())
+
+    # date arithmetic differs between dialects, merge times are aggregated here
+    stats = {}
+    query = select([pulls.c.repository_id, pulls.c.created_at, pulls.c.merged_at]) \
+        .where(pulls.c.merged_at.isnot(None)).where(pulls.c.created_at.isnot(None))
+    result = session.execute(query.execution_options(stream_results=True))
+    while True:
+        rows = result.fetchmany(chunk_size)
+        if not rows:
+            break
+        for row in rows:
+            seconds = merge_seconds(row)
+            s = stats.get(row["repository_id"])
+            if s is None:
+                stats[row["repository_id"]] = [1, seconds, seconds, seconds]
+            else:
+                s[0] += 1
+                s[1] += seconds
+                s[2] = min(s[2], seconds)
+                s[3] = max(s[3], seconds)
+
+    if stats:
+        session.execute(merge_summary.insert(), [
+            {"repository_id": r, "merged_count": s[0], "merge_seconds_sum": s[1], "merge_seconds_min": s[2],
+             "merge_seconds_max": s[3]} for r, s in stats.items()])
+
+    session.execute(file_summary.insert().from_select(
+        ["repository_id", "filename", "change_count"],
+        select([pulls.c.repository_id, paths.c.filename, func.count()])
+        .select_from(files.join(pulls, pulls.c.id == files.c.pull_id).join(paths, paths.c.id == files.c.path_id))
+        .where(pulls.c.merged_at.isnot(None))
+        .group_by(pulls.c.repository_id, paths.c.filename)))
+    session.commit()
+    logger.info("Summary tables were rebuilt for %s repositories", len(stats))
+
+
+def ensure(session):
+    """Rebuild summary tables when they are empty while merged pull requests exist, e.g. after upgrade."""
+    pulls = dto.GitPullRequest.__table__
+    summary = dto.GitMergeTimeSummary.__table__
+    if session.execute(select([summary.c.repository_id]).limit(1)).first() is not None:
+        return False
+    if session.execute(select([pulls.c.id]).where(pulls.c.merged_at.isnot(None)).limit(1)).first() is None:
+        return False
+
+    rebuild(session)
+    return True
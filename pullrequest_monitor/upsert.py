@@ -0,0 +1,42 @@
+from sqlalchemy import bindparam, text
+
+
+def upsert_statement(dialect_name, table, key_columns, update_set, condition=None):
+    """
+    Build executemany friendly "insert or update" statement for given table.
+
+    Oracle gets MERGE ... USING (SELECT ... FROM dual), other dialects (SQLite, PostgreSQL) get
+    INSERT ... ON CONFLICT DO UPDATE. Expressions in update_set values and in condition refer to the existing
+    row as {old} and to the new row as {new}, e.g. {"state": "{new}.state"}. Empty update_set makes
+    "insert if missing" statement, existing rows are left as they are.
+    All table columns are bound by name, so rows are plain column mappings.
+    """
+    columns = [c.name for c in table.columns]
+
+    if dialect_name == "oracle":
+        old, new = "t", "s"
+        names = {"old": old, "new": new}
+        sql = "MERGE INTO " + table.name + " " + old + \
+              " USING (SELECT " + ", ".join(":" + c + " AS " + c for c in columns) + " FROM dual) " + new + \
+              " ON (" + " AND ".join(old + "." + k + " = " + new + "." + k for k in key_columns) + ")"
+        if update_set:
+            sql += " WHEN MATCHED THEN UPDATE SET " + \
+                   ", ".join(old + "." + c + " = " + e.format(**names) for c, e in update_set.items())
+            if condition:
+                sql += " WHERE " + condition.format(**names)
+        sql += " WHEN NOT MATCHED THEN INSERT (" + ", ".join(columns) + ")" + \
+               " VALUES (" + ", ".join(new + "." + c for c in columns) + ")"
+    else:
+        names = {"old": table.name, "new": "excluded"}
+        sql = "INSERT INTO " + table.name + " (" + ", ".join(columns) + ")" + \
+              " VALUES (" + ", ".join(":" + c for c in columns) + ")" + \
+              " ON CONFLICT (" + ", ".join(key_columns) + ")"
+        if update_set:
+            sql += " DO UPDATE SET " + ", ".join(c + " = " + e.format(**names) for c, e in update_set.items())
+            if condition:
+                sql += " WHERE " + condition.format(**names)
+        else:
+            sql += " DO NOTHING"
+
+    # typed binds keep values conversion (e.g. DateTime on SQLite) the same as for ORM inserts
+    return text(sql).bindparams(*[bindparam(c.name, type_=c.type) for c in table.columns])
@@ -0,0 +1,76 @@
+import json
+import os
+import sys
+import tempfile
+import pytest
+from sqlalchemy import create_engine
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# modules of the project are flat and import each other by name, the same as when scripts are launched
+for directory in ("pullrequest_monitor", os.path.join("analysis", "python"), "benchmarks"):
+    sys.path.insert(0, os.path.join(ROOT_DIR, directory))
+
+import common
+
+# logging is configured once per process, before walkers do it with the log file of the configuration
+common.configure_logging(path=os.path.join(tempfile.mkdtemp(prefix="github_monitor_tests"), "github_monitor.log"))
+
+
+class FakeResponse:
+    """Response with the attributes used by RateLimiter and walkers."""
+
+    def __init__(self, status_code=200, headers=None, content=b"", links=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.content = content
+        self.links = links or {}
+
+
+@pytest.fixture
+def engine(tmp_path):
+    """SQLite database with the current schema."""
+    import schema
+    engine = create_engine("sqlite:///" + str(tmp_path / "github.db"))
+    schema.migrate(engine)
+    yield engine
+    engine.dispose()
+
+
+def write_crawl_configs(directory, api_url, repositories, **options):
+    """loader.json and connections.json for a crawl of the fake API into SQLite, as benchmarks write them."""
+    with open(os.path.join(ROOT_DIR, "config", "github_monitor_config.json")) as f:
+        loader_config = json.load(f)
+
+    loader_config.update({"api_url": api_url, "db_provider": "SQLite", "log_level": "WARNING",
+                          "sync_mode": "full", "repositories": repositories})
+    loader_config["http_cache"] = {"enabled": "N"}
+    loader_config["metrics"] = {"enabled": "N"}
+    loader_config["request_params"].update(options.pop("request_params", {}))
+    loader_config.update(options)
+
+    paths = {"loader": str(directory / "loader.json"), "connections": str(directory / "connections.json")}
+    with open(paths["loader"], "w") as f:
+        json.dump(loader_config, f)
+    with open(paths["connections"], "w") as f:
+        json.dump({"github": {"github_token": ""}}, f)
+    return paths
+
+
+@pytest.fixture
+def fake_github():
+    """Starts fake GitHub API of benchmarks, returns a function of FakeGitHub arguments giving (api, api_url)."""
+    import fake_github as fake
+    servers = []
+
+    def start(**args):
+        api = fake.FakeGitHub(**args)
+        server = fake.start(api)
+        servers.append(server)
+        return api, "http://127.0.0.1:%d" % server.server_address[1]
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
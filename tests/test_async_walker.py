@@ -0,0 +1,21 @@
+from sqlalchemy.orm import sessionmaker
+import async_walker
+from tests.conftest import write_crawl_configs
+
+
+def test_pages_after_the_last_one_are_not_requested(tmp_path, monkeypatch, engine, fake_github):
+    monkeypatch.chdir(tmp_path)
+    api, api_url = fake_github(pulls=250)
+    paths = write_crawl_configs(tmp_path, api_url, ["benchmark/repo0"], batch_size=100,
+                                request_params={"concurrency": 8})
+    session = sessionmaker(bind=engine)()
+    walker = async_walker.AsyncGitHubWalker(session, loader=paths["loader"], connections=paths["connections"])
+    walker.repository_walk()
+    requests = api.stats["requests"]
+    walker.pull_requests_walk(collect_files=False)
+    session.close()
+
+    # the first page and a window bounded by its rel="last" link: pages 2 and 3
+    assert api.stats["requests"] - requests == 3
+    assert engine.execute("select count(*) from git_pullrequest").scalar() == 250
+    assert not walker.failed_repositories
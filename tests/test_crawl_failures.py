@@ -0,0 +1,69 @@
+import pytest
+from sqlalchemy.orm import sessionmaker
+import async_walker
+import github_walker
+import pipeline_walker
+from tests.conftest import write_crawl_configs
+
+
+WALKERS = {"sync": github_walker.GitHubWalker, "async": async_walker.AsyncGitHubWalker,
+           "pipeline": pipeline_walker.PipelinedGitHubWalker}
+
+PULLS = 250
+REPOSITORIES = ["benchmark/repo0", "benchmark/repo1"]
+
+
+def crawl(engine, walker_cls, paths):
+    session = sessionmaker(bind=engine)()
+    walker = walker_cls(session, loader=paths["loader"], connections=paths["connections"])
+    walker.repository_walk()
+    walker.pull_requests_walk()
+    session.close()
+    return walker.failed_repositories
+
+
+def crawl_state(engine, api):
+    """{repository: (pulls count, checkpoint phases)} of repositories loaded so far."""
+    state = {}
+    for repository in REPOSITORIES:
+        repository_id = api.repository_id(repository)
+        pulls = engine.execute("select count(*) from git_pullrequest where repository_id = ?", repository_id).scalar()
+        phases = [r[0] for r in engine.execute("select phase from git_crawl_checkpoint where repository_id = ?",
+                                               repository_id)]
+        state[repository] = (pulls, phases)
+    return state
+
+
+def files_states(engine):
+    return engine.execute("select count(*) from git_pull_files_state where status = 'complete'").scalar()
+
+
+@pytest.mark.parametrize("crawl_mode", sorted(WALKERS))
+def test_failed_pages_keep_checkpoints(tmp_path, monkeypatch, engine, fake_github, crawl_mode):
+    monkeypatch.chdir(tmp_path)
+    # retries are off, so every injected 5xx reaches the walker
+    api, api_url = fake_github(pulls=PULLS, files_per_pull=2, error_rate=0.15)
+    paths = write_crawl_configs(tmp_path, api_url, REPOSITORIES, request_params={"retries": 0})
+
+    for _ in range(30):
+        failed = crawl(engine, WALKERS[crawl_mode], paths)
+        state = crawl_state(engine, api)
+        for repository, (pulls, phases) in state.items():
+            # a repository stopped at a failed page after some pages were loaded is resumed from its checkpoint
+            if 0 < pulls < PULLS:
+                assert phases, repository + " lost its checkpoint with %s of %s pulls loaded" % (pulls, PULLS)
+            # and it is reported as not finished, e.g. to the queue of sharded crawl
+            if phases:
+                assert repository in failed
+        if all(pulls == PULLS and not phases for pulls, phases in state.values()) and \
+                files_states(engine) == len(REPOSITORIES) * PULLS:
+            break
+
+    assert api.stats["errors"] > 0
+    assert all(pulls == PULLS and not phases for pulls, phases in crawl_state(engine, api).values())
+
+    # files of every pull are collected in the end, pulls with failed files pages are collected again
+    expected_files = sum(len(api.files(repository, number)) for repository in REPOSITORIES
+                         for number in range(1, PULLS + 1))
+    assert engine.execute("select count(*) from git_pull_file").scalar() == expected_files
+    assert files_states(engine) == len(REPOSITORIES) * PULLS
@@ -0,0 +1,77 @@
+import pytest
+from sqlalchemy.orm import sessionmaker
+import file_collector
+import github_loader
+import github_walker
+from tests.conftest import FakeResponse, write_crawl_configs
+
+
+def link(page, last):
+    url = "https://api.github.com/repos/o/r/pulls/1/files?per_page=100&page=%d"
+    return {"next": {"url": url % (page + 1), "rel": "next"}, "last": {"url": url % last, "rel": "last"}}
+
+
+@pytest.mark.parametrize("response, files, expected", [
+    # Link header of the first page tells the last one
+    (FakeResponse(headers={"Link": "..."}, links=link(1, 7)), [{}] * 100, 7),
+    # single page has no Link header
+    (FakeResponse(), [{}] * 40, 1),
+    (FakeResponse(), [], 1),
+    # full page without Link header (dropped by a proxy): pages are requested one by one
+    (FakeResponse(), [{}] * 100, None),
+    # next without last
+    (FakeResponse(headers={"Link": "..."}, links={"next": link(1, 2)["next"]}), [{}] * 100, None),
+])
+def test_last_page(response, files, expected):
+    assert file_collector.last_page(response, files, 100) == expected
+
+
+def test_head_sha():
+    assert file_collector.head_sha({"head": {"sha": "abc"}}) == "abc"
+    assert file_collector.head_sha({"head": None}) is None
+
+
+def crawl(engine, paths):
+    session = sessionmaker(bind=engine)()
+    walker = github_walker.GitHubWalker(session, loader=paths["loader"], connections=paths["connections"])
+    walker.repository_walk()
+    walker.pull_requests_walk()
+    session.close()
+
+
+def test_files_are_collected_once_per_head_commit(tmp_path, monkeypatch, engine, fake_github):
+    monkeypatch.chdir(tmp_path)
+    api, api_url = fake_github(pulls=150, files_per_pull=60)
+    repositories = ["benchmark/repo0"]
+    # 100 files per page, pulls with more files take several pages
+    paths = write_crawl_configs(tmp_path, api_url, repositories)
+
+    crawl(engine, paths)
+    first_requests = api.stats["requests"]
+    crawl(engine, paths)
+
+    expected = sum(len(api.files(repositories[0], number)) for number in range(1, 151))
+    assert engine.execute("select count(*) from git_pull_file").scalar() == expected
+    assert engine.execute("select status, count(*), sum(files_count) from git_pull_files_state "
+                          "group by status").fetchall() == [("complete", 150, expected)]
+    # the second run requests repository and pull pages only
+    assert first_requests > 150
+    assert api.stats["requests"] - first_requests <= 5
+
+
+def test_pull_with_files_not_loaded_is_not_marked_collected(engine):
+    # file rows rejected by the database, e.g. by a constraint
+    engine.execute("CREATE TRIGGER reject_file BEFORE INSERT ON git_pull_file WHEN NEW.sha = 'bad' "
+                   "BEGIN SELECT RAISE(ABORT, 'rejected'); END")
+    session = sessionmaker(bind=engine)()
+    loader = github_loader.GitHubLoader(session, summaries=False)
+    for pull_id, sha in ((1, "good"), (2, "bad")):
+        loader.add_pull_request_files([{"pull_id": pull_id, "repository_id": 1, "filename": name, "sha": sha,
+                                        "status": "modified", "additions": 1, "deletions": 0, "changes": 1}
+                                       for name in ("a.py", "b.py")])
+        loader.set_files_state(pull_id, "head", "complete", 2)
+    loader.flush()
+    session.close()
+
+    assert engine.execute("select count(*) from git_pull_file").scalar() == 2
+    assert engine.execute("select pull_id from git_pull_files_state").fetchall() == [(1,)]
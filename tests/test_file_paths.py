@@ -0,0 +1,38 @@
+from sqlalchemy.orm import sessionmaker
+import dto_requests_objects as dto
+import github_loader
+import id_index
+
+
+def test_path_id_is_the_same_in_every_process():
+    # ids are stored in git_file_path and git_pull_file, a change of the hash breaks existing databases
+    assert id_index.path_id(1, "src/a.py") == 7489687184770219763
+    assert id_index.file_key(10, id_index.path_id(1, "src/a.py")) == -1618283889926900638
+
+
+def test_path_id_depends_on_repository_and_path():
+    ids = {id_index.path_id(r, f) for r in (1, 2, 12) for f in ("a.py", "2:a.py", "src/ä.py", "")}
+    assert len(ids) == 12
+    assert all(-2 ** 63 <= i < 2 ** 63 for i in ids)
+
+
+def test_file_key_depends_on_pull_and_path():
+    path = id_index.path_id(1, "a.py")
+    assert len({id_index.file_key(1, path), id_index.file_key(2, path), id_index.file_key(1, path + 1)}) == 3
+
+
+def test_paths_evicted_from_cache_are_not_duplicated(engine, caplog):
+    session = sessionmaker(bind=engine)()
+    engine.execute(dto.GitRepository.__table__.insert(), [{"id": 1, "full_name": "o/a", "repository_url": "u"}])
+    loader = github_loader.GitHubLoader(session, path_cache_size=2, summaries=False)
+    ids = [loader.get_path_id(1, name) for name in ("a.py", "b.py", "c.py", "a.py", "a.py")]
+    loader.flush()
+    # a path evicted from the cache is buffered again, it is inserted if missing
+    ids.append(loader.get_path_id(1, "b.py"))
+    loader.flush()
+    session.close()
+
+    assert ids[0] == ids[3] == ids[4] == id_index.path_id(1, "a.py")
+    assert sorted(tuple(r) for r in engine.execute("select repository_id, filename from git_file_path")) == \
+        [(1, "a.py"), (1, "b.py"), (1, "c.py")]
+    assert not [r for r in caplog.records if r.levelname == "ERROR"]
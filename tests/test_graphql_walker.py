@@ -0,0 +1,28 @@
+import pytest
+from sqlalchemy.orm import sessionmaker
+import graphql_walker
+from tests.conftest import write_crawl_configs
+
+
+@pytest.mark.parametrize("files_per_query", [100, 2])
+def test_pulls_and_files_are_loaded_in_batches(tmp_path, monkeypatch, engine, fake_github, files_per_query):
+    monkeypatch.chdir(tmp_path)
+    api, api_url = fake_github(pulls=50, files_per_pull=3)
+    paths = write_crawl_configs(tmp_path, api_url, ["benchmark/repo0"],
+                                graphql={"pulls_per_query": 20, "files_per_query": files_per_query})
+    session = sessionmaker(bind=engine)()
+    walker = graphql_walker.GraphQLGitHubWalker(session, loader=paths["loader"], connections=paths["connections"])
+    walker.repository_walk()
+    requests = api.stats["requests"]
+    walker.pull_requests_walk()
+    session.close()
+
+    counts = [len(api.files("benchmark/repo0", n)) for n in range(1, 51)]
+    # 3 batches of pulls, files over the first files_per_query are paged by a query per pull
+    pages = sum((max(c - files_per_query, 0) + files_per_query - 1) // files_per_query for c in counts)
+    assert api.stats["requests"] - requests == 3 + pages
+    assert files_per_query == 100 or pages > 0
+    assert not walker.failed_repositories
+    assert engine.execute("select count(*) from git_pullrequest").scalar() == 50
+    assert engine.execute("select count(*) from git_pull_file").scalar() == sum(counts)
+    assert engine.execute("select count(*) from git_pull_files_state where status = 'complete'").scalar() == 50
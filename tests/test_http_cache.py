@@ -0,0 +1,94 @@
+import logging
+import zlib
+import pytest
+import requests
+import github_walker
+import http_cache
+from tests.conftest import FakeResponse, write_crawl_configs
+
+
+URL = "https://api.github.com/repos/o/r/pulls"
+
+
+@pytest.fixture
+def network(monkeypatch):
+    """Requests which reached the network, answered with ETag "v1" and 304 when it is sent back."""
+    sent = []
+
+    def request(session, method, url, params=None, headers=None, **kwargs):
+        sent.append((method, url, dict(headers or {})))
+        if (headers or {}).get("If-None-Match") == '"v1"':
+            return FakeResponse(304, {"ETag": '"v1"', "X-RateLimit-Remaining": "41"})
+        return FakeResponse(200, {"ETag": '"v1"', "Link": "<next>", "X-RateLimit-Remaining": "42"}, b'[{"id": 1}]')
+
+    monkeypatch.setattr(requests.Session, "request", request)
+    return sent
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(http_cache.time, "time", lambda: now[0])
+    return now
+
+
+def test_cached_response_is_revalidated(tmp_path, network):
+    session = http_cache.CachedSession(http_cache.ResponseCache(str(tmp_path / "cache.db")))
+    first = session.get(URL, params={"page": 1})
+    second = session.get(URL, params={"page": 1})
+
+    assert first.status_code == 200 and "X-From-Cache" not in first.headers
+    assert network[1][2]["If-None-Match"] == '"v1"'
+    # 304 answer is served from the cache with the budget headers of the real answer
+    assert second.status_code == 200 and second.headers["X-From-Cache"] == "1"
+    assert second.json() == [{"id": 1}] and second.headers["Link"] == "<next>"
+    assert second.headers["X-RateLimit-Remaining"] == "41"
+
+
+def test_own_validators_get_304(tmp_path, network):
+    session = http_cache.CachedSession(http_cache.ResponseCache(str(tmp_path / "cache.db")))
+    session.get(URL)
+
+    assert session.get(URL, headers={"If-None-Match": '"v1"'}).status_code == 304
+
+
+def test_old_and_oversized_entries_are_evicted(tmp_path, clock):
+    cache = http_cache.ResponseCache(str(tmp_path / "cache.db"), max_age=100)
+    keys = [cache.key(URL, {"page": page}) for page in range(4)]
+    for key in keys:
+        cache.put(key, URL, FakeResponse(content=b"x" * 1000))
+        clock[0] += 40
+
+    cache.evict()
+    # entries fetched more than 100 sec ago are gone
+    assert [cache.get(key) is not None for key in keys] == [False, False, True, True]
+
+    # then the oldest ones, while compressed bodies are over the size limit
+    cache.max_size = len(zlib.compress(b"x" * 1000))
+    cache.evict()
+    assert [cache.get(key) is not None for key in keys] == [False, False, False, True]
+
+
+def test_replay_serves_cache_only(tmp_path, network):
+    cache = http_cache.ResponseCache(str(tmp_path / "cache.db"))
+    http_cache.CachedSession(cache).get(URL, params={"page": 1})
+    replay = http_cache.CachedSession(cache, replay=True)
+
+    cached = replay.get(URL, params={"page": 1})
+    assert cached.status_code == 200 and cached.json() == [{"id": 1}]
+    assert replay.get(URL, params={"page": 2}).status_code == 404
+    assert replay.post("https://api.github.com/graphql", json={}).status_code == 404
+    assert len(network) == 1
+
+
+
+def test_walker_helpers_log_at_configured_level(tmp_path, monkeypatch, fake_github):
+    monkeypatch.chdir(tmp_path)
+    _, api_url = fake_github()
+    paths = write_crawl_configs(tmp_path, api_url, [], log_level="ERROR",
+                                http_cache={"enabled": "Y", "path": str(tmp_path / "cache.db")})
+    walker = github_walker.GitHubWalker(None, loader=paths["loader"], connections=paths["connections"])
+    walker.response_cache.close()
+
+    assert walker.response_cache._logger.getEffectiveLevel() == logging.ERROR
+    assert walker.rate_limiter._logger.getEffectiveLevel() == logging.ERROR
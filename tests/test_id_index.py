@@ -0,0 +1,40 @@
+import id_index
+
+
+def test_existing_ids_are_loaded_lazily():
+    calls = []
+
+    def loader():
+        calls.append(1)
+        yield [5, 3]
+        yield []
+        yield [9, 3]
+
+    index = id_index.IdIndex(loader)
+    assert calls == []
+    assert 3 in index and 9 in index and 4 not in index
+    assert len(index) == 3
+    assert calls == [1]
+
+
+def test_added_ids_are_merged_into_array():
+    index = id_index.IdIndex(lambda: [[1, 2]], merge_threshold=2)
+    index.add(2)
+    index.add(10)
+    assert len(index._recent) == 1
+    index.update([-(2 ** 63)])
+
+    assert len(index._recent) == 0
+    assert list(index._ids) == [-(2 ** 63), 1, 2, 10]
+    assert 10 in index and -(2 ** 63) in index and 11 not in index
+
+
+def test_discard_removes_loaded_and_added_ids():
+    index = id_index.IdIndex(lambda: [[1, 2, 3]])
+    index.add(4)
+    index.discard(2)
+    index.discard(4)
+    index.discard(100)
+
+    assert 2 not in index and 4 not in index
+    assert len(index) == 2
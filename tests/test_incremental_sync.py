@@ -0,0 +1,61 @@
+from sqlalchemy.orm import sessionmaker
+import github_walker
+from tests.conftest import write_crawl_configs
+
+REPOSITORY = "benchmark/repo0"
+
+
+def make_walker(engine, paths):
+    walker = github_walker.GitHubWalker(sessionmaker(bind=engine)(), loader=paths["loader"],
+                                        connections=paths["connections"])
+    walker.repository_walk()
+    return walker
+
+
+def pulls_walk(walker, api, collect_files=False):
+    """Requests sent by the walk."""
+    requests = api.stats["requests"]
+    walker.pull_requests_walk(collect_files)
+    return api.stats["requests"] - requests
+
+
+def pulls_count(engine):
+    return engine.execute("select count(*) from git_pullrequest").scalar()
+
+
+def test_walk_stops_at_watermark_and_unchanged_first_page_is_not_modified(tmp_path, monkeypatch, engine,
+                                                                          fake_github):
+    monkeypatch.chdir(tmp_path)
+    api, api_url = fake_github(pulls=100)
+    paths = write_crawl_configs(tmp_path, api_url, [REPOSITORY], batch_size=30, sync_mode="incremental")
+    walker = make_walker(engine, paths)
+
+    assert pulls_walk(walker, api) == 4
+    assert pulls_count(engine) == 100
+
+    # 10 new pulls are on the first page, the walk stops at the first pull updated before the watermark
+    api.pulls = 110
+    assert pulls_walk(walker, api) == 1
+    assert pulls_count(engine) == 110
+
+    # first page did not change, it is answered by 304 to the ETag of the last sync
+    not_modified = api.stats["not_modified"]
+    assert pulls_walk(walker, api) == 1
+    assert api.stats["not_modified"] == not_modified + 1
+    assert not walker.failed_repositories
+
+
+def test_failed_page_keeps_watermark_and_releases_collector(tmp_path, monkeypatch, engine, fake_github):
+    monkeypatch.chdir(tmp_path)
+    api, api_url = fake_github(pulls=100, files_per_pull=1)
+    paths = write_crawl_configs(tmp_path, api_url, [REPOSITORY], batch_size=30, sync_mode="incremental")
+    walker = make_walker(engine, paths)
+
+    get_response = walker._get_response
+    monkeypatch.setattr(walker, "_get_response", lambda url, params=None, headers=None:
+                        None if params and params.get("page") == 2 else get_response(url, params, headers))
+    walker.pull_requests_walk()
+
+    assert walker.failed_repositories == {REPOSITORY}
+    assert engine.execute("select count(*) from git_sync_state").scalar() == 0
+    assert walker.file_collector._collected == {}
@@ -0,0 +1,22 @@
+from datetime import datetime
+from sqlalchemy.orm import sessionmaker
+import dto_requests_objects as dto
+import github_loader
+
+
+def test_failed_batch_is_bisected_down_to_bad_row(engine, caplog):
+    session = sessionmaker(bind=engine)()
+    loader = github_loader.GitHubLoader(session, batch_size=100)
+    for number in range(1, 9):
+        # url is NOT NULL, the row of pull 6 fails the whole batch
+        loader.add_pull_request(dto.GitPullRequest(id=number, pull_number=number, url=None if number == 6 else "u",
+                                                   user_id=1, repository_id=1, created_at=datetime(2020, 1, 1)))
+
+    assert loader.flush() == 7
+    session.close()
+
+    assert [r[0] for r in engine.execute("select id from git_pullrequest order by id")] == [1, 2, 3, 4, 5, 7, 8]
+    # the bad row is forgotten, so it is not taken for loaded
+    assert 6 not in loader.pulls and 7 in loader.pulls
+    errors = [r.getMessage() for r in caplog.records if r.levelname == "ERROR"]
+    assert len(errors) == 1 and errors[0].startswith("Value was not loaded to git_pullrequest")
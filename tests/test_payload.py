@@ -0,0 +1,33 @@
+from datetime import datetime
+import pytest
+import payload
+
+
+@pytest.mark.parametrize("value", ["2020-01-02T03:04:05Z", "1999-12-31T23:59:59Z"])
+def test_github_timestamp_is_parsed_as_strptime(value):
+    assert payload.parse_timestamp(value) == datetime.strptime(value, "%Y-%m-%dT%H:%M:%SZ")
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("2020-01-02T03:04:05.250Z", datetime(2020, 1, 2, 3, 4, 5, 250000)),
+    ("2020-01-02T05:04:05+02:00", datetime(2020, 1, 2, 3, 4, 5)),
+    ("2020-01-01T23:30:00-04:00", datetime(2020, 1, 2, 3, 30)),
+])
+def test_other_iso_forms_are_naive_utc(value, expected):
+    parsed = payload.parse_timestamp(value)
+    assert parsed == expected
+    assert parsed.tzinfo is None
+
+
+@pytest.mark.parametrize("value", [None, ""])
+def test_missing_timestamp_is_none(value):
+    assert payload.parse_timestamp(value) is None
+
+
+def test_pulls_keep_used_fields_only():
+    content = b'[{"id": 1, "number": 2, "body": "long text", "user": {"id": 3, "login": "u", "bio": "x"}, ' \
+              b'"head": {"sha": "abc", "repo": {}}}]'
+    pull = payload.pulls(content)[0]
+
+    assert "body" not in pull and "bio" not in pull["user"] and "repo" not in pull["head"]
+    assert pull["id"] == 1 and pull["user"]["login"] == "u" and pull["head"]["sha"] == "abc"
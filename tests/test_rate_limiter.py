@@ -0,0 +1,98 @@
+import time
+import pytest
+import github_walker
+import rate_limiter
+from tests.conftest import FakeResponse, write_crawl_configs
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    calls = []
+    monkeypatch.setattr(rate_limiter.time, "sleep", calls.append)
+    return calls
+
+
+def budget(remaining, reset_in, limit=5000):
+    return FakeResponse(headers={"X-RateLimit-Limit": str(limit), "X-RateLimit-Remaining": str(remaining),
+                                 "X-RateLimit-Reset": str(time.time() + reset_in)})
+
+
+def test_burst_is_not_paced(sleeps):
+    limiter = rate_limiter.RateLimiter(burst=3)
+    limiter.update(budget(remaining=100, reset_in=100))
+
+    assert [limiter.acquire() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert sleeps == []
+
+
+def test_requests_over_burst_are_spread_until_reset(sleeps):
+    limiter = rate_limiter.RateLimiter(burst=1)
+    limiter.update(budget(remaining=10, reset_in=10))
+
+    assert limiter.acquire() == 0.0
+    wait = limiter.acquire()
+    # the second request has taken its token from 8 requests left for 10 seconds
+    assert wait == pytest.approx(10 / 8.0, rel=0.01)
+    assert sleeps == [wait]
+    assert limiter.total_wait == wait
+
+
+def test_exhausted_budget_waits_for_reset(sleeps):
+    limiter = rate_limiter.RateLimiter(burst=10)
+    limiter.update(budget(remaining=0, reset_in=30))
+
+    assert 29 < limiter.acquire() <= 30
+
+
+def test_rejected_response_is_repeated_after_reset(sleeps):
+    limiter = rate_limiter.RateLimiter()
+    response = budget(remaining=0, reset_in=20)
+    response.status_code = 403
+
+    assert limiter.update(response) is True
+    assert limiter.acquire() > 19
+
+
+def test_secondary_rate_limit_honors_retry_after(sleeps):
+    limiter = rate_limiter.RateLimiter()
+    assert limiter.update(FakeResponse(429, {"Retry-After": "5", "X-RateLimit-Remaining": "100"})) is True
+    assert 4 < limiter.acquire() <= 5
+
+
+def test_secondary_rate_limit_without_retry_after_backs_off(sleeps):
+    limiter = rate_limiter.RateLimiter(backoff=60)
+    for wait in (60, 120, 240):
+        assert limiter.update(FakeResponse(429, {"X-RateLimit-Remaining": "100"})) is True
+        assert wait - 1 < limiter.acquire() <= wait
+
+    # backoff starts over after an accepted response
+    assert limiter.update(FakeResponse(200, {"X-RateLimit-Remaining": "100"})) is False
+    assert limiter.update(FakeResponse(429, {"X-RateLimit-Remaining": "100"})) is True
+    assert 59 < limiter.acquire() <= 60
+
+
+def test_rate_limit_retries_are_configured(tmp_path, monkeypatch, sleeps, fake_github):
+    monkeypatch.chdir(tmp_path)
+    _, api_url = fake_github()
+    paths = write_crawl_configs(tmp_path, api_url, [], request_params={"rate_limit_retries": 1})
+    walker = github_walker.GitHubWalker(None, loader=paths["loader"], connections=paths["connections"])
+    requests = []
+    monkeypatch.setattr(walker.request_session, "get", lambda url, **args: requests.append(url) or
+                        FakeResponse(429, {"X-RateLimit-Remaining": "100"}))
+
+    assert walker._get_response(api_url + "/repos/o/a") is None
+    assert len(requests) == 2
+
+
+def test_successful_response_is_not_repeated():
+    limiter = rate_limiter.RateLimiter()
+    assert limiter.update(budget(remaining=10, reset_in=10)) is False
+    assert limiter.remaining == 10
+
+
+def test_disabled_limiter_does_not_wait(sleeps):
+    limiter = rate_limiter.RateLimiter(enabled=False)
+    limiter.update(budget(remaining=0, reset_in=60))
+
+    assert limiter.acquire() == 0.0
+    assert sleeps == []
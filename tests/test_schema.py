@@ -0,0 +1,97 @@
+import pytest
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.dialects import oracle, sqlite
+from sqlalchemy.schema import CreateTable
+import dto_requests_objects as dto
+import id_index
+import schema
+
+
+# tables of a database created before secondary indexes and service tables, merge_commit_sha was added later
+LEGACY_TABLES = [
+    "CREATE TABLE git_user (id INTEGER PRIMARY KEY, login VARCHAR(200) NOT NULL, user_url VARCHAR(2000), "
+    "user_type VARCHAR(20))",
+    "CREATE TABLE git_repository (id INTEGER PRIMARY KEY, full_name VARCHAR(200) NOT NULL, private INTEGER, "
+    "repository_url VARCHAR(500) NOT NULL, description VARCHAR(1000), owner_id INTEGER REFERENCES git_user (id))",
+    "CREATE TABLE git_pullrequest (id INTEGER PRIMARY KEY, pull_number INTEGER NOT NULL, url VARCHAR(2000) NOT NULL, "
+    "state VARCHAR(20), title VARCHAR(2000), created_at DATETIME, updated_at DATETIME, merged_at DATETIME, "
+    "closed_at DATETIME, user_id INTEGER REFERENCES git_user (id), "
+    "repository_id INTEGER REFERENCES git_repository (id))",
+    "CREATE TABLE git_pullrequest_file (pull_id INTEGER NOT NULL REFERENCES git_pullrequest (id), "
+    "filename VARCHAR(2000) NOT NULL, sha VARCHAR(100), status VARCHAR(20), additions INTEGER, deletions INTEGER, "
+    "changes INTEGER, contents_url VARCHAR(2000) NOT NULL, PRIMARY KEY (pull_id, filename))",
+]
+
+
+@pytest.fixture
+def legacy_engine(tmp_path):
+    engine = create_engine("sqlite:///" + str(tmp_path / "legacy.db"))
+    for statement in LEGACY_TABLES:
+        engine.execute(statement)
+    engine.execute("INSERT INTO git_repository (id, full_name, repository_url) VALUES (1, 'o/a', 'u')")
+    engine.execute("INSERT INTO git_pullrequest (id, pull_number, url, repository_id, created_at) "
+                   "VALUES (10, 1, 'u', 1, '2020-01-01 00:00:00.000000')")
+    engine.execute("INSERT INTO git_pullrequest_file VALUES (10, 'src/a.py', 's', 'modified', 1, 2, 3, "
+                   "'https://api.github.com/repos/o/a/contents/src/a.py?ref=abc')")
+    engine.execute("INSERT INTO git_pullrequest_file VALUES (10, 'src/a b#1.py', 's', 'added', 1, 0, 1, "
+                   "'https://api.github.com/repos/o/a/contents/src/a%20b%231.py?ref=abc')")
+    yield engine
+    engine.dispose()
+
+
+def test_migrate_brings_legacy_database_to_metadata(legacy_engine):
+    changes = schema.migrate(legacy_engine)
+
+    inspector = inspect(legacy_engine)
+    for table in dto.Base.metadata.sorted_tables:
+        assert set(c["name"] for c in inspector.get_columns(table.name)) == set(c.name for c in table.columns)
+        assert set(i["name"] for i in inspector.get_indexes(table.name)) >= set(i.name for i in table.indexes)
+    assert "git_pullrequest.merge_commit_sha" in changes and "ix_git_pullrequest_repo_id" in changes
+    assert "git_crawl_checkpoint" in changes and "git_pullrequest" not in changes
+    assert legacy_engine.execute("SELECT id, url, head_sha FROM git_pullrequest").fetchall() == [(10, "u", "abc")]
+    # file names are moved to git_file_path, the view gives rows of the legacy table, paths are percent-encoded
+    assert "git_pullrequest_file_legacy (2 rows moved to git_pull_file)" in changes
+    assert sorted(legacy_engine.execute("SELECT id, repository_id, filename FROM git_file_path").fetchall()) == \
+        sorted((id_index.path_id(1, name), 1, name) for name in ("src/a.py", "src/a b#1.py"))
+    assert sorted(legacy_engine.execute("SELECT * FROM git_pullrequest_file").fetchall()) == \
+        sorted(legacy_engine.execute("SELECT * FROM git_pullrequest_file_legacy").fetchall())
+    # nothing is left to migrate on the next start
+    assert schema.migrate(legacy_engine) == []
+
+
+def test_pulls_without_created_at_are_reported(legacy_engine, caplog):
+    # created_at of existing tables is not altered to NOT NULL, partitioning by it fails on such rows
+    legacy_engine.execute("INSERT INTO git_pullrequest (id, pull_number, url, repository_id) VALUES (11, 2, 'u', 1)")
+    schema.migrate(legacy_engine, oracle_partitioning=True)
+
+    assert schema.check_not_null(legacy_engine, dto.GitPullRequest.__table__, "created_at") == 1
+    assert [r for r in caplog.records if r.getMessage().startswith("Pull requests without created_at: 1,")]
+
+
+@pytest.fixture
+def oracle_partitioning():
+    schema.enable_oracle_partitioning()
+    yield
+    for table in schema.ORACLE_PARTITIONS:
+        table.info.pop("oracle_partition_by", None)
+
+
+def ddl(cls, dialect):
+    return str(CreateTable(cls.__table__).compile(dialect=dialect)).strip()
+
+
+def test_oracle_tables_are_partitioned(oracle_partitioning):
+    pulls = ddl(dto.GitPullRequest, oracle.dialect())
+    files = ddl(dto.PullRequestFile, oracle.dialect())
+
+    assert "created_at DATE NOT NULL" in pulls
+    assert pulls.endswith(")\nPARTITION BY RANGE (created_at) INTERVAL (NUMTOYMINTERVAL(1, 'YEAR')) "
+                          "(PARTITION p_before_2008 VALUES LESS THAN (DATE '2008-01-01'))")
+    # reference partitioning needs the named foreign key of the files table
+    assert "CONSTRAINT fk_git_pull_file_pull FOREIGN KEY(pull_id) REFERENCES git_pullrequest (id)" in files
+    assert files.endswith(")\nPARTITION BY REFERENCE (fk_git_pull_file_pull)")
+    assert "PARTITION" not in ddl(dto.GitPullRequest, sqlite.dialect())
+
+
+def test_tables_are_not_partitioned_by_default():
+    assert "PARTITION" not in ddl(dto.GitPullRequest, oracle.dialect())
@@ -0,0 +1,136 @@
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine
+import dto_requests_objects as dto
+import github_walker
+import schema
+import sharded_crawl
+from tests.conftest import write_crawl_configs
+
+
+# database of the sharded crawl test, worker processes are forked after it is set
+DATABASE_PATH = None
+
+
+def get_engine():
+    return create_engine("sqlite:///" + DATABASE_PATH, connect_args={"timeout": 30})
+
+
+class FailingWalker:
+    """Walker whose pulls walk of o/a always stops at a failed page."""
+
+    def __init__(self, session, **args):
+        self.repository_list = []
+        self.failed_repositories = set()
+
+    def repository_walk(self):
+        return len(self.repository_list)
+
+    def pull_requests_walk(self):
+        self.failed_repositories = set(r for r in self.repository_list if r == "o/a")
+        return 0
+
+
+def test_repository_is_claimed_once(engine):
+    queue = sharded_crawl.CrawlQueue(engine)
+    queue.enqueue(["o/a", "o/b"])
+
+    claimed = {queue.claim("w1"), queue.claim("w2")}
+    assert claimed == {"o/a", "o/b"}
+    assert queue.claim("w3") is None
+
+
+def test_failed_repository_is_claimed_until_attempts_are_over(engine):
+    queue = sharded_crawl.CrawlQueue(engine, max_attempts=2)
+    queue.enqueue(["o/a"])
+
+    assert queue.claim("w1") == "o/a"
+    queue.complete("w1", "o/a", False)
+    assert queue.claim("w2") == "o/a"
+    queue.complete("w2", "o/a", False)
+    assert queue.claim("w3") is None
+
+
+def test_expired_lease_is_claimed_by_another_worker(engine):
+    queue = sharded_crawl.CrawlQueue(engine, lease_seconds=60)
+    queue.enqueue(["o/a"])
+    assert queue.claim("w1") == "o/a"
+    assert queue.claim("w2") is None
+
+    # w1 crashed and stopped its heartbeat
+    table = dto.GitCrawlQueue.__table__
+    engine.execute(table.update().values(heartbeat_at=datetime.utcnow() - timedelta(seconds=120)))
+    assert queue.claim("w2") == "o/a"
+
+
+def test_finished_run_is_enqueued_again(engine):
+    queue = sharded_crawl.CrawlQueue(engine)
+    queue.enqueue(["o/a"])
+    queue.claim("w1")
+    queue.complete("w1", "o/a", True)
+
+    queue.enqueue(["o/a"])
+    assert queue.claim("w1") == "o/a"
+
+
+def test_workers_share_users_of_repositories(tmp_path, monkeypatch, capfd, fake_github):
+    global DATABASE_PATH
+    monkeypatch.chdir(tmp_path)
+    DATABASE_PATH = str(tmp_path / "sharded.db")
+    schema.migrate(get_engine())
+
+    # authors of pulls are the same 97 users in every repository
+    api, api_url = fake_github(pulls=150, files_per_pull=2)
+    repositories = ["benchmark/repo%d" % i for i in range(4)]
+    paths = write_crawl_configs(tmp_path, api_url, repositories, write_batch_size=50)
+
+    crawled = sharded_crawl.run(get_engine, github_walker.GitHubWalker, repositories, ["a", "b"], workers=2,
+                                loader=paths["loader"], connections=paths["connections"])
+
+    assert crawled == 4
+    engine = get_engine()
+    assert engine.execute("select count(*) from git_user").scalar() == 97 + 1
+    assert engine.execute("select count(*) from git_pullrequest").scalar() == 4 * 150
+    assert engine.execute("select count(*) from git_pullrequest where user_id is null").scalar() == 0
+    assert engine.execute("select count(*) from git_crawl_queue where status <> 'done'").scalar() == 0
+    assert "Value was not loaded" not in capfd.readouterr().err
+
+
+def test_failed_walk_leaves_repository_claimable(tmp_path):
+    global DATABASE_PATH
+    DATABASE_PATH = str(tmp_path / "failing.db")
+    engine = get_engine()
+    schema.migrate(engine)
+    sharded_crawl.CrawlQueue(engine).enqueue(["o/a", "o/b"])
+
+    # o/a is claimed again until its attempts are over
+    assert sharded_crawl.crawl_worker(get_engine, FailingWalker, "a", 900, {}) == 1
+    assert engine.execute("select repository, status, attempts from git_crawl_queue order by repository").fetchall() \
+        == [("o/a", "failed", 3), ("o/b", "done", 1)]
+
+
+def test_workers_do_not_share_tokens(tmp_path, monkeypatch):
+    global DATABASE_PATH
+    DATABASE_PATH = str(tmp_path / "tokens.db")
+    pools, tokens = [], []
+
+    class Pool:
+        def __init__(self, max_workers):
+            pools.append(max_workers)
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            pass
+
+        def submit(self, worker, get_engine, walker_cls, token, *args):
+            tokens.append(token)
+            future = Future()
+            future.set_result(0)
+            return future
+
+    monkeypatch.setattr(sharded_crawl, "ProcessPoolExecutor", Pool)
+    sharded_crawl.run(get_engine, FailingWalker, ["o/a"], ["a", "b"], workers=4)
+
+    assert pools == [2] and tokens == ["a", "b"]
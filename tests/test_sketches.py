@@ -0,0 +1,62 @@
+import random
+import numpy as np
+import sketches
+
+
+def stream(seed, size):
+    # Zipf-like frequencies: item i is drawn with weight 1 / (i + 1)
+    generator = random.Random(seed)
+    return generator.choices(["file%d" % i for i in range(500)], [1.0 / (i + 1) for i in range(500)], k=size)
+
+
+def test_space_saving_merge_keeps_heavy_hitters():
+    left, right = stream(1, 20000), stream(2, 20000)
+    merged = sketches.SpaceSaving(50)
+    merged.update_counts({item: left.count(item) for item in set(left)})
+    other = sketches.SpaceSaving(50)
+    for item in right:
+        other.update(item)
+    merged.merge(other)
+
+    exact = {}
+    for item in left + right:
+        exact[item] = exact.get(item, 0) + 1
+    top = merged.top(3)
+
+    assert [item for item, _, _ in top] == sorted(exact, key=exact.get, reverse=True)[:3]
+    for item, count, error in top:
+        # counts are overestimated, by at most the error of the counter
+        assert count - error <= exact[item] <= count
+    assert len(merged.counters) <= 50
+
+
+def test_space_saving_round_trip():
+    sketch = sketches.SpaceSaving(10)
+    sketch.update_counts({"a": 5, "b": 2})
+    restored = sketches.SpaceSaving.from_dict(sketch.to_dict())
+    assert restored.top(2) == [("a", 5, 0), ("b", 2, 0)]
+
+
+def test_kll_merge_has_bounded_rank_error():
+    generator = np.random.RandomState(7)
+    values = generator.exponential(3600.0, 40000)
+    parts = [sketches.KLLSketch(k=200, seed=i) for i in range(4)]
+    for part, chunk in zip(parts, np.array_split(values, 4)):
+        part.update_many(chunk)
+    merged = parts[0]
+    for part in parts[1:]:
+        merged.merge(part)
+
+    assert merged.n == len(values)
+    ordered = np.sort(values)
+    for q in (0.1, 0.5, 0.9, 0.99):
+        rank = np.searchsorted(ordered, merged.quantile(q)) / float(len(values))
+        assert abs(rank - q) < 0.02
+
+
+def test_kll_memory_does_not_grow_with_values():
+    sketch = sketches.KLLSketch(k=100, seed=1)
+    sketch.update_many(range(100000))
+    assert sketch._size() < 400
+    restored = sketches.KLLSketch.from_dict(sketch.to_dict())
+    assert restored.quantile(0.5) == sketch.quantile(0.5)
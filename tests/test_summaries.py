@@ -0,0 +1,92 @@
+from datetime import datetime
+from sqlalchemy.orm import sessionmaker
+import dto_requests_objects as dto
+import github_loader
+import github_walker
+import id_index
+import summaries
+from tests.conftest import write_crawl_configs
+
+
+def summary_rows(engine):
+    merge = sorted(tuple(r) for r in engine.execute(dto.GitMergeTimeSummary.__table__.select()))
+    files = sorted(tuple(r) for r in engine.execute(dto.GitFileChangeSummary.__table__.select()))
+    return merge, files
+
+
+def test_rebuild_counts_merged_pulls_and_their_files(engine):
+    engine.execute(dto.GitRepository.__table__.insert(), [{"id": 1, "full_name": "o/a", "repository_url": "u"},
+                                                          {"id": 2, "full_name": "o/b", "repository_url": "u"}])
+    created = datetime(2020, 1, 1)
+    engine.execute(dto.GitPullRequest.__table__.insert(), [
+        {"id": 10, "pull_number": 1, "url": "u", "repository_id": 1, "created_at": created,
+         "merged_at": datetime(2020, 1, 1, 1)},
+        {"id": 11, "pull_number": 2, "url": "u", "repository_id": 1, "created_at": created,
+         "merged_at": datetime(2020, 1, 1, 3)},
+        {"id": 12, "pull_number": 3, "url": "u", "repository_id": 1, "created_at": created, "merged_at": None},
+        {"id": 20, "pull_number": 1, "url": "u", "repository_id": 2, "created_at": created,
+         "merged_at": datetime(2020, 1, 2)}])
+    paths = {(r, f): id_index.path_id(r, f) for r, f in ((1, "a.py"), (1, "b.py"), (2, "a.py"))}
+    engine.execute(dto.GitFilePath.__table__.insert(),
+                   [{"id": p, "repository_id": r, "filename": f} for (r, f), p in paths.items()])
+    engine.execute(dto.PullRequestFile.__table__.insert(), [
+        {"pull_id": 10, "path_id": paths[(1, "a.py")]}, {"pull_id": 11, "path_id": paths[(1, "a.py")]},
+        {"pull_id": 11, "path_id": paths[(1, "b.py")]}, {"pull_id": 12, "path_id": paths[(1, "b.py")]},
+        {"pull_id": 20, "path_id": paths[(2, "a.py")]}])
+
+    session = sessionmaker(bind=engine)()
+    summaries.rebuild(session)
+    session.close()
+
+    assert summary_rows(engine) == ([(1, 2, 4 * 3600, 3600, 3 * 3600), (2, 1, 86400, 86400, 86400)],
+                                    [(1, "a.py", 2), (1, "b.py", 1), (2, "a.py", 1)])
+
+
+def test_summaries_maintained_by_crawl_equal_rebuild(tmp_path, monkeypatch, engine, fake_github):
+    monkeypatch.chdir(tmp_path)
+    api, api_url = fake_github(pulls=120, files_per_pull=3)
+    paths = write_crawl_configs(tmp_path, api_url, ["benchmark/repo0", "benchmark/repo1"], batch_size=25)
+    session = sessionmaker(bind=engine)()
+    walker = github_walker.GitHubWalker(session, loader=paths["loader"], connections=paths["connections"])
+    walker.repository_walk()
+    walker.pull_requests_walk()
+
+    maintained = summary_rows(engine)
+    summaries.rebuild(session)
+    session.close()
+
+    assert maintained[0] and maintained[1]
+    assert maintained == summary_rows(engine)
+
+
+def test_rows_not_written_are_not_counted(engine):
+    engine.execute("CREATE TRIGGER reject_pull BEFORE INSERT ON git_pullrequest WHEN NEW.title = 'bad' "
+                   "BEGIN SELECT RAISE(ABORT, 'rejected'); END")
+    engine.execute("CREATE TRIGGER reject_file BEFORE INSERT ON git_pull_file WHEN NEW.sha = 'bad' "
+                   "BEGIN SELECT RAISE(ABORT, 'rejected'); END")
+    session = sessionmaker(bind=engine)()
+    loader = github_loader.GitHubLoader(session)
+
+    def pull(pull_id, title):
+        return {"id": pull_id, "pull_number": pull_id, "url": "u", "title": title, "user_id": 1, "repository_id": 1,
+                "created_at": datetime(2020, 1, 1), "merged_at": datetime(2020, 1, 1, pull_id)}
+
+    def files(pull_id, sha):
+        return [{"pull_id": pull_id, "repository_id": 1, "filename": "a.py", "sha": sha, "status": "modified",
+                 "additions": 1, "deletions": 0, "changes": 1}]
+
+    loader.add_pull_request(pull(1, "good"))
+    loader.add_pull_request_files(files(1, "bad"))
+    loader.add_pull_request(pull(2, "bad"))
+    loader.flush()
+    assert summary_rows(engine) == ([(1, 1, 3600, 3600, 3600)], [])
+
+    # forgotten rows are counted when they are loaded again
+    engine.execute("DROP TRIGGER reject_pull")
+    engine.execute("DROP TRIGGER reject_file")
+    loader.add_pull_request(pull(2, "good"))
+    loader.add_pull_request_files(files(1, "good") + files(2, "good"))
+    loader.flush()
+    session.close()
+
+    assert summary_rows(engine) == ([(1, 2, 3 * 3600, 3600, 2 * 3600)], [(1, "a.py", 2)])
@@ -0,0 +1,54 @@
+from datetime import datetime
+import dto_requests_objects as dto
+import upsert
+
+
+def pull(pull_id, state, updated_at, title="title"):
+    row = {c.name: None for c in dto.GitPullRequest.__table__.columns}
+    row.update({"id": pull_id, "pull_number": pull_id, "url": "u", "state": state, "title": title,
+                "created_at": datetime(2020, 1, 1), "updated_at": updated_at})
+    return row
+
+
+def states(engine):
+    table = dto.GitPullRequest.__table__
+    return {r["id"]: (r["state"], r["updated_at"]) for r in engine.execute(table.select())}
+
+
+def test_rows_are_updated_when_condition_holds(engine):
+    table = dto.GitPullRequest.__table__
+    statement = upsert.upsert_statement("sqlite", table, ["id"], {"state": "{new}.state",
+                                                                  "updated_at": "{new}.updated_at"},
+                                        "{new}.updated_at > {old}.updated_at")
+    engine.execute(statement, [pull(1, "open", datetime(2020, 1, 2)), pull(2, "open", datetime(2020, 1, 2))])
+    # newer state replaces the row, an older one is ignored
+    engine.execute(statement, [pull(1, "closed", datetime(2020, 1, 3)), pull(2, "closed", datetime(2020, 1, 1)),
+                               pull(3, "open", datetime(2020, 1, 1))])
+
+    assert states(engine) == {1: ("closed", datetime(2020, 1, 3)), 2: ("open", datetime(2020, 1, 2)),
+                              3: ("open", datetime(2020, 1, 1))}
+
+
+def test_empty_update_set_inserts_missing_rows_only(engine):
+    table = dto.GitUser.__table__
+    statement = upsert.upsert_statement("sqlite", table, ["id"], {})
+    engine.execute(statement, [{"id": 1, "login": "a", "user_url": "u", "user_type": "User"}])
+    engine.execute(statement, [{"id": 1, "login": "b", "user_url": "u", "user_type": "User"},
+                               {"id": 2, "login": "c", "user_url": "u", "user_type": "User"}])
+
+    assert sorted(tuple(r) for r in engine.execute("select id, login from git_user")) == [(1, "a"), (2, "c")]
+
+
+def test_oracle_statement_is_merge():
+    table = dto.GitUser.__table__
+    sql = str(upsert.upsert_statement("oracle", table, ["id"], {"login": "{new}.login"}, "{old}.login IS NULL"))
+
+    assert sql.startswith("MERGE INTO git_user t USING (SELECT :id AS id")
+    assert "ON (t.id = s.id) WHEN MATCHED THEN UPDATE SET t.login = s.login WHERE t.login IS NULL" in sql
+    assert sql.endswith("WHEN NOT MATCHED THEN INSERT (id, login, user_url, user_type) "
+                        "VALUES (s.id, s.login, s.user_url, s.user_type)")
+
+
+def test_oracle_insert_if_missing_has_no_update():
+    sql = str(upsert.upsert_statement("oracle", dto.GitUser.__table__, ["id"], {}))
+    assert "WHEN MATCHED" not in sql and "WHEN NOT MATCHED" in sql